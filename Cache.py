@@ -0,0 +1,196 @@
+import os
+import time
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from Filler import Binned
+
+#default location of the histogram cache
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "HEP_Plotter")
+#age in seconds after which a .tmp file is taken as left by a killed writer
+STALE_TMP = 3600
+
+
+class HistoCache:
+    """
+        Persistent cache of filled histograms on disk. Each histogram is stored as a small .npz file (see Binned.toArrays)
+        named after a hash of: file path, size and modification time, tree, branch and everything that changes the
+        content (n_ev, binning, range, ...). Styles are not part of the key: they are applied after the histograms
+        are served back. When the directory grows above max_size the least recently used entries are removed.
+        Several processes can share the directory: an entry removed by one of them is a cache miss for the others.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size=1024**3):
+        """
+            directory: where the histograms are written. By default ~/.cache/HEP_Plotter
+            max_size: size cap of the directory in bytes. By default 1 GB
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, tree, branch, **spec):
+        """
+            Return the key of a histogram or None if the file cannot be identified (remote files).
+            Arguments:
+            path, tree, branch: where the values come from
+            spec: all the parameters defining the content such as n_ev=, bins=, range=
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        ident = [os.path.abspath(path), st.st_size, st.st_mtime_ns, tree, branch, spec]
+        return hashlib.sha1(json.dumps(ident, sort_keys=True, default=float).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """
+            Return the cached Binned or None
+        """
+        if key is None: return None
+        f = self._file(key)
+        try:
+            with np.load(f) as arrays:
+                binned = Binned.fromArrays(arrays)
+            os.utime(f) #most recently used
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return binned
+
+    def put(self, key, binned):
+        """
+            Store a Binned. Call evict() once after many put to respect the size cap
+        """
+        if key is None: return
+        tmp = self._file(key) + ".{}.tmp".format(os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, **binned.toArrays())
+        os.replace(tmp, self._file(key)) #atomic, concurrent jobs never read half written files
+
+    def _entries(self, suffix=".npz"):
+        """
+            (mtime, size, path) of the files ending with suffix, skipping the ones removed meanwhile by other processes
+        """
+        entries = []
+        for e in os.scandir(self.directory):
+            if not e.name.endswith(suffix): continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+            Remove the least recently used histograms until the cache is below max_size, and the .tmp files older
+            than STALE_TMP seconds left by killed writers
+        """
+        stale = time.time() - STALE_TMP
+        for mtime, _, path in self._entries(".tmp"):
+            if mtime < stale: _remove(path)
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size: break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        """
+            Remove all the cached histograms
+        """
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".npz"): _remove(e.path)
+
+
+def _remove(path):
+    """
+        Remove path, already removed by another process is fine
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def getCache(cache):
+    """
+        Return a HistoCache from the cache argument of the filling methods: False/None (no cache), True (default
+        directory), a directory path or a HistoCache
+    """
+    if cache is None or cache is False: return None
+    if cache is True: return HistoCache()
+    if isinstance(cache, str): return HistoCache(cache)
+
+    return cache
+
+
+class ColumnCache:
+    """
+        Values of the branches read while filling, kept to bin them again (new binning, new range) without reading
+        the files. Arrays are kept in memory up to budget bytes: beyond that the least recently used are written
+        to spill as .npy files and memory-mapped back, or dropped if spill is None.
+    """
+
+    def __init__(self, budget=512*1024**2, spill=None):
+        """
+            budget: bytes of arrays kept in memory. By default 512 MB
+            spill: directory for the .npy files of the arrays beyond budget. By default None, arrays are dropped
+        """
+        self.budget = budget
+        self.spill = spill
+        self.arrays = OrderedDict() #in memory, least recently used first
+        self.mapped = {} #memory-mapped from spill
+        if spill is not None: os.makedirs(spill, exist_ok=True)
+
+    def key(self, path, tree, n_ev, branch, selection=None, weights=None, what='values'):
+        """
+            Key of the values of a branch (what='values') or of their weights (what='weights')
+        """
+        return (os.path.abspath(path), tree, n_ev, branch, selection, weights, what)
+
+    def __contains__(self, key):
+        return key in self.arrays or key in self.mapped
+
+    def nbytes(self):
+        """
+            Bytes held in memory (memory-mapped arrays excluded)
+        """
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def put(self, key, array):
+        self.mapped.pop(key, None)
+        self.arrays[key] = array
+        self.arrays.move_to_end(key)
+        self._evict()
+
+    def get(self, key):
+        """
+            Return the array or None
+        """
+        if key in self.arrays:
+            self.arrays.move_to_end(key)
+            return self.arrays[key]
+
+        return self.mapped.get(key)
+
+    def _evict(self):
+        total = self.nbytes()
+        while total > self.budget and len(self.arrays):
+            key, array = self.arrays.popitem(last=False)
+            total -= array.nbytes
+            if self.spill is not None:
+                f = os.path.join(self.spill, hashlib.sha1(repr(key).encode()).hexdigest() + ".npy")
+                np.save(f, array)
+                self.mapped[key] = np.load(f, mmap_mode='r')
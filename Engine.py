@@ -1,18 +1,179 @@
-import ROOT
-import pandas as pd 
 import numpy as np 
 import sys
-import matplotlib.pyplot as plt
 import math as mt
 from array import array
+from Reader import branchNames
+from Filler import Binned, valueRange, addContents, bulkFill, fillFiles, fillFilesND, fillFilesPairs, fillFilesVariations, efficiencyInterval, axisEdges
+from Cache import getCache, ColumnCache
+from Store import saveCollections, loadCollections, HistoArrays, CompactCollection, compactTH1, compactable
+from Lazy import ROOT, kBlack, isSeries
+
+
+def _styledTH1F(name, binned, fillcolor, fillstyle, linecolor, linestyle):
+    """
+        Build the TH1F of a collection from a Filler.Binned
+    """
+    h = binned.toTH1F(name)
+    h.SetDirectory(0) #owned by the collection, not by the current ROOT directory
+    h.SetFillStyle(fillstyle)
+    h.SetFillColor(fillcolor)
+    h.SetLineColor(linecolor)
+    h.SetLineStyle(linestyle)
+    return h
+
+
+def _compactCollection(prefix, binned, branches, fillcolor, fillstyle, linecolor, linestyle):
+    """
+        Build the CompactCollection of a collection from {branch: Filler.Binned}
+    """
+    styles = list(zip(fillcolor, fillstyle, linecolor, linestyle))
+    if all(binned[branch].values is None for branch in branches):
+        return CompactCollection(HistoArrays.fromBinned([binned[branch] for branch in branches], [prefix + branch for branch in branches], styles), branches)
+
+    parts = []
+    for branch, (fc, fs, lc, ls) in zip(branches, styles):
+        b = binned[branch]
+        if b.values is not None:
+            #no valid range, ROOT chooses it while filling the TH1F
+            h = _styledTH1F(prefix + branch, b, fc, fs, lc, ls)
+            h.SetDirectory(0)
+            parts.append(compactTH1(h))
+        else:
+            parts.append(HistoArrays.fromBinned([b], [prefix + branch], [(fc, fs, lc, ls)]))
+
+    return CompactCollection(HistoArrays.concatenate(parts), branches)
+
+
+def _detach(h_dict):
+    """
+        Detach the histograms of a collection from the current ROOT directory: they belong to the collection only,
+        so histograms with the same name in different collections do not replace each other
+    """
+    if isinstance(h_dict, (LazyCollection, CompactCollection)): return #their histograms are created detached
+    for h in h_dict.values():
+        if hasattr(h, "SetDirectory"): h.SetDirectory(0)
+
+
+def _prefetch(h_dict):
+    """
+        Fill in one read all the pending histograms of a LazyCollection before some of them are used: they share the file
+    """
+    if isinstance(h_dict, LazyCollection):
+        h_dict.materialize()
+
+
+class LazyCollection(dict):
+    """
+        Collection {branch: TH1F} created by fillROOT(lazy=True). It knows all its keys but remembers only how to fill
+        the histograms: nothing is read until a histogram is accessed (h_dict[branch], get, values, items), then all the
+        pending histograms of the collection are filled together in one read of the file, so that iterating the
+        collection does not read the file once per branch. Pending histograms are shown as <lazy>.
+    """
+
+    def __init__(self, path, tree, n_ev, prefix, specs, options, selection=None, weights=None):
+        """
+            path, tree, n_ev: file, tree and number of events to read
+            prefix: prefix of the TH1F names
+            specs: {branch: (bins, range, fillcolor, fillstyle, linecolor, linestyle)}
+            options: keyword arguments of Filler.fillFiles
+            selection, weights: selection and weight expressions, see Reader.readBranches
+        """
+        dict.__init__(self, ((branch, None) for branch in specs))
+        self.path = path
+        self.tree = tree
+        self.n_ev = n_ev
+        self.selection = selection
+        self.weights = weights
+        self.prefix = prefix
+        self.pending = dict(specs)
+        self.options = options
+
+    def materialize(self, branches=None):
+        """
+            Fill the pending histograms in branches (all of them if None) with a single read of the file
+        """
+        if branches is None: branches = list(self.pending)
+        todo = [branch for branch in dict.fromkeys(branches) if branch in self.pending]
+        if not len(todo): return
+
+        bins_ = [self.pending[branch][0] for branch in todo]
+        ranges_ = [self.pending[branch][1] for branch in todo]
+        binned = fillFiles([(self.path, self.tree, self.n_ev, todo, bins_, ranges_, self.selection, self.weights)], **self.options)[0]
+
+        for branch in todo:
+            _, _, fc, fs, lc, ls = self.pending.pop(branch)
+            dict.__setitem__(self, branch, _styledTH1F(self.prefix + branch, binned[branch], fc, fs, lc, ls))
+
+    def __getitem__(self, key):
+        if key in self.pending: self.materialize() #all the pending branches share the file: one read for all
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def pop(self, key, *default):
+        if key in self.pending: self.materialize()
+        return dict.pop(self, key, *default)
+
+    def __repr__(self):
+        return "{" + ", ".join("{!r}: {}".format(k, "<lazy>" if k in self.pending else repr(dict.__getitem__(self, k))) for k in self) + "}"
 
 
 class RootHisto:
 
     def __init__(self):
-        self.attributes = []
+        self.attributes = {} #registry of the collections: name -> {key: histogram}, in order of creation
         self.filepaths = []
         self.trees = []
+        self.sources = {} #collection name -> (path, tree, n_ev, selection, weights) filled by fillROOT
+        self.variations = {} #collection name -> {variation: collection name} filled by fillROOTVariations
+
+    def __getattr__(self, name):
+        """
+            Collections are reached as attributes: self.namehisto is self.attributes["namehisto"]
+        """
+        attributes = self.__dict__.get("attributes", {})
+        if name in attributes: return attributes[name]
+        raise AttributeError("'RootHisto' object has no attribute or collection '{}'".format(name))
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__.get("attributes", ()):
+            self._setColl(name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if name in self.__dict__.get("attributes", ()):
+            del self.attributes[name]
+        else:
+            object.__delattr__(self, name)
+
+    def _reserve(self, name):
+        """
+            Register the name of a new collection, exit if already taken
+        """
+        if name in self.attributes:
+            sys.exit("[ERROR] name of collection {} already in class, change name_of".format(name))
+        self.attributes[name] = {}
+
+    def _setColl(self, name, h_dict):
+        """
+            Store a collection in the registry, its histograms detached from ROOT directories
+        """
+        _detach(h_dict)
+        self.attributes[name] = h_dict
 
     def rangeDefiner(self, rangedict = {"pt": [0, 400], "eta": [-5,5], "phi":[-mt.pi, mt.pi], "btag":[-1,1]}):
         """
@@ -27,6 +188,18 @@ class RootHisto:
         """
         self.ranges = rangedict
 
+    def keepColumns(self, budget=512*1024**2, spill=None):
+        """
+            Keep the values of the branches read by fillROOT so that refillCollection can change binning and
+            range of the histograms without reading the files again.
+            Arguments:
+            budget: bytes of values kept in memory, least recently used branches beyond it are spilled or dropped.
+                    By default 512 MB
+            spill: directory where the values beyond budget are written as .npy and memory-mapped back.
+                    By default None, they are dropped
+        """
+        self.columns = ColumnCache(budget, spill)
+
     def clearRange(self):
         """
             Clear attribute self.ranges
@@ -38,53 +211,62 @@ class RootHisto:
         """
             Clear collection by name
         """
+        assert coll_name in self.attributes, "[ERROR] {} not in attributes".format(coll_name)
+        del self.attributes[coll_name]
+        self.sources.pop(coll_name, None)
 
-        delattr(self, coll_name)
-
-    def addNewToColl(self, var, merge_on='namedhisto', to_merge = 'namedhisto', bins=30, linestyle=1, linecolor = ROOT.kBlack, fillcolor = 0, fillstyle = 0, ranges=False, markerstyle = 22, markercolor = ROOT.kBlack):
+    def addNewToColl(self, var, merge_on='namedhisto', to_merge = 'namedhisto', bins=30, linestyle=1, linecolor = kBlack, fillcolor = 0, fillstyle = 0, ranges=False, markerstyle = 22, markercolor = kBlack, weights=None):
         """
             Add single histogram to collection
             Arguments:
-            styles/bins: See fill method 
-            var: list/np.ndarray unidimensional with values to be histogrammed
+            styles/bins/weights: See fill method 
+            var: list/np.ndarray/pd.Series unidimensional with values to be histogrammed
             merge_on: Collection we want to append the new instance
             to_merge: Name of the key the object will have in self.merge_on attribute
 
         """
-        print(to_merge)
-        histo_coll = self.fill(var, name_of = to_merge, set_=False, bins=bins, linestyle=linestyle, linecolor=linecolor, fillcolor=fillcolor, fillstyle=fillstyle, ranges=ranges, markerstyle=markerstyle, markercolor=markercolor)
-        histo = histo_coll[to_merge]
-        coll_ = getattr(self, merge_on)
-        coll_[to_merge] = histo
-        setattr(self, merge_on, coll_)
+        assert merge_on in self.attributes, "[ERROR] {} not in attributes".format(merge_on)
+        print("@Filling: ", to_merge)
+        h = self._fillHisto(var, to_merge, bins, linestyle, linecolor, fillcolor, fillstyle, ranges, markerstyle, markercolor, weights)
+        h.SetDirectory(0)
+        self.attributes[merge_on][to_merge] = h
 
     def mergeColl(self, coll_names, merge_on='new_merged_coll', keep=False ):
         """
             Merging two collections into a single one. Pay attention to keys to avoid overwriting
             Arguments:
             coll_names: list/np.ndarray of attribute names to be searched in self.
-            merge_on: The name of the newly created merged collection
-            keep: Allows to keep originary collections or free them to save memory
+            merge_on: The name of the newly created merged collection. Can be one of coll_names
+            keep: Allows to keep originary collections or free them to save memory. If False the first collection
+                    is extended in place with the others, no histogram is copied
         """
         assert len(coll_names) >= 2, "[ERROR] not enough coll_names to merge"
-        
-        new_h_dict = {}
+        assert all([name in self.attributes for name in coll_names]), "[ERROR] given names not in attributes"
+        if merge_on in self.attributes and (keep or merge_on not in coll_names):
+            sys.exit("[ERROR] name of collection {} already in class, change merge_on".format(merge_on))
+
         for name in coll_names:
-            h_dict = getattr(self, name)
-            for key in h_dict.keys():
-                new_h_dict[key] = h_dict[key]
-            if not keep:
-                delattr(self, name) #free memory
+            _prefetch(self.attributes[name])
 
-        setattr(self, merge_on, new_h_dict)
+        if keep:
+            merged = {}
+            for name in coll_names:
+                merged.update(self.attributes[name].items())
+        else:
+            merged = self.attributes[coll_names[0]]
+            for name in coll_names[1:]:
+                merged.update(self.attributes[name].items())
+            for name in coll_names:
+                self.clearColl(name) #free memory
 
+        self._setColl(merge_on, merged)
 
 
-    def fill(self, val, name_of='namehisto', bins=30, linestyle=1, linecolor = ROOT.kBlack, fillcolor = 0, fillstyle = 0, ranges=False, markerstyle = 22, markercolor = ROOT.kBlack, set_=True ):
+    def fill(self, val, name_of='namehisto', bins=30, linestyle=1, linecolor = kBlack, fillcolor = 0, fillstyle = 0, ranges=False, markerstyle = 22, markercolor = kBlack, set_=True, weights=None ):
         """
             fill will fill named dictionaries starting from list/np.ndarrays.
             Arguments:
-            val: list/ np.ndarray of values
+            val: list/ np.ndarray/ pd.Series of values
             name_of: list [coll, key] or str [key, key]. This names will be the attributes names of the class. Avoid redefinitions to avoid 
                     overwriting. To access attributes like name_of='namehisto' just type self.namehisto. This objects
                     will be dictionaries of branches and relative histos like self.namehisto = {"branch_name": TH1F}
@@ -96,15 +278,10 @@ class RootHisto:
             fillstyle: same as above, fillstyle of TH1F
             ranges: list or nested list of ranges. Will be overrided if self.ranges is present (more specific)
             set_: Set this dictionary as attribute of the class. Default = False will return the dictionary created
+            weights: list/np.ndarray of weights pairwise with val. The histogram keeps the sum of squared weights (Sumw2)
+                    for the errors. By default None, unweighted
         """
 
-        assert isinstance(val, list) or isinstance(val, np.ndarray), "[ERROR] input argument is not a list/np.array"
-        if hasattr(self, "ranges") and ranges: 
-            print("[INFO]: Ranges from rangeDefiner will shadow input ranges")
-            ranges = False
-        else:
-            assert len(ranges)==2, "[ERROR] multiple ranges for single histo, check your inputs"
-
         if isinstance(name_of, list) or isinstance(name_of, np.ndarray):
             assert len(name_of) == 2, "[ERROR] name_of list contains too many elements"
             coll_name = name_of[0]
@@ -113,24 +290,40 @@ class RootHisto:
             coll_name = name_of
             histo_name = name_of
 
+        if set_: self._reserve(coll_name)
 
-        if coll_name in self.attributes:
-            sys.exit("[ERROR] name of collection already in class, change name_of")
+        namedhisto = {histo_name: self._fillHisto(val, histo_name, bins, linestyle, linecolor, fillcolor, fillstyle, ranges, markerstyle, markercolor, weights)}
+
+        if set_:
+            self._setColl(coll_name, namedhisto)
         else:
-            self.attributes.append(coll_name)
+            return namedhisto
 
-        namedhisto = {}
+    def _fillHisto(self, val, histo_name, bins, linestyle, linecolor, fillcolor, fillstyle, ranges, markerstyle, markercolor, weights):
+        """
+            Fill the TH1F of fill and addNewToColl, see fill for the arguments
+        """
+        if isSeries(val): val = val.to_numpy()
+        if isSeries(weights): weights = weights.to_numpy()
+        assert isinstance(val, list) or isinstance(val, np.ndarray), "[ERROR] input argument is not a list/np.array/pd.Series"
+        if weights is not None:
+            assert len(weights) == len(val), "[ERROR] weights and values have different dimensions"
+        if hasattr(self, "ranges") and ranges: 
+            print("[INFO]: Ranges from rangeDefiner will shadow input ranges")
+            ranges = False
+        else:
+            assert len(ranges)==2, "[ERROR] multiple ranges for single histo, check your inputs"
 
         if ranges == False:
             if hasattr(self, "ranges"):
                 for range_key in self.ranges.keys():
                     r = self.ranges[range_key]
             else:
-                r = [min(var), max(var)]
+                r = list(valueRange(val))
 
         else:
             if ranges == 'all':
-                r = [min(var), max(var)]
+                r = list(valueRange(val))
             else:
                 r = ranges
 
@@ -142,18 +335,12 @@ class RootHisto:
         h.SetLineStyle(linestyle)
         h.SetMarkerStyle(markerstyle)
         h.SetMarkerColor(markercolor)
-        for value in val:
-            h.Fill(value)
-        
-        namedhisto[histo_name] = h
+        bulkFill(h, val, weights)
 
-        if set_:
-            setattr(self, coll_name, namedhisto)
-        else:
-            return namedhisto
+        return h
 
 
-    def fillROOT(self, path, tree, n_ev, name_of='namehisto', branches='all',  bins = 30, linestyle=1, linecolor = ROOT.kBlack, fillcolor = 0, fillstyle = 0, ranges=False):
+    def fillROOT(self, path, tree, n_ev, name_of='namehisto', branches='all',  bins = 30, linestyle=1, linecolor = kBlack, fillcolor = 0, fillstyle = 0, ranges=False, workers=1, chunksize=None, autorange='exact', cache=False, lazy=False, selection=None, weights=None, backend=None, compact=False):
         """
             fillROOT will fill named dictionaries starting from .root files and trees.
             Arguments:
@@ -173,10 +360,34 @@ class RootHisto:
             fillcolor: same as above, fillcolor of TH1F
             fillstyle: same as above, fillstyle of TH1F
             ranges: list or nested list of ranges. Will be overrided if self.ranges is present (more specific)
+            workers: number of processes filling the files in parallel. By default 1, files are filled one after the other.
+                    Histograms are the same whatever the number of workers
+            chunksize: split the n_ev events of each file in entry ranges of chunksize events, filled separately (in parallel
+                    if workers > 1) and merged. By default None, each file is filled in one go
+            autorange: how ranges taken from the data are found. 'exact' (default) uses min and max of the full column,
+                    'stream' reads chunk after chunk with running min/max and a fine provisional histogram rebinned at the
+                    end (approximate, bounded memory), (low, high) as 'stream' with range on the quantiles low and high
+            cache: keep the filled histograms on disk (see Cache.HistoCache) and serve them back when the same file, tree,
+                    branch, n_ev, binning and range are asked again. True for the default directory, a directory path or a
+                    HistoCache. By default False
+            lazy: do not fill now. Collections are LazyCollection: each histogram is filled when it is first accessed,
+                    together with the other histograms asked at the same time (one read of the file). By default False
+            selection: str or list of str pairwise with path. C++ expression of the branches such as "pt > 30 && abs(eta) < 2.4"
+                    evaluated while reading: only passing events (or vector elements, when the expression is computed on
+                    vector branches) are histogrammed, see Reader.readBranches. By default None, no selection
+            weights: str or list of str pairwise with path. Branch or C++ expression such as "genWeight*puWeight" with the
+                    weight of each event, applied to every element of vector branches (per element weights are possible with
+                    expressions on vector branches). Histograms keep the sum of squared weights for the errors.
+                    By default None, unweighted
+            backend: 'root' or 'uproot', backend reading the files (see Reader.setBackend). By default the global one
+            compact: keep every collection as a Store.CompactCollection: contents and sumw2 of all the histograms in a few
+                    contiguous numpy arrays, TH1F built only when a histogram is accessed. For thousands of histograms,
+                    see save with a .hmap file to memory-map them back. By default False
         """
         
         assert len(path) == len(tree), "[ERROR] Dimension of root files and trees does not match"
         assert len(path) == len(name_of), "[ERROR] Dimension of names and files does not match"
+        assert not (lazy and compact), "[ERROR] lazy and compact collections cannot be combined"
 
         if hasattr(self, "ranges") and ranges: 
             print("[INFO]: Ranges from rangeDefiner will shadow input ranges")
@@ -195,7 +406,7 @@ class RootHisto:
         if not isinstance(bins, list):
             bins = [bins]*len(path)
         else:
-            assert len(bins_) == len(path), "[ERROR] Bins does not match dimension of path"
+            assert len(bins) == len(path), "[ERROR] Bins does not match dimension of path"
         
         if not isinstance(fillcolor, list):
             fillcolor = [fillcolor]*len(path)
@@ -222,32 +433,30 @@ class RootHisto:
         else:
             assert len(n_ev) == len(path), "[ERROR] Number of events does not match dimension of path"
 
-        for path_, tree_, n_ev_, name, branches_,  bins_, linestyle_, linecolor_, fillcolor_, fillstyle_, ranges_  in zip(path, tree, n_ev, name_of, branches,  bins, linestyle, linecolor, fillcolor, fillstyle, ranges):
+        if not isinstance(selection, list):
+            selection = [selection]*len(path)
+        else:
+            assert len(selection) == len(path), "[ERROR] Selection does not match dimension of path"
+
+        if not isinstance(weights, list):
+            weights = [weights]*len(path)
+        else:
+            assert len(weights) == len(path), "[ERROR] Weights does not match dimension of path"
+
+        jobs = []
+        for path_, tree_, n_ev_, name, branches_,  bins_, linestyle_, linecolor_, fillcolor_, fillstyle_, ranges_, selection_, weights_  in zip(path, tree, n_ev, name_of, branches,  bins, linestyle, linecolor, fillcolor, fillstyle, ranges, selection, weights):
             
-            if name in self.attributes:
-                sys.exit("[ERROR] name of collection already in class, change name_of")
-            else:
-                self.attributes.append(name)
+            self._reserve(name)
 
             self.filepaths.append(path_)
             self.trees.append(tree_)
-            namedhistos = {}
-
-            f = ROOT.TFile(path_)
-            t = f.Get(tree_)
-
-            filename = path_.split(".")[-2][1:] + "_" #will be added to TH1F name to avoid memory leaks
+            self.sources[name] = (path_, tree_, n_ev_, selection_, weights_)
 
             if branches_ == 'all':
-                branches_ = [i.GetName() for i in t.GetListOfBranches()] #branch names
-
-            if n_ev_ == 'all':
-                n_ev_ = t.GetEntries()
+                branches_ = branchNames(path_, tree_, backend) #branch names
 
-            f.Close()
-
-            if ranges_ and not self.ranges:
-                if len(ranges_) != len(branches_) and ranges_ != 'all':
+            if ranges_ and not hasattr(self, "ranges"):
+                if ranges_ != 'all' and len(ranges_) != len(branches_):
                     sys.exit("Number of ranges must be equal to number of variables being plotted")
 
             if not isinstance(linecolor_, list):
@@ -266,64 +475,354 @@ class RootHisto:
                 linestyle_ = [linestyle_]*len(branches_)
 
             if not isinstance(ranges_, list):
-                ranges = [ranges_]*len(branches_)
+                ranges_ = [ranges_]*len(branches_)
+
+            #ranges from rangeDefiner are resolved here, the jobs only know fixed ranges or 'all'
+            ranges_ = [self._branchRange(branch, r) for branch, r in zip(branches_, ranges_)]
+
+            jobs.append((name, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_, fillcolor_, fillstyle_, linecolor_, linestyle_))
 
-            idx = 0
+        options = {"workers": workers, "chunksize": chunksize, "autorange": autorange, "cache": getCache(cache), "columns": getattr(self, "columns", None), "backend": backend}
 
-            print("...Filling Named Histograms")
+        if lazy:
+            for name, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_, fillcolor_, fillstyle_, linecolor_, linestyle_ in jobs:
+                filename = path_.split(".")[-2][1:] + "_" #will be added to TH1F name to avoid memory leaks
+                specs = {branch: spec for branch, spec in zip(branches_, zip(bins_, ranges_, fillcolor_, fillstyle_, linecolor_, linestyle_))}
+                self._setColl(name, LazyCollection(path_, tree_, n_ev_, filename, specs, options, selection_, weights_))
+            return
 
-            for branch, fc, fs, lc, ls, b in zip(branches_, fillcolor_, fillstyle_, linecolor_, linestyle_, bins_):
-                f = ROOT.TFile(path_)
-                t = f.Get(tree_)
-                var = []
+        print("...Filling Named Histograms")
+
+        #files (and chunks of files) are read and binned in parallel if workers > 1, the TH1F are built here
+        filled = fillFiles([(path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_) for _, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_, _, _, _, _ in jobs], **options)
+
+        for (name, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_, fillcolor_, fillstyle_, linecolor_, linestyle_), binned in zip(jobs, filled):
+            namedhistos = {}
+            filename = path_.split(".")[-2][1:] + "_" #will be added to TH1F name to avoid memory leaks
+
+            if compact:
+                self._setColl(name, _compactCollection(filename, binned, branches_, fillcolor_, fillstyle_, linecolor_, linestyle_))
+                continue
+
+            for branch, fc, fs, lc, ls in zip(branches_, fillcolor_, fillstyle_, linecolor_, linestyle_):
                 print("@Filling: ", branch)
-                #filling single variables = multiple scan of tree but less memory employment -> Quicker
-                #appending to list to list [[event1], [event2], ...] takes O(1) while appending everything 
-                #into one list [1,2,3,...] makes everything very expensive.
-                var = []
-                ind_to_stop = 0
-                for event in t:
-                    if ind_to_stop == n_ev_ : break
-                    try:
-                        var.append(list(getattr(event, branch)))
-                    except:
-                        var.append([getattr(event, branch)])
-                    ind_to_stop += 1
-
-                var = [item for sublist in var for item in sublist]
-
-                f.Close()
-
-
-                if ranges[idx] == False:
-                    if hasattr(self, "ranges"):
-                        for range_key in self.ranges.keys():
-                            if range_key in branch:
-                                r = self.ranges[range_key]
-                    else:
-                        r = [min(var), max(var)]
+                namedhistos[branch] = _styledTH1F(filename + branch, binned[branch], fc, fs, lc, ls)
+            
+            self._setColl(name, namedhistos)
+
+    def fillROOTND(self, path, tree, n_ev, name_of='namehisto', variables=None, bins=30, ranges=False, sparse=False, workers=1, selection=None, weights=None, backend=None):
+        """
+            fillROOTND will fill named dictionaries of multi-dimensional histograms (correlations such as pt vs eta) starting from
+            .root files and trees. All the histograms of a file are filled from a single read of the file.
+            Arguments:
+            path, tree, n_ev, name_of: see fillROOT
+            variables: list of tuples of branches such as [("pt", "eta"), ("pt", "eta", "phi")], one histogram per tuple, with
+                    the first branch on the x axis. Same variables for every file, or a nested list pairwise with path.
+                    Vector branches of a tuple must have the same number of elements, scalar branches are repeated for every element.
+                    Histograms are stored with keys "pt:eta", "pt:eta:phi"
+            bins: int (all the axes) or list pairwise with variables of int or list of int (one per axis)
+            ranges: False to take ranges from rangeDefiner if present, otherwise from the data (as in fillROOT). Can be a list pairwise
+                    with variables of lists of [min, max] or 'all' (one per axis)
+            sparse: keep only the filled cells and return ROOT.THnSparseD instead of TH2F/TH3F, for high dimensional histograms with
+                    mostly empty cells. Forced for more than 3 variables. Bool or list pairwise with variables. By default False
+            workers: number of processes filling the files in parallel. By default 1
+            selection, weights, backend: see fillROOT
+        """
+        assert variables is not None, "[ERROR] no variables to be histogrammed"
+        assert len(path) == len(tree), "[ERROR] Dimension of root files and trees does not match"
+        assert len(path) == len(name_of), "[ERROR] Dimension of names and files does not match"
+
+        if isinstance(variables[0][0], str):
+            variables = [variables]*len(path)
+        else:
+            assert len(variables) == len(path), "[ERROR] Variables does not match dimension of path"
+
+        if not isinstance(n_ev, list):
+            n_ev = [n_ev]*len(path)
+        else:
+            assert len(n_ev) == len(path), "[ERROR] Number of events does not match dimension of path"
+
+        if not isinstance(selection, list):
+            selection = [selection]*len(path)
+        else:
+            assert len(selection) == len(path), "[ERROR] Selection does not match dimension of path"
+
+        if not isinstance(weights, list):
+            weights = [weights]*len(path)
+        else:
+            assert len(weights) == len(path), "[ERROR] Weights does not match dimension of path"
+
+        jobs = []
+        for path_, tree_, n_ev_, name, variables_, selection_, weights_ in zip(path, tree, n_ev, name_of, variables, selection, weights):
+
+            self._reserve(name)
+
+            self.filepaths.append(path_)
+            self.trees.append(tree_)
+
+            bins_ = bins if isinstance(bins, list) else [bins]*len(variables_)
+            ranges_ = ranges if ranges else [False]*len(variables_)
+            sparse_ = sparse if isinstance(sparse, list) else [sparse]*len(variables_)
+            assert len(bins_) == len(variables_) and len(ranges_) == len(variables_) and len(sparse_) == len(variables_), \
+                "[ERROR] bins, ranges and sparse must be pairwise with variables"
+
+            bins_ = [b if isinstance(b, list) else [b]*len(var) for b, var in zip(bins_, variables_)]
+            #ranges from rangeDefiner (or 'all') for every axis without explicit range
+            ranges_ = [[self._branchRange(branch, r_) for branch, r_ in zip(var, r if r else [False]*len(var))] for var, r in zip(variables_, ranges_)]
+            sparse_ = [s or len(var) > 3 for s, var in zip(sparse_, variables_)]
+
+            jobs.append((name, path_, tree_, n_ev_, [tuple(var) for var in variables_], bins_, ranges_, selection_, weights_, sparse_))
+
+        print("...Filling Named Multi-dimensional Histograms")
+
+        filled = fillFilesND([(path_, tree_, n_ev_, variables_, bins_, ranges_, selection_, weights_, sparse_) for _, path_, tree_, n_ev_, variables_, bins_, ranges_, selection_, weights_, sparse_ in jobs], workers, backend)
 
+        for (name, path_, tree_, n_ev_, variables_, bins_, ranges_, selection_, weights_, sparse_), binned in zip(jobs, filled):
+            namedhistos = {}
+            filename = path_.split(".")[-2][1:] + "_" #will be added to histo name to avoid memory leaks
+
+            for var, b, s in zip(variables_, binned, sparse_):
+                key = ":".join(var)
+                print("@Filling: ", key)
+                if s:
+                    h = b.toTHnSparse(filename + "_".join(var))
+                    axes = [h.GetAxis(i) for i in range(len(var))]
                 else:
-                    if ranges[idx] == 'all':
-                        r = [min(var), max(var)]
-                    else:
-                        r = ranges[idx]
-
-                max_, min_ = r[1], r[0]
-                h = ROOT.TH1F(filename + branch, filename + branch, b, min_, max_)
-                h.SetFillStyle(fs)
-                h.SetFillColor(fc)
-                h.SetLineColor(lc)
-                h.SetLineStyle(ls)
-                for value in var:
-                    h.Fill(value)
-                
-        
-                namedhistos[branch] = h
+                    h = b.toTH(filename + "_".join(var))
+                    axes = [h.GetXaxis(), h.GetYaxis(), h.GetZaxis()]
+                for axis, branch in zip(axes, var):
+                    axis.SetTitle(branch)
+                namedhistos[key] = h
 
-                idx += 1
-            
-            setattr(self, name, namedhistos)
+            self._setColl(name, namedhistos)
+
+    def fillROOTVariations(self, path, tree, n_ev, name_of='namehisto', variations={}, branches='all', bins=30, linestyle=1, linecolor=kBlack, fillcolor=0, fillstyle=0, ranges=False, workers=1, selection=None, weights=None, backend=None, compact=False):
+        """
+            fillROOTVariations will fill the nominal histograms and any number of systematic variations of them (shifted branches,
+            alternative weights, different selections) with a single read of each file: every branch and expression is decoded
+            once and shared by all the variations. Each variation is a collection named name_of + "_" + variation (the nominal is
+            name_of + "_nominal") with the nominal branch names as keys, see getVariations.
+            Arguments:
+            path, tree, n_ev, name_of, branches, bins, workers: see fillROOT. bins and ranges are shared by all the files
+            variations: {variation: spec} with spec a dictionary with any of
+                    "branches": {branch: alternative branch or expression}, such as {"pt": "pt_jesUp"}
+                    "weights": weight expression replacing weights, such as "genWeight*puWeightUp"
+                    "selection": selection expression replacing selection, such as "pt_jesUp > 30"
+                    ex: {"jesUp": {"branches": {"pt": "pt_jesUp"}}, "puUp": {"weights": "genWeight*puWeightUp"}}
+            linestyle, linecolor, fillcolor, fillstyle: style of the TH1F, single value or list pairwise with branches
+            ranges: False (rangeDefiner if present, otherwise from the data), [min, max], or list of them pairwise with branches.
+                    Ranges taken from the data are those of the nominal, used by all the variations so that they can be compared
+            selection, weights: nominal selection and weights, str or list of str pairwise with path, see fillROOT
+            backend, compact: see fillROOT
+        """
+        assert len(path) == len(tree), "[ERROR] Dimension of root files and trees does not match"
+        assert len(path) == len(name_of), "[ERROR] Dimension of names and files does not match"
+        assert "nominal" not in variations, "[ERROR] nominal is always filled, it cannot be a variation"
+
+        if not isinstance(n_ev, list):
+            n_ev = [n_ev]*len(path)
+        else:
+            assert len(n_ev) == len(path), "[ERROR] Number of events does not match dimension of path"
+
+        if not isinstance(branches, list) or not isinstance(branches[0], list):
+            branches = [branches]*len(path)
+        else:
+            assert len(branches) == len(path), "[ERROR] Branches does not match dimension of path"
+
+        if not isinstance(selection, list):
+            selection = [selection]*len(path)
+        else:
+            assert len(selection) == len(path), "[ERROR] Selection does not match dimension of path"
+
+        if not isinstance(weights, list):
+            weights = [weights]*len(path)
+        else:
+            assert len(weights) == len(path), "[ERROR] Weights does not match dimension of path"
+
+        jobs = []
+        for path_, tree_, n_ev_, name, branches_, selection_, weights_ in zip(path, tree, n_ev, name_of, branches, selection, weights):
+            if branches_ == 'all':
+                branches_ = branchNames(path_, tree_, backend) #branch names
+
+            names = {variation: "{}_{}".format(name, variation) for variation in ["nominal"] + list(variations)}
+            for coll_name in names.values():
+                self._reserve(coll_name)
+            self.variations[name] = names
+
+            self.filepaths.append(path_)
+            self.trees.append(tree_)
+
+            bins_ = bins if isinstance(bins, list) else [bins]*len(branches_)
+            if ranges and not isinstance(ranges[0], (list, tuple, str)):
+                ranges_ = [ranges]*len(branches_)
+            else:
+                ranges_ = ranges if ranges else [False]*len(branches_)
+            assert len(bins_) == len(branches_) and len(ranges_) == len(branches_), "[ERROR] bins and ranges must be pairwise with branches"
+            ranges_ = [self._branchRange(branch, r) for branch, r in zip(branches_, ranges_)]
+
+            jobs.append((names, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_))
+
+        print("...Filling Named Histograms and {} variations".format(len(variations)))
+
+        filled = fillFilesVariations([(path_, tree_, n_ev_, branches_, bins_, ranges_, variations, selection_, weights_) for _, path_, tree_, n_ev_, branches_, bins_, ranges_, selection_, weights_ in jobs], workers, backend)
+
+        for (names, path_, tree_, n_ev_, branches_, bins_, ranges_, _, _), binned in zip(jobs, filled):
+            filename = path_.split(".")[-2][1:] + "_" #will be added to TH1F name to avoid memory leaks
+            for variation, coll_name in names.items():
+                if compact:
+                    styles = [[style[i] if isinstance(style, list) else style for i in range(len(branches_))] for style in (fillcolor, fillstyle, linecolor, linestyle)]
+                    self._setColl(coll_name, _compactCollection(filename + variation + "_", binned[variation], branches_, *styles))
+                    continue
+
+                namedhistos = {}
+                for i, branch in enumerate(branches_):
+                    print("@Filling: ", variation, branch)
+                    fc, fs, lc, ls = [style[i] if isinstance(style, list) else style for style in (fillcolor, fillstyle, linecolor, linestyle)]
+                    namedhistos[branch] = _styledTH1F(filename + variation + "_" + branch, binned[variation][branch], fc, fs, lc, ls)
+                self._setColl(coll_name, namedhistos)
+
+    def getVariations(self, name):
+        """
+            Return {variation: collection} of the nominal and of the variations filled by fillROOTVariations.
+            Arguments:
+            name: name_of given to fillROOTVariations
+        """
+        assert name in self.variations, "[ERROR] {} was not filled by fillROOTVariations".format(name)
+        return {variation: self.attributes[coll_name] for variation, coll_name in self.variations[name].items()}
+
+    def fillProfileROOT(self, path, tree, n_ev, name_of='nameprofile', profiles=None, bins=30, ranges=False, option='', workers=1, selection=None, weights=None, backend=None):
+        """
+            fillProfileROOT will fill named dictionaries of ROOT.TProfile (mean of y in bins of x) starting from .root files and trees.
+            Sums per bin are accumulated with numpy during a single read of each file, TProfile::Fill is never called.
+            Arguments:
+            path, tree, n_ev, name_of: see fillROOT
+            profiles: list of (x, y) branches or expressions such as [("pt", "response")], one TProfile per pair stored with
+                    key "x:y". Same profiles for every file, or a nested list pairwise with path. Vector and scalar branches
+                    are aligned as in fillROOTND
+            bins: int or list pairwise with profiles of number of bins on x
+            ranges: range on x, False (rangeDefiner if present, otherwise from the data), or list pairwise with profiles of [min, max] or 'all'
+            option: error option of TProfile, '' (error on the mean) or 's' (spread)
+            workers: number of processes filling the files in parallel. By default 1
+            selection, weights, backend: see fillROOT
+        """
+        self._fillPairs(path, tree, n_ev, name_of, profiles, 'profile', bins, ranges, workers, selection, weights, backend, option)
+
+    def fillEfficiencyROOT(self, path, tree, n_ev, name_of='nameefficiency', efficiencies=None, bins=30, ranges=False, workers=1, selection=None, weights=None, backend=None):
+        """
+            fillEfficiencyROOT will fill named dictionaries of ROOT.TEfficiency (fraction of passing entries in bins of x, such as
+            trigger turn-on curves) starting from .root files and trees. Passed and total counts are accumulated with numpy during
+            a single read of each file. See efficiencyInterval for the confidence intervals of all the bins at once.
+            Arguments:
+            path, tree, n_ev, name_of: see fillROOT
+            efficiencies: list of (x, pass) such as [("pt", "passTrigger"), ("pt", "pt_reco > 0 && dR < 0.4")], pass being a branch or
+                    a C++ expression, non zero values pass. One TEfficiency per pair stored with key "x:pass". Same efficiencies for
+                    every file, or a nested list pairwise with path
+            bins, ranges, workers, selection, weights, backend: see fillProfileROOT
+        """
+        self._fillPairs(path, tree, n_ev, name_of, efficiencies, 'efficiency', bins, ranges, workers, selection, weights, backend)
+
+    def _fillPairs(self, path, tree, n_ev, name_of, pairs, kind, bins, ranges, workers, selection, weights, backend, option=''):
+        """
+            Common part of fillProfileROOT and fillEfficiencyROOT
+        """
+        assert pairs is not None, "[ERROR] no {} to be filled".format(kind)
+        assert len(path) == len(tree), "[ERROR] Dimension of root files and trees does not match"
+        assert len(path) == len(name_of), "[ERROR] Dimension of names and files does not match"
+
+        if isinstance(pairs[0][0], str):
+            pairs = [pairs]*len(path)
+        else:
+            assert len(pairs) == len(path), "[ERROR] {} does not match dimension of path".format(kind)
+
+        if not isinstance(n_ev, list):
+            n_ev = [n_ev]*len(path)
+        else:
+            assert len(n_ev) == len(path), "[ERROR] Number of events does not match dimension of path"
+
+        if not isinstance(selection, list):
+            selection = [selection]*len(path)
+        else:
+            assert len(selection) == len(path), "[ERROR] Selection does not match dimension of path"
+
+        if not isinstance(weights, list):
+            weights = [weights]*len(path)
+        else:
+            assert len(weights) == len(path), "[ERROR] Weights does not match dimension of path"
+
+        jobs = []
+        for path_, tree_, n_ev_, name, pairs_, selection_, weights_ in zip(path, tree, n_ev, name_of, pairs, selection, weights):
+
+            self._reserve(name)
+
+            self.filepaths.append(path_)
+            self.trees.append(tree_)
+
+            bins_ = bins if isinstance(bins, list) else [bins]*len(pairs_)
+            ranges_ = ranges if ranges else [False]*len(pairs_)
+            assert len(bins_) == len(pairs_) and len(ranges_) == len(pairs_), "[ERROR] bins and ranges must be pairwise with {}".format(kind)
+            ranges_ = [self._branchRange(x, r) for (x, _), r in zip(pairs_, ranges_)]
+
+            jobs.append((name, path_, tree_, n_ev_, [tuple(pair) for pair in pairs_], [kind]*len(pairs_), bins_, ranges_, selection_, weights_))
+
+        print("...Filling Named {}".format("Profiles" if kind == 'profile' else "Efficiencies"))
+
+        filled = fillFilesPairs([(path_, tree_, n_ev_, pairs_, kinds_, bins_, ranges_, selection_, weights_) for _, path_, tree_, n_ev_, pairs_, kinds_, bins_, ranges_, selection_, weights_ in jobs], workers, backend)
+
+        for (name, path_, tree_, n_ev_, pairs_, kinds_, bins_, ranges_, selection_, weights_), accumulators in zip(jobs, filled):
+            named = {}
+            filename = path_.split(".")[-2][1:] + "_" #will be added to the name to avoid memory leaks
+
+            for (x, y), acc in zip(pairs_, accumulators):
+                key = x + ":" + y
+                print("@Filling: ", key)
+                hname = filename + "{}_{}_{}".format(kind, len(named), x)
+                if kind == 'profile':
+                    h = acc.toTProfile(hname, ";{};{}".format(x, y), option)
+                else:
+                    h = acc.toTEfficiency(hname, ";{};efficiency {}".format(x, y))
+                named[key] = h
+
+            self._setColl(name, named)
+
+    def efficiencyInterval(self, coll_name, key, level=0.682689, method='clopper_pearson'):
+        """
+            Efficiency and confidence interval of all the bins of a TEfficiency of a collection, computed at once with numpy
+            instead of bin by bin.
+            Arguments:
+            coll_name: name of the collection filled by fillEfficiencyROOT
+            key: key of the efficiency such as "pt:passTrigger"
+            level: confidence level. By default 0.682689 (one sigma)
+            method: 'clopper_pearson' (as TEfficiency default), 'wilson' or 'normal'
+
+            Returns np.ndarray of bin centers, efficiencies, lower and upper bounds (under/overflow excluded)
+        """
+        eff = self.getSingleHisto(coll_name, key)
+        arrays = []
+        for h in (eff.GetPassedHistogram(), eff.GetTotalHistogram()):
+            n = h.GetNcells()
+            contents = np.frombuffer(h.GetArray(), dtype=np.float64, count=n)
+            sumw2 = np.frombuffer(h.GetSumw2().GetArray(), dtype=np.float64, count=n) if h.GetSumw2N() else None
+            arrays.append((contents, sumw2))
+
+        (passed, passed_w2), (total, total_w2) = arrays
+        e, low, high = efficiencyInterval(passed, total, level, method, passed_w2, total_w2 if eff.UsesWeights() else None)
+        edges = axisEdges(eff.GetTotalHistogram().GetXaxis())
+        centers = 0.5*(edges[1:] + edges[:-1])
+        return centers, e[1:-1], low[1:-1], high[1:-1]
+
+    def _branchRange(self, branch, range_):
+        """
+            Range of a branch: range_ if given, otherwise the matching fragment of self.ranges (see rangeDefiner).
+            Returns [min, max] or 'all' when the range has to be taken from the data
+        """
+        if range_ == False:
+            if hasattr(self, "ranges"):
+                for range_key in self.ranges.keys():
+                    if range_key in branch:
+                        range_ = self.ranges[range_key]
+            if range_ == False: range_ = 'all'
+
+        return range_
 
 
     def printAttr(self, name):
@@ -334,7 +833,7 @@ class RootHisto:
         """
         if name not in self.attributes:
             sys.exit("[ERROR] Name not in collection, change name")
-        print(getattr(self, name))
+        print(self.attributes[name])
 
     def getHistoColl(self, coll_name):
         """
@@ -347,11 +846,60 @@ class RootHisto:
 
         dicts = []
         for name in coll_name:
-            dicts.append(getattr(self, name))
+            dicts.append(self.attributes[name])
         
         if len(dicts) == 1: return dicts[0]
         else: return dicts
 
+    def save(self, path, coll_name='all'):
+        """
+            Write collections in one file, to be read back by load (for example by plotting jobs that do not fill).
+            Arguments:
+            path: .root file (one directory per collection, any histogram type), .npz file (compressed numpy arrays of
+                    edges, contents, sumw2 and statistics plus the style of TH1, TH2 and TH3, readable without ROOT) or .hmap
+                    file (contiguous arrays of one dimensional histograms memory-mapped by load, for thousands of them), see Store
+            coll_name: name or list of names of the collections. By default 'all'
+        """
+        if coll_name == 'all': coll_name = list(self.attributes)
+        if not isinstance(coll_name, list): coll_name = [coll_name]
+        assert all([name in self.attributes for name in coll_name]), "[ERROR] given names not in attributes"
+
+        collections = {}
+        for name in coll_name:
+            h_dict = self.attributes[name]
+            _prefetch(h_dict)
+            collections[name] = h_dict
+        variations = {name: group for name, group in self.variations.items() if all(c in collections for c in group.values())}
+
+        if path.endswith(".hmap"):
+            objects = lambda coll: coll.built.values() if isinstance(coll, CompactCollection) else coll.values()
+            wrong = [name for name, coll in collections.items() if not all(compactable(h) for h in objects(coll))]
+            if len(wrong):
+                raise ValueError("[ERROR] collections {} hold histograms other than TH1 with fixed binning (TH2, TH3, TProfile, ...), "
+                                 "save them in a .root or .npz file or leave them out with coll_name".format(wrong))
+
+        saveCollections(path, collections, variations)
+        print("[INFO] {} collections saved in {}".format(len(collections), path))
+
+    def load(self, path, coll_name='all'):
+        """
+            Read collections written by save. They become attributes of the class as if they had been filled here.
+            Collections of .hmap files are Store.CompactCollection: the file is memory-mapped and TH1F are built on access.
+            Arguments:
+            path: .root, .npz or .hmap file written by save
+            coll_name: name or list of names of the collections to be read. By default 'all'
+        """
+        if coll_name != 'all' and not isinstance(coll_name, list): coll_name = [coll_name]
+        collections, variations = loadCollections(path, coll_name)
+        if coll_name != 'all':
+            assert all([name in collections for name in coll_name]), "[ERROR] given names not in {}".format(path)
+
+        for name, h_dict in collections.items():
+            if name in self.attributes:
+                sys.exit("[ERROR] name of collection {} already in class, clear it before loading".format(name))
+            self._setColl(name, h_dict)
+        self.variations.update((name, group) for name, group in variations.items() if all(c in collections for c in group.values()))
+
     def getSingleHisto(self, coll_name, br_name):
         """
             Get a single histo from one of collection.
@@ -361,7 +909,7 @@ class RootHisto:
         """
         assert not isinstance(coll_name, list), "[ERROR] only one col name allowed"
 
-        h_dict = getattr(self, coll_name)
+        h_dict = self.attributes[coll_name]
 
         assert br_name in h_dict.keys(), "[ERROR] {}  not in collection required: {} ".format(br_name, coll_name)
 
@@ -380,7 +928,7 @@ class RootHisto:
         """
 
         if branches == 'all':
-            branches = getattr(self, coll_name).keys()
+            branches = self.attributes[coll_name].keys()
         else:
             if not isinstance(branches, list): branches = [branches]
 
@@ -392,7 +940,8 @@ class RootHisto:
 
         assert not isinstance(coll_name, list), "[ERROR] Parameter coll_name: {} was found to be list, only one name accepted".format(coll_name)
         
-        h_dict = getattr(self, coll_name)
+        h_dict = self.attributes[coll_name]
+        _prefetch(h_dict)
 
         for br, bi in zip(branches, bins_):
             if not isinstance(bi, list):
@@ -400,21 +949,70 @@ class RootHisto:
             else:
                 h_dict[br] = h_dict[br].Rebin(len(bi)-1, "", array('d', bi))
 
-        setattr(self, coll_name, h_dict) #overload the attribute with new dictionary
-
         return
 
+    def refillCollection(self, coll_name, bins_=30, ranges=False, branches='all'):
+        """
+            Change binning and range of histograms of a collection filled by fillROOT, histogramming again the values
+            kept in memory (see keepColumns) instead of reading the files. Styles, names and labels are kept.
+            Arguments:
+            coll_name: name of the collection such as "namehisto"
+            bins_: number of bins, int or list pairwise with branches
+            ranges: [min, max], 'all' (min and max of the values) or list of them pairwise with branches. By default
+                    False: ranges from rangeDefiner if present otherwise 'all'
+            branches: name of the branches to be modified. By default 'all'
+        """
+        assert hasattr(self, "columns"), "[ERROR] values are not kept, call keepColumns before fillROOT"
+        assert coll_name in self.sources, "[ERROR] {} was not filled by fillROOT".format(coll_name)
+
+        h_dict = self.attributes[coll_name]
+        if branches == 'all': branches = list(h_dict.keys())
+        if not isinstance(branches, list): branches = [branches]
+
+        if not isinstance(bins_, list):
+            bins_ = [bins_]*len(branches)
+        else:
+            assert len(bins_) == len(branches), "[ERROR] Same number of bins for number of branches"
+
+        if not isinstance(ranges, list) or (len(ranges) == 2 and not isinstance(ranges[0], (list, tuple, str, bool))):
+            ranges = [ranges]*len(branches)
+        else:
+            assert len(ranges) == len(branches), "[ERROR] Same number of ranges for number of branches"
+
+        path_, tree_, n_ev_, selection_, weights_ = self.sources[coll_name]
+        _prefetch(h_dict)
+        for br, bi, r in zip(branches, bins_, ranges):
+            var = self.columns.get(self.columns.key(path_, tree_, n_ev_, br, selection_, weights_))
+            w = self.columns.get(self.columns.key(path_, tree_, n_ev_, br, selection_, weights_, 'weights')) if weights_ else None
+            if var is None or (weights_ and w is None):
+                raise KeyError("[ERROR] values of {} of {} not in the kept columns: dropped beyond the keepColumns budget (raise it or "
+                               "give spill) or filled before keepColumns, fill again with fillROOT".format(br, coll_name))
+
+            r = self._branchRange(br, r)
+            if r == 'all':
+                r = [var.min(), var.max()]
+
+            binned = Binned.fromValues(var, bi, r[0], r[1], w)
+            h = h_dict[br]
+            h.Reset()
+            h.SetBins(bi, binned.xmin, binned.xmax)
+            if binned.values is not None:
+                bulkFill(h, binned.values, binned.weights)
+            else:
+                addContents(h, binned.contents, binned.sumw2, binned.stats, binned.entries)
+
     def linestyleCollection(self, linestyle=1, coll_name='all', branches='all'):
         """
             Change Linestyle of a collection
         """
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
             if not isinstance(linestyle, list):
                 linestyle = [linestyle]*len(branches)
             else:
@@ -422,19 +1020,19 @@ class RootHisto:
 
             for branch, ls in zip(branches, linestyle):
                 h_dict[branch].SetLineStyle(ls)
-            setattr(self, branch, h_dict)
 
     def markerstyleCollection(self, markerstyle=20, coll_name='all', branches='all'):
         """
             Change markerstyle of collection
         """ 
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
             if not isinstance(markerstyle, list):
                 markerstyle = [markerstyle]*len(branches)
             else:
@@ -442,19 +1040,19 @@ class RootHisto:
 
             for branch, ms in zip(branches, markerstyle):
                 h_dict[branch].SetMarkerStyle(ms)
-            setattr(self, branch, h_dict)
 
     def markercolorCollection(self, markercolor=20, coll_name='all', branches='all'):
         """
             Change marker color for collection
         """
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
             if not isinstance(markercolor, list):
                 markercolor = [markercolor]*len(branches)
             else:
@@ -462,7 +1060,6 @@ class RootHisto:
 
             for branch, mc in zip(branches, markercolor):
                 h_dict[branch].SetMarkerColor(mc)
-            setattr(self, branch, h_dict)
 
 
     def xlabelsCollection(self, labels='branch', coll_name='all', branches='all'):
@@ -470,12 +1067,13 @@ class RootHisto:
             Label X axis of a collection
         """
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
     
             if not isinstance(labels, list) and labels != 'branch':
                 labels = [labels]*len(branches)
@@ -486,19 +1084,19 @@ class RootHisto:
 
             for branch, label in zip(branches, labels):
                 h_dict[branch].GetXaxis().SetTitle(label)
-            setattr(self, branch, h_dict)
 
     def ylabelsCollection(self, labels='branch', coll_name='all', branches='all'):
         """
             Label Y axis of a collection
         """
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
     
             if not isinstance(labels, list) and labels != 'branch':
                 labels = [labels]*len(branches)
@@ -509,19 +1107,19 @@ class RootHisto:
 
             for branch, label in zip(branches, labels):
                 h_dict[branch].GetYaxis().SetTitle(label)
-            setattr(self, branch, h_dict)
 
     def titlesCollection(self, titles='branch', coll_name='all', branches='all'):
         """
             Titles of a collection
         """
 
-        if coll_name == 'all': coll_name = self.attributes
+        if coll_name == 'all': coll_name = list(self.attributes)
         if not isinstance(coll_name, list) and coll_name != 'all': coll_name = [coll_name]
         if not isinstance(branches, list) and branches != 'all': branches = [branches]
         for name in coll_name:
-            h_dict = getattr(self, name)
+            h_dict = self.attributes[name]
             if branches == 'all': branches = h_dict.keys()
+            _prefetch(h_dict)
     
             if not isinstance(titles, list) and titles != 'branch':
                 titles = [titles]*len(branches)
@@ -532,7 +1130,6 @@ class RootHisto:
 
             for branch, label in zip(branches, titles):
                 h_dict[branch].SetTitle(label)
-            setattr(self, branch, h_dict)
 
         
 
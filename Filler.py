@@ -0,0 +1,1184 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Reader import readBranches, entryRanges, broadcast, getBackend, getThreads, setBackend, useBackend
+from Lazy import ROOT
+
+#events per chunk when ranges are accumulated while reading (autorange='stream')
+STREAM_CHUNKSIZE = 1000000
+
+#numpy type of the bin contents, from the last letter of the histogram class name (TH1F -> F)
+_DTYPES = {"F": np.float32, "D": np.float64, "I": np.int32, "S": np.int16, "C": np.int8}
+
+
+def toArray(val):
+    """
+        Convert list/np.ndarray/pd.Series of values to a contiguous float64 np.ndarray without
+        copying when the input already is one.
+    """
+    return np.ascontiguousarray(val, dtype=np.float64)
+
+
+def valueRange(val):
+    """
+        (min, max) of list/np.ndarray/pd.Series of values, computed by numpy. nan are ignored as they go in the
+        overflow (see findBins)
+    """
+    val = toArray(val)
+    return (float(np.nanmin(val)), float(np.nanmax(val)))
+
+
+def axisEdges(axis):
+    """
+        Return the bin edges of a ROOT.TAxis as np.ndarray (works for fixed and variable binning)
+    """
+    xbins = axis.GetXbins()
+    if xbins.GetSize():
+        return np.frombuffer(xbins.GetArray(), dtype=np.float64, count=xbins.GetSize()).copy()
+
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins()+1)
+
+
+def findBins(x, nbins, xmin, xmax, edges=None):
+    """
+        Vectorized version of TAxis::FindBin. Bin 0 is the underflow and bin nbins+1 the overflow
+        exactly as ROOT does when filling one value at a time.
+        Arguments:
+        x: np.ndarray of values
+        nbins: number of bins of the axis
+        xmin, xmax: range of the axis
+        edges: np.ndarray of bin edges for variable binning. If None fixed binning is assumed
+    """
+    bins = np.empty(len(x), dtype=np.int64)
+    under = x < xmin
+    over = ~(x < xmax) & ~under #nan goes in overflow as in ROOT
+    inside = ~(under | over)
+
+    bins[under] = 0
+    bins[over] = nbins + 1
+    if edges is None:
+        bins[inside] = 1 + (nbins*(x[inside] - xmin)/(xmax - xmin)).astype(np.int64)
+    else:
+        bins[inside] = np.searchsorted(edges, x[inside], side='right')
+
+    return bins
+
+
+def accumulate(val, nbins, xmin, xmax, edges=None, weights=None):
+    """
+        Bin a whole array of values in one shot.
+        Arguments:
+        val: list/np.ndarray/pd.Series of values
+        nbins, xmin, xmax, edges: binning, see findBins
+        weights: list/np.ndarray/pd.Series of weights with the same length of val. If None every entry has weight 1
+
+        Returns contents and sumw2 arrays of dimension nbins+2 (under/overflow included, sumw2 is None
+        if weights is None), the statistics array [sumw, sumw2, sumwx, sumwx2] of in range entries
+        as used by TH1::PutStats and the number of entries.
+    """
+    x = toArray(val)
+    bins = findBins(x, nbins, xmin, xmax, edges)
+    inside = (bins > 0) & (bins <= nbins)
+    xin = x[inside]
+
+    if weights is None:
+        contents = np.bincount(bins, minlength=nbins+2).astype(np.float64)
+        sumw2 = None
+        stats = np.array([len(xin), len(xin), xin.sum(), (xin*xin).sum()], dtype=np.float64)
+    else:
+        w = toArray(weights)
+        assert len(w) == len(x), "[ERROR] weights and values have different dimensions"
+        contents = np.bincount(bins, weights=w, minlength=nbins+2)
+        sumw2 = np.bincount(bins, weights=w*w, minlength=nbins+2)
+        win = w[inside]
+        stats = np.array([win.sum(), (win*win).sum(), (win*xin).sum(), (win*xin*xin).sum()], dtype=np.float64)
+
+    return contents, sumw2, stats, len(x)
+
+
+def contentView(h):
+    """
+        Return a writable np.ndarray view on the bin contents of a histogram (under/overflow included)
+    """
+    return np.frombuffer(h.GetArray(), dtype=_DTYPES[h.ClassName()[-1]], count=h.GetNcells())
+
+
+def sumw2View(h):
+    """
+        Return a writable np.ndarray view on the sum of squared weights of a histogram, creating
+        the structure if needed
+    """
+    if h.GetSumw2N() == 0: h.Sumw2()
+    return np.frombuffer(h.GetSumw2().GetArray(), dtype=np.float64, count=h.GetNcells())
+
+
+def addContents(h, contents, sumw2, stats, entries):
+    """
+        Add binned contents to a histogram, updating sumw2, statistics and entries as TH1::Fill would do
+        Arguments: see accumulate output
+    """
+    c = contentView(h)
+    c += contents.astype(c.dtype)
+
+    if sumw2 is not None:
+        sumw2View(h)[:] += sumw2
+    elif h.GetSumw2N():
+        sumw2View(h)[:] += contents #unweighted entries: sumw2 = sumw
+
+    s = np.zeros(len(stats), dtype=np.float64) #4 for TH1, 7 for TH2, 11 for TH3
+    h.GetStats(s)
+    h.PutStats(s + stats)
+    h.SetEntries(h.GetEntries() + entries)
+
+
+def bulkFill(h, val, weights=None):
+    """
+        Fill a ROOT.TH1 with a whole array of values in one shot instead of calling h.Fill(value) for
+        each value. Values are binned with numpy and bin contents, sumw2 and statistics are written
+        directly in the histogram.
+        Arguments:
+        h: ROOT.TH1F (or any one dimensional ROOT histogram)
+        val: list/np.ndarray/pd.Series of values
+        weights: list/np.ndarray/pd.Series of per value weights. By default None, every value has weight 1
+    """
+    if h.GetBufferSize():
+        #axis range not defined yet (xmin >= xmax), let ROOT buffer and define the range
+        x = toArray(val)
+        w = np.ones(len(x)) if weights is None else toArray(weights)
+        h.FillN(len(x), x, w)
+        return
+
+    axis = h.GetXaxis()
+    edges = axisEdges(axis) if axis.GetXbins().GetSize() else None
+    contents, sumw2, stats, entries = accumulate(val, axis.GetNbins(), axis.GetXmin(), axis.GetXmax(), edges, weights)
+    addContents(h, contents, sumw2, stats, entries)
+
+
+class Binned:
+    """
+        Histogram content kept as numpy arrays (nbins+2 cells, under/overflow included) instead of a ROOT object.
+        It is what the filling jobs produce: it can be sent between processes, merged and turned into a TH1F at the end.
+        If the axis is not valid (xmin >= xmax) the raw values (and their weights) are kept and ROOT will choose the range.
+    """
+
+    def __init__(self, nbins, xmin, xmax, contents=None, sumw2=None, stats=None, entries=0, values=None, weights=None):
+        self.nbins = nbins
+        self.xmin = xmin
+        self.xmax = xmax
+        self.contents = contents
+        self.sumw2 = sumw2
+        self.stats = stats
+        self.entries = entries
+        self.values = values
+        self.weights = weights
+
+    @classmethod
+    def fromValues(cls, val, nbins, xmin, xmax, weights=None):
+        """
+            Bin an array of values, see accumulate
+        """
+        xmin, xmax = float(xmin), float(xmax)
+        if xmin >= xmax:
+            return cls(nbins, xmin, xmax, values=toArray(val), weights=None if weights is None else toArray(weights))
+
+        return cls(nbins, xmin, xmax, *accumulate(val, nbins, xmin, xmax, weights=weights))
+
+    def toArrays(self):
+        """
+            Return a dictionary of np.ndarray describing the histogram, to be written with np.savez
+        """
+        arrays = {"axis": np.array([self.nbins, self.xmin, self.xmax], dtype=np.float64), "entries": np.array(self.entries, dtype=np.float64)}
+        for name in ("contents", "sumw2", "stats", "values", "weights"):
+            if getattr(self, name) is not None: arrays[name] = getattr(self, name)
+
+        return arrays
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        """
+            Inverse of toArrays, arrays can be the dictionary or the np.load of the .npz file
+        """
+        nbins, xmin, xmax = arrays["axis"]
+        get = lambda name: arrays[name] if name in arrays else None
+        return cls(int(nbins), float(xmin), float(xmax), get("contents"), get("sumw2"), get("stats"), int(arrays["entries"]), get("values"), get("weights"))
+
+    def add(self, other):
+        """
+            Merge in place another Binned with the same binning, as TH1::Add would do
+        """
+        assert (self.nbins, self.xmin, self.xmax) == (other.nbins, other.xmin, other.xmax), "[ERROR] cannot merge histograms with different binning"
+
+        if self.values is not None:
+            if self.weights is not None or other.weights is not None:
+                ones = lambda b: np.ones(len(b.values)) if b.weights is None else b.weights
+                self.weights = np.concatenate([ones(self), ones(other)])
+            self.values = np.concatenate([self.values, other.values])
+            return self
+
+        if self.sumw2 is not None or other.sumw2 is not None:
+            #unweighted contents have sumw2 equal to the contents
+            self.sumw2 = (self.contents if self.sumw2 is None else self.sumw2) + (other.contents if other.sumw2 is None else other.sumw2)
+        self.contents = self.contents + other.contents
+        self.stats = self.stats + other.stats
+        self.entries += other.entries
+        return self
+
+    def toTH1F(self, name, title=None):
+        """
+            Build the ROOT.TH1F with these contents
+        """
+        h = ROOT.TH1F(name, name if title is None else title, self.nbins, self.xmin, self.xmax)
+        if self.values is not None:
+            bulkFill(h, self.values, self.weights)
+        else:
+            addContents(h, self.contents, self.sumw2, self.stats, self.entries)
+
+        return h
+
+
+class RangeAccumulator:
+    """
+        Streaming histogram for branches whose range is taken from the data (see autorange='stream' in fillFiles).
+        Values are counted chunk after chunk on a fine provisional grid while the running min and max are tracked,
+        so the column never has to be resident in memory. The grid has at most FINE bins of width 2**exp with edges
+        on multiples of the width: when values fall outside the grid the width is doubled merging pairs of bins, so
+        accumulators of different chunks can always be merged exactly. At the end the fine bins are rebinned on the
+        requested binning between min and max (or between quantiles for outlier robust ranges).
+        Weighted values accumulate the sum of weights and of squared weights of the fine bins.
+    """
+
+    FINE = 16384
+
+    def __init__(self, nbins, quantiles=None):
+        """
+            nbins: number of bins of the final histogram
+            quantiles: (low, high) fractions such as (0.001, 0.999) to set the range on approximate quantiles
+                    instead of min and max. By default None
+        """
+        self.nbins = nbins
+        self.quantiles = quantiles
+        self.min = np.inf
+        self.max = -np.inf
+        self.exp = None
+        self.origin = 0 #fine bin k covers [k*2**exp, (k+1)*2**exp), counts[i] is bin origin+i
+        self.counts = np.zeros(0, dtype=np.float64)
+        self.sumw2 = None #sum of squared weights of the fine bins, None while unweighted (equal to counts)
+        self.entries = 0
+        self.nonfinite = 0 #sum of weights (and squared weights) of nan and inf values
+        self.nonfinite2 = 0
+        self.neginf = 0 #part of nonfinite from -inf values, they go in the underflow
+        self.neginf2 = 0
+
+    def _coarsen(self, exp):
+        """
+            Double the width of the fine bins until it is 2**exp, merging bins pairwise
+        """
+        while self.exp < exp:
+            k = np.floor_divide(self.origin + np.arange(len(self.counts)), 2)
+            self.origin = int(k[0]) if len(k) else self.origin//2
+            if len(k):
+                self.counts = np.bincount(k - self.origin, weights=self.counts)
+                if self.sumw2 is not None: self.sumw2 = np.bincount(k - self.origin, weights=self.sumw2)
+            self.exp += 1
+
+    def _cover(self, lo, hi):
+        """
+            Extend (and coarsen if needed) the grid to contain [lo, hi]
+        """
+        if self.exp is None:
+            span = hi - lo if hi > lo else max(abs(lo), 1.)*2.**-20
+            self.exp = int(np.ceil(np.log2(span/(self.FINE//2))))
+            self.origin = int(np.floor(lo/2.**self.exp))
+
+        while True:
+            w = 2.**self.exp
+            first = min(self.origin, int(np.floor(lo/w)))
+            last = max(self.origin + len(self.counts) - 1, int(np.floor(hi/w)))
+            if last - first + 1 <= self.FINE: break
+            self._coarsen(self.exp + 1)
+
+        grid = slice(self.origin - first, self.origin - first + len(self.counts))
+        counts = np.zeros(last - first + 1, dtype=np.float64)
+        counts[grid] = self.counts
+        if self.sumw2 is not None:
+            sumw2 = np.zeros(last - first + 1, dtype=np.float64)
+            sumw2[grid] = self.sumw2
+            self.sumw2 = sumw2
+        self.origin, self.counts = first, counts
+
+    def _weighted(self):
+        """
+            Start tracking squared weights
+        """
+        if self.sumw2 is None:
+            self.sumw2 = self.counts.copy()
+            self.nonfinite2 = self.nonfinite
+            self.neginf2 = self.neginf
+
+    def fill(self, val, weights=None):
+        """
+            Accumulate a chunk of values, with their weights if not None
+        """
+        x = toArray(val)
+        self.entries += len(x)
+        ok = np.isfinite(x)
+        finite = x[ok]
+        neginf = x == -np.inf
+        if weights is None:
+            w = None
+            self.nonfinite += len(x) - len(finite)
+            self.nonfinite2 += len(x) - len(finite)
+            self.neginf += np.count_nonzero(neginf)
+            self.neginf2 += np.count_nonzero(neginf)
+        else:
+            self._weighted()
+            w = toArray(weights)
+            assert len(w) == len(x), "[ERROR] weights and values have different dimensions"
+            self.nonfinite += w[~ok].sum()
+            self.nonfinite2 += (w[~ok]**2).sum()
+            self.neginf += w[neginf].sum()
+            self.neginf2 += (w[neginf]**2).sum()
+            w = w[ok]
+        if len(finite) == 0: return self
+
+        lo, hi = finite.min(), finite.max()
+        self.min, self.max = min(self.min, lo), max(self.max, hi)
+        self._cover(lo, hi)
+        k = np.floor(finite/2.**self.exp).astype(np.int64) - self.origin
+        self.counts += np.bincount(k, weights=w, minlength=len(self.counts))
+        if self.sumw2 is not None:
+            self.sumw2 += np.bincount(k, weights=None if w is None else w*w, minlength=len(self.counts))
+        return self
+
+    def copy(self):
+        acc = RangeAccumulator(self.nbins, self.quantiles)
+        acc.min, acc.max, acc.exp, acc.origin = self.min, self.max, self.exp, self.origin
+        acc.counts, acc.entries, acc.nonfinite, acc.nonfinite2 = self.counts.copy(), self.entries, self.nonfinite, self.nonfinite2
+        acc.neginf, acc.neginf2 = self.neginf, self.neginf2
+        acc.sumw2 = None if self.sumw2 is None else self.sumw2.copy()
+        return acc
+
+    def add(self, other):
+        """
+            Merge in place the accumulator of another chunk
+        """
+        if other.sumw2 is not None: self._weighted()
+        if self.sumw2 is not None:
+            other = other.copy()
+            other._weighted()
+        self.entries += other.entries
+        self.nonfinite += other.nonfinite
+        self.nonfinite2 += other.nonfinite2
+        self.neginf += other.neginf
+        self.neginf2 += other.neginf2
+        if other.exp is None: return self
+
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        if self.exp is None:
+            self.exp, self.origin, self.counts = other.exp, other.origin, other.counts.copy()
+            self.sumw2 = None if other.sumw2 is None else other.sumw2.copy()
+            return self
+
+        #same bin width for both grids, then the union of the two grids (which can coarsen again)
+        other = other.copy()
+        exp = max(self.exp, other.exp)
+        self._coarsen(exp)
+        other._coarsen(exp)
+        w = 2.**self.exp
+        self._cover(other.origin*w, (other.origin + len(other.counts) - 1)*w)
+        other._coarsen(self.exp)
+
+        k = other.origin + np.arange(len(other.counts)) - self.origin
+        self.counts += np.bincount(k, weights=other.counts, minlength=len(self.counts))
+        if self.sumw2 is not None:
+            self.sumw2 += np.bincount(k, weights=other.sumw2, minlength=len(self.counts))
+        return self
+
+    def finalize(self):
+        """
+            Return the Binned histogram on nbins bins between min and max (or the quantiles). Fine bins are
+            assigned to the final bin containing their center, so the result is approximate at the level of
+            the fine bin width, (max - min)/FINE at worst.
+        """
+        if self.exp is None:
+            return Binned.fromValues(np.full(self.entries, np.nan), self.nbins, 0, 0)
+
+        w = 2.**self.exp
+        #values of a fine bin are placed at its center, kept inside [min, max] for the bins at the edges (below max
+        #so that they are not in the overflow, exactly at the value if all the values are equal)
+        top = np.nextafter(self.max, -np.inf) if self.max > self.min else self.max
+        centers = np.clip((self.origin + np.arange(len(self.counts)) + 0.5)*w, self.min, top)
+        lo, hi = self.min, self.max
+        if self.quantiles is not None:
+            cdf = np.cumsum(self.counts)/self.counts.sum()
+            lo = max(lo, (self.origin + np.searchsorted(cdf, self.quantiles[0], side='right'))*w)
+            hi = min(hi, (self.origin + np.searchsorted(cdf, self.quantiles[1], side='left') + 1)*w)
+
+        if lo >= hi:
+            if self.sumw2 is None:
+                return Binned(self.nbins, float(lo), float(hi), values=np.repeat(centers, self.counts.astype(np.int64)))
+            filled = self.counts != 0
+            return Binned(self.nbins, float(lo), float(hi), values=centers[filled], weights=self.counts[filled])
+
+        contents, _, stats, _ = accumulate(centers, self.nbins, lo, hi, weights=self.counts)
+        contents[0] += self.neginf #-inf goes in the underflow, nan and inf in the overflow as in ROOT
+        contents[-1] += self.nonfinite - self.neginf
+        sumw2 = None
+        if self.sumw2 is None:
+            stats[1] = stats[0] #unweighted entries
+        else:
+            sumw2 = accumulate(centers, self.nbins, lo, hi, weights=self.sumw2)[0]
+            sumw2[0] += self.neginf2
+            sumw2[-1] += self.nonfinite2 - self.neginf2
+            stats[1] = sumw2[1:-1].sum()
+        return Binned(self.nbins, float(lo), float(hi), contents, sumw2, stats, self.entries)
+
+
+_sparse_setter_declared = False
+
+
+def _declareSparseSetter():
+    """
+        JIT the C++ loop setting the filled bins of a THnSparse, one call for all the bins
+    """
+    global _sparse_setter_declared
+    if _sparse_setter_declared: return
+
+    ROOT.gInterpreter.Declare("""
+    namespace HEPPlotter {
+    void setSparseBins(THnSparse &h, Long64_t n, const Int_t *coords, const Double_t *contents, const Double_t *sumw2) {
+       const Int_t ndim = h.GetNdimensions();
+       for (Long64_t k = 0; k < n; ++k) {
+          const Long64_t bin = h.GetBin(coords + k*ndim, kTRUE);
+          h.SetBinContent(bin, contents[k]);
+          if (sumw2) h.SetBinError2(bin, sumw2[k]);
+       }
+    }
+    }
+    """)
+    _sparse_setter_declared = True
+
+
+def cellIndex(vals, axes):
+    """
+        Vectorized global bin number of a multi-dimensional histogram, with the ordering of TH1::GetBin:
+        bin = bx + (nx+2)*(by + (ny+2)*bz), under/overflow included on every axis.
+        Arguments:
+        vals: list of np.ndarray of values, one per axis, of the same length
+        axes: list of (nbins, xmin, xmax) pairwise with vals
+
+        Returns the np.ndarray of global bins and the boolean mask of the entries in range on all the axes
+    """
+    cells = np.zeros(len(vals[0]), dtype=np.int64)
+    inside = np.ones(len(vals[0]), dtype=bool)
+    stride = 1
+    for x, (nbins, xmin, xmax) in zip(vals, axes):
+        bins = findBins(x, nbins, xmin, xmax)
+        inside &= (bins > 0) & (bins <= nbins)
+        cells += stride*bins
+        stride *= nbins + 2
+
+    return cells, inside
+
+
+def statsND(vals, w, inside):
+    """
+        Statistics of the in range entries in the order of TH2::GetStats (ndim=2) and TH3::GetStats (ndim=3):
+        sumw, sumw2, then sumwx, sumwx2 of every axis with the cross terms sumwxy (2D) or sumwxy, sumwxz, sumwyz (3D)
+    """
+    x = [v[inside] for v in vals]
+    w = np.ones(inside.sum()) if w is None else w[inside]
+    stats = [w.sum(), (w*w).sum()]
+    for i, xi in enumerate(x):
+        stats += [(w*xi).sum(), (w*xi*xi).sum()]
+        if i == 1: stats.append((w*x[0]*x[1]).sum())
+    if len(x) == 3:
+        stats += [(w*x[0]*x[2]).sum(), (w*x[1]*x[2]).sum()]
+
+    return np.array(stats, dtype=np.float64)
+
+
+class BinnedND:
+    """
+        Multi-dimensional histogram content kept as numpy arrays, the N-dimensional analogue of Binned.
+        Dense: contents (and sumw2) have one entry per cell, (nx+2)*(ny+2)*... with the TH1::GetBin ordering.
+        Sparse (dict of bins): only the filled cells are kept, cells is the sorted np.ndarray of their global
+        bin numbers and contents/sumw2 are pairwise with it, so empty cells take no memory.
+    """
+
+    def __init__(self, axes, contents, sumw2=None, stats=None, entries=0, cells=None):
+        self.axes = [(int(n), float(lo), float(hi)) for n, lo, hi in axes]
+        self.contents = contents
+        self.sumw2 = sumw2
+        self.stats = stats
+        self.entries = entries
+        self.cells = cells
+
+    def isSparse(self):
+        return self.cells is not None
+
+    def ncells(self):
+        return int(np.prod([n + 2 for n, _, _ in self.axes]))
+
+    @classmethod
+    def fromValues(cls, vals, axes, weights=None, sparse=False):
+        """
+            Bin the values of all the axes in one shot.
+            Arguments:
+            vals: list of list/np.ndarray of values, one per axis, of the same length
+            axes: list of (nbins, xmin, xmax) pairwise with vals
+            weights: per entry weights. By default None, every entry has weight 1
+            sparse: keep only the filled cells. By default False
+        """
+        vals = [toArray(v) for v in vals]
+        assert all(len(v) == len(vals[0]) for v in vals), "[ERROR] the variables of a multi-dimensional histogram have different dimensions"
+        w = None if weights is None else toArray(weights)
+        cells, inside = cellIndex(vals, axes)
+        stats = statsND(vals, w, inside)
+
+        if sparse:
+            cells, cells_inv = np.unique(cells, return_inverse=True)
+            contents = np.bincount(cells_inv, weights=w, minlength=len(cells)).astype(np.float64)
+            sumw2 = None if w is None else np.bincount(cells_inv, weights=w*w, minlength=len(cells))
+            return cls(axes, contents, sumw2, stats, len(vals[0]), cells)
+
+        ncells = int(np.prod([n + 2 for n, _, _ in axes]))
+        contents = np.bincount(cells, weights=w, minlength=ncells).astype(np.float64)
+        sumw2 = None if w is None else np.bincount(cells, weights=w*w, minlength=ncells)
+        return cls(axes, contents, sumw2, stats, len(vals[0]))
+
+    def add(self, other):
+        """
+            Merge in place another BinnedND with the same axes
+        """
+        assert self.axes == other.axes, "[ERROR] cannot merge histograms with different binning"
+        assert self.isSparse() == other.isSparse(), "[ERROR] cannot merge sparse and dense histograms"
+
+        sumw2 = lambda b: b.contents if b.sumw2 is None else b.sumw2
+        weighted = self.sumw2 is not None or other.sumw2 is not None
+        if self.isSparse():
+            cells, cells_inv = np.unique(np.concatenate([self.cells, other.cells]), return_inverse=True)
+            merge = lambda a, b: np.bincount(cells_inv, weights=np.concatenate([a, b]), minlength=len(cells))
+            if weighted: self.sumw2 = merge(sumw2(self), sumw2(other))
+            self.contents = merge(self.contents, other.contents)
+            self.cells = cells
+        else:
+            if weighted: self.sumw2 = sumw2(self) + sumw2(other)
+            self.contents = self.contents + other.contents
+        self.stats = self.stats + other.stats
+        self.entries += other.entries
+        return self
+
+    def dense(self):
+        """
+            Return the contents and sumw2 (None if unweighted) with one entry per cell
+        """
+        if not self.isSparse(): return self.contents, self.sumw2
+
+        contents = np.zeros(self.ncells(), dtype=np.float64)
+        contents[self.cells] = self.contents
+        sumw2 = None
+        if self.sumw2 is not None:
+            sumw2 = np.zeros(self.ncells(), dtype=np.float64)
+            sumw2[self.cells] = self.sumw2
+        return contents, sumw2
+
+    def toTH(self, name, title=None):
+        """
+            Build the ROOT.TH2F or ROOT.TH3F with these contents
+        """
+        assert len(self.axes) in (2, 3), "[ERROR] only 2 and 3 dimensional histograms can be TH2F/TH3F, use toTHnSparse"
+        title = name if title is None else title
+        binning = [a for axis in self.axes for a in axis]
+        h = ROOT.TH2F(name, title, *binning) if len(self.axes) == 2 else ROOT.TH3F(name, title, *binning)
+        contents, sumw2 = self.dense()
+        addContents(h, contents, sumw2, self.stats, self.entries)
+        return h
+
+    def toTHnSparse(self, name, title=None):
+        """
+            Build the ROOT.THnSparseD with these contents, any number of dimensions. Only the filled cells are set
+        """
+        ndim = len(self.axes)
+        h = ROOT.THnSparseD(name, name if title is None else title, ndim,
+                            np.array([n for n, _, _ in self.axes], dtype=np.int32),
+                            np.array([lo for _, lo, _ in self.axes], dtype=np.float64),
+                            np.array([hi for _, _, hi in self.axes], dtype=np.float64))
+        if self.sumw2 is not None: h.Sumw2()
+
+        if self.isSparse():
+            cells, contents, sumw2 = self.cells, self.contents, self.sumw2
+        else:
+            contents, sumw2 = self.contents, self.sumw2
+            cells = np.flatnonzero(contents != 0)
+            contents = contents[cells]
+            if sumw2 is not None: sumw2 = sumw2[cells]
+
+        #global bin -> bin on every axis
+        coords = np.empty((len(cells), ndim), dtype=np.int32)
+        rest = cells.copy()
+        for i, (n, _, _) in enumerate(self.axes):
+            rest, coords[:, i] = np.divmod(rest, n + 2)
+
+        _declareSparseSetter()
+        contents = np.ascontiguousarray(contents, dtype=np.float64)
+        sumw2 = np.ascontiguousarray(sumw2, dtype=np.float64) if sumw2 is not None else ROOT.nullptr
+        ROOT.HEPPlotter.setSparseBins(h, len(cells), coords, contents, sumw2)
+        h.SetEntries(self.entries)
+        return h
+
+
+class Profile:
+    """
+        Accumulators of a TProfile (mean of y in bins of x) as numpy arrays of nbins+2 cells: sum of weights, of squared
+        weights, of w*y and of w*y*y per bin, filled in one shot with np.bincount.
+    """
+
+    def __init__(self, nbins, xmin, xmax, sumw, sumw2, sumwy, sumwy2, stats, entries, weighted=False):
+        self.nbins = nbins
+        self.xmin = xmin
+        self.xmax = xmax
+        self.sumw = sumw
+        self.sumw2 = sumw2
+        self.sumwy = sumwy
+        self.sumwy2 = sumwy2
+        self.stats = stats
+        self.entries = entries
+        self.weighted = weighted
+
+    @classmethod
+    def fromValues(cls, x, y, nbins, xmin, xmax, weights=None):
+        """
+            Accumulate the pairs (x, y) with their weights (None for unweighted)
+        """
+        x, y = toArray(x), toArray(y)
+        assert len(x) == len(y), "[ERROR] x and y of the profile have different dimensions"
+        w = np.ones(len(x)) if weights is None else toArray(weights)
+        bins = findBins(x, nbins, float(xmin), float(xmax))
+        inside = (bins > 0) & (bins <= nbins)
+        count = lambda v: np.bincount(bins, weights=v, minlength=nbins+2)
+
+        wi, xi, yi = w[inside], x[inside], y[inside]
+        stats = np.array([wi.sum(), (wi*wi).sum(), (wi*xi).sum(), (wi*xi*xi).sum(), (wi*yi).sum(), (wi*yi*yi).sum()], dtype=np.float64)
+        return cls(nbins, float(xmin), float(xmax), count(w), count(w*w), count(w*y), count(w*y*y), stats, len(x), weights is not None)
+
+    def add(self, other):
+        """
+            Merge in place another Profile with the same binning
+        """
+        assert (self.nbins, self.xmin, self.xmax) == (other.nbins, other.xmin, other.xmax), "[ERROR] cannot merge profiles with different binning"
+        for name in ("sumw", "sumw2", "sumwy", "sumwy2", "stats"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.entries += other.entries
+        self.weighted = self.weighted or other.weighted
+        return self
+
+    def means(self):
+        """
+            Mean of y per bin (0 for empty bins)
+        """
+        return np.divide(self.sumwy, self.sumw, out=np.zeros_like(self.sumwy), where=self.sumw != 0)
+
+    def errors(self, option=''):
+        """
+            Errors per bin as TProfile::GetBinError: spread of y over the square root of the effective entries for
+            option '', spread of y for option 's'
+        """
+        mean = self.means()
+        filled = self.sumw != 0
+        spread = np.sqrt(np.abs(np.divide(self.sumwy2, self.sumw, out=np.zeros_like(self.sumwy2), where=filled) - mean*mean))
+        if option == 's': return spread
+
+        neff = np.divide(self.sumw*self.sumw, self.sumw2, out=np.zeros_like(self.sumw), where=self.sumw2 != 0)
+        return np.divide(spread, np.sqrt(neff), out=np.zeros_like(spread), where=neff != 0)
+
+    def toTProfile(self, name, title=None, option=''):
+        """
+            Build the ROOT.TProfile with these contents (bin entries are set bin by bin, never entry by entry)
+        """
+        h = ROOT.TProfile(name, name if title is None else title, self.nbins, self.xmin, self.xmax, option)
+        h.SetDirectory(0)
+        ncells = h.GetNcells()
+        np.frombuffer(h.GetArray(), dtype=np.float64, count=ncells)[:] = self.sumwy
+        np.frombuffer(h.GetSumw2().GetArray(), dtype=np.float64, count=ncells)[:] = self.sumwy2
+        for i in range(ncells):
+            h.SetBinEntries(i, self.sumw[i])
+        if self.weighted:
+            h.GetBinSumw2().Set(ncells, self.sumw2)
+        h.PutStats(self.stats.copy())
+        h.SetEntries(self.entries)
+        return h
+
+
+def efficiencyInterval(passed, total, level=0.682689, method='clopper_pearson', passed_w2=None, total_w2=None):
+    """
+        Efficiency and confidence interval of every bin at once.
+        Arguments:
+        passed, total: np.ndarray of passed and total (weighted) counts per bin
+        level: confidence level. By default 0.682689 (one sigma)
+        method: 'clopper_pearson' (default of TEfficiency), 'wilson' or 'normal'
+        passed_w2, total_w2: sum of squared weights per bin for weighted counts. 'clopper_pearson' and 'wilson' are then
+                computed on the effective number of entries total**2/total_w2, 'normal' on the variance of the weighted
+                ratio as TEfficiency does for weighted events. By default None, unweighted
+
+        Returns the np.ndarray of efficiencies, lower and upper bounds. Empty bins have efficiency 0 and interval [0, 1]
+    """
+    assert method in ('clopper_pearson', 'wilson', 'normal'), "[ERROR] unknown interval method {}".format(method)
+    passed, total = toArray(passed), toArray(total)
+    eff = np.divide(passed, total, out=np.zeros_like(total), where=total > 0)
+    n = total
+    if total_w2 is not None:
+        n = np.divide(total*total, total_w2, out=np.zeros_like(total), where=toArray(total_w2) > 0)
+    k = eff*n
+    empty = n <= 0
+    alpha = 1. - level
+
+    if method == 'clopper_pearson':
+        q = np.vectorize(ROOT.Math.beta_quantile, otypes=[np.float64])
+        low = np.where((k > 0) & ~empty, q(alpha/2., np.maximum(k, 1e-300), np.maximum(n - k + 1, 1e-300)), 0.)
+        high = np.where((k < n) & ~empty, q(1. - alpha/2., k + 1, np.maximum(n - k, 1e-300)), 1.)
+    else:
+        z = ROOT.Math.normal_quantile(1. - alpha/2., 1.)
+        nn = np.where(empty, 1., n)
+        if method == 'wilson':
+            center = (eff + z*z/(2.*nn))/(1. + z*z/nn)
+            half = z*np.sqrt(eff*(1. - eff)/nn + z*z/(4.*nn*nn))/(1. + z*z/nn)
+        elif total_w2 is None or passed_w2 is None:
+            center, half = eff, z*np.sqrt(eff*(1. - eff)/nn)
+        else:
+            #variance of the ratio of weighted sums, as TEfficiency does for weighted events
+            var = np.divide((1. - 2.*eff)*toArray(passed_w2) + eff*eff*toArray(total_w2), total*total, out=np.zeros_like(total), where=total != 0)
+            center, half = eff, z*np.sqrt(np.abs(var))
+        low, high = np.clip(center - half, 0., 1.), np.clip(center + half, 0., 1.)
+        low, high = np.where(empty, 0., low), np.where(empty, 1., high)
+
+    return eff, low, high
+
+
+class Efficiency:
+    """
+        Passed and total counts (and squared weights) in nbins+2 cells of x, the content of a TEfficiency,
+        filled in one shot with np.bincount.
+    """
+
+    def __init__(self, nbins, xmin, xmax, passed, total, passed_w2=None, total_w2=None, entries=0):
+        self.nbins = nbins
+        self.xmin = xmin
+        self.xmax = xmax
+        self.passed = passed
+        self.total = total
+        self.passed_w2 = passed_w2
+        self.total_w2 = total_w2
+        self.entries = entries
+
+    @classmethod
+    def fromValues(cls, x, passed, nbins, xmin, xmax, weights=None):
+        """
+            Accumulate the values x with the pass flags (anything non zero passes) and their weights (None for unweighted)
+        """
+        x, ok = toArray(x), toArray(passed) != 0
+        assert len(x) == len(ok), "[ERROR] x and pass flags of the efficiency have different dimensions"
+        bins = findBins(x, nbins, float(xmin), float(xmax))
+        count = lambda b, v: np.bincount(b, weights=v, minlength=nbins+2).astype(np.float64)
+
+        if weights is None:
+            return cls(nbins, float(xmin), float(xmax), count(bins[ok], None), count(bins, None), entries=len(x))
+
+        w = toArray(weights)
+        return cls(nbins, float(xmin), float(xmax), count(bins[ok], w[ok]), count(bins, w), count(bins[ok], w[ok]**2), count(bins, w*w), len(x))
+
+    def add(self, other):
+        """
+            Merge in place another Efficiency with the same binning
+        """
+        assert (self.nbins, self.xmin, self.xmax) == (other.nbins, other.xmin, other.xmax), "[ERROR] cannot merge efficiencies with different binning"
+        if self.total_w2 is not None or other.total_w2 is not None:
+            #unweighted counts have squared weights equal to the counts
+            self.passed_w2 = (self.passed if self.passed_w2 is None else self.passed_w2) + (other.passed if other.passed_w2 is None else other.passed_w2)
+            self.total_w2 = (self.total if self.total_w2 is None else self.total_w2) + (other.total if other.total_w2 is None else other.total_w2)
+        self.passed = self.passed + other.passed
+        self.total = self.total + other.total
+        self.entries += other.entries
+        return self
+
+    def interval(self, level=0.682689, method='clopper_pearson'):
+        """
+            Efficiency, lower and upper bound of every bin, see efficiencyInterval
+        """
+        return efficiencyInterval(self.passed, self.total, level, method, self.passed_w2, self.total_w2)
+
+    def toTEfficiency(self, name, title=None):
+        """
+            Build the ROOT.TEfficiency from the passed and total histograms
+        """
+        hists = []
+        for which, counts, w2 in (("passed", self.passed, self.passed_w2), ("total", self.total, self.total_w2)):
+            h = ROOT.TH1D(name + "_" + which, name if title is None else title, self.nbins, self.xmin, self.xmax)
+            h.SetDirectory(0) #not tied to the file open at the moment, nor replaced by a histogram with the same name
+            if w2 is not None:
+                sumw2View(h)[:] = w2
+            np.frombuffer(h.GetArray(), dtype=np.float64, count=h.GetNcells())[:] = counts
+            h.SetEntries(counts.sum())
+            hists.append(h)
+
+        eff = ROOT.TEfficiency(hists[0], hists[1])
+        eff.SetDirectory(0)
+        eff.SetName(name)
+        return eff
+
+
+def binBranches(path, tree, branches, bins, ranges, n_ev='all', first=0, selection=None, weights=None, quantiles=None, keep=False):
+    """
+        Read the branches of one file (or of one entry range of it) in a single pass and bin them.
+        Runs in the main process or in a worker of fillFiles.
+        Arguments:
+        path, tree: file and tree to read
+        branches: list of branches
+        bins: list of number of bins pairwise with branches
+        ranges: list of [min, max], 'all' or 'stream' pairwise with branches. 'stream' branches are accumulated
+                in a RangeAccumulator to be merged with the other chunks and finalized
+        n_ev, first: read n_ev events starting from entry first
+        selection: only entries passing this expression are binned, see Reader.readBranches
+        weights: branch or expression with the weight of the entries, see Reader.readBranches
+        quantiles: see RangeAccumulator
+        keep: return also the values read
+
+        Returns {branch: Binned or RangeAccumulator} and {branch: (values, weights)} with the values read (and their
+        weights, None if unweighted) if keep (empty otherwise)
+    """
+    columns = readBranches(path, tree, branches, n_ev, first, selection, weights)
+
+    binned, kept = {}, {}
+    for branch, b, r in zip(branches, bins, ranges):
+        column = columns.pop(branch) #release the column as soon as it is histogrammed
+        var, w = column.content, column.weights
+        if keep: kept[branch] = (var, w)
+        if r == 'stream':
+            binned[branch] = RangeAccumulator(b, quantiles).fill(var, w)
+            continue
+        if r == 'all':
+            r = [var.min(), var.max()] if len(var) else [0, 0]
+        binned[branch] = Binned.fromValues(var, b, r[0], r[1], w)
+
+    return binned, kept
+
+
+def _aligned(columns, variables):
+    """
+        Values (and weights) of the variables of a multi-dimensional histogram entry by entry: vector branches must
+        have the same number of elements per event, scalar branches are repeated for every element
+    """
+    cols = [columns[v] for v in variables]
+    jagged = [c for c in cols if c.isJagged()]
+    for c in jagged[1:]:
+        assert np.array_equal(c.offsets, jagged[0].offsets), "[ERROR] vector branches {} have different number of elements".format(variables)
+
+    if not len(jagged):
+        return [c.content for c in cols], cols[0].weights
+
+    counts = jagged[0].counts()
+    vals = [c.content if c.isJagged() else np.repeat(c.content, counts) for c in cols]
+    return vals, jagged[0].weights
+
+
+def binBranchesND(path, tree, variables, bins, ranges, n_ev='all', first=0, selection=None, weights=None, sparse=False):
+    """
+        Read the branches of many multi-dimensional histograms of one file in a single pass and bin them.
+        Arguments:
+        path, tree: file and tree to read
+        variables: list of tuples of branches such as [("pt", "eta"), ("pt", "eta", "phi")], one per histogram
+        bins: list pairwise with variables of lists of number of bins, one per axis
+        ranges: list pairwise with variables of lists of [min, max] or 'all', one per axis
+        n_ev, first, selection, weights: see binBranches
+        sparse: list of bool pairwise with variables, keep only the filled cells
+
+        Returns the list of BinnedND pairwise with variables
+    """
+    branches = list(dict.fromkeys(b for v in variables for b in v))
+    columns = readBranches(path, tree, branches, n_ev, first, selection, weights)
+
+    binned = []
+    for var, bins_, ranges_, sparse_ in zip(variables, bins, ranges, sparse):
+        vals, w = _aligned(columns, var)
+        axes = []
+        for x, b, r in zip(vals, bins_, ranges_):
+            if r == 'all':
+                r = [x.min(), x.max()] if len(x) else [0, 1]
+            if r[0] >= r[1]: r = [r[0], r[0] + 1] #single value: TH2F/TH3F need a valid range
+            axes.append((b, r[0], r[1]))
+        binned.append(BinnedND.fromValues(vals, axes, w, sparse_))
+
+    return binned
+
+
+def binPairs(path, tree, pairs, kinds, bins, ranges, n_ev='all', first=0, selection=None, weights=None):
+    """
+        Read the branches of many profiles and efficiencies of one file in a single pass and accumulate them.
+        Arguments:
+        path, tree: file and tree to read
+        pairs: list of (x, y) branches (or expressions, see Reader.readBranches). y is the profiled variable for
+                profiles and the pass flag for efficiencies
+        kinds: list of 'profile' or 'efficiency' pairwise with pairs
+        bins: list of number of bins on x pairwise with pairs
+        ranges: list of [min, max] or 'all' on x pairwise with pairs
+        n_ev, first, selection, weights: see binBranches
+
+        Returns the list of Profile or Efficiency pairwise with pairs
+    """
+    branches = list(dict.fromkeys(b for pair in pairs for b in pair))
+    columns = readBranches(path, tree, branches, n_ev, first, selection, weights)
+
+    filled = []
+    for pair, kind, b, r in zip(pairs, kinds, bins, ranges):
+        (x, y), w = _aligned(columns, pair)
+        if r == 'all':
+            r = [x.min(), x.max()] if len(x) else [0, 1]
+        if r[0] >= r[1]: r = [r[0], r[0] + 1]
+        filled.append((Profile if kind == 'profile' else Efficiency).fromValues(x, y, b, r[0], r[1], w))
+
+    return filled
+
+
+def selectionMask(mask, column):
+    """
+        Boolean mask of the values of a column from the values of a selection expression read as a column, with the
+        rules of the selection of Reader.readBranches: per event selections apply to all the values of the event, per
+        element selections to the elements of vector branches of the same size, otherwise to events with at least one
+        passing element
+    """
+    passed = mask.content != 0
+    if mask.isJagged() and column.isJagged() and np.array_equal(mask.offsets, column.offsets):
+        return passed
+    if mask.isJagged():
+        cumulative = np.concatenate([[0], np.cumsum(passed)])
+        passed = cumulative[mask.offsets[1:]] > cumulative[mask.offsets[:-1]]
+
+    return passed if not column.isJagged() else np.repeat(passed, column.counts())
+
+
+VARIATION_KEYS = ("branches", "weights", "selection")
+
+
+def binVariations(path, tree, branches, bins, ranges, variations, n_ev='all', first=0, selection=None, weights=None):
+    """
+        Fill the histograms of the nominal and of many systematic variations of one file in a single read: every branch,
+        alternative branch, weight and selection expression is read (decoded) once and every variation takes its values
+        from the shared columns.
+        Arguments:
+        path, tree, branches, bins, n_ev, first: see binBranches
+        ranges: list of [min, max] or 'all' pairwise with branches. 'all' ranges are taken from the nominal values and
+                used for all the variations, so that they share the binning
+        variations: {name: spec} with spec a dictionary with any of
+                "branches": {branch: alternative branch or expression} such as {"pt": "pt_jesUp"}
+                "weights": weight expression replacing weights such as "genWeight*puWeightUp"
+                "selection": selection expression replacing selection such as "pt_jesUp > 30"
+                The nominal ("nominal", empty spec) is always filled
+        selection, weights: nominal selection and weights, see Reader.readBranches
+
+        Returns {variation: {branch: Binned}}, nominal first
+    """
+    specs = {"nominal": {}}
+    specs.update(variations)
+    resolved = {}
+    for name, spec in specs.items():
+        assert all(key in VARIATION_KEYS for key in spec), "[ERROR] variation {} keys must be in {}".format(name, VARIATION_KEYS)
+        alternatives = spec.get("branches", {})
+        resolved[name] = ({b: alternatives.get(b, b) for b in branches}, spec.get("weights", weights), spec.get("selection", selection))
+
+    #a selection shared by all the variations is applied while reading, otherwise selections are read as columns
+    selections = set(sel for _, _, sel in resolved.values())
+    common = selections.pop() if len(selections) == 1 else None
+    read = [alt for names, _, _ in resolved.values() for alt in names.values()]
+    read += [w for _, w, _ in resolved.values() if w]
+    if len(selections): read += [sel for _, _, sel in resolved.values() if sel]
+    columns = readBranches(path, tree, list(dict.fromkeys(read)), n_ev, first, common)
+
+    filled = {}
+    for name, (names, w_expr, sel) in resolved.items():
+        filled[name] = {}
+        for i, (branch, b) in enumerate(zip(branches, bins)):
+            column = columns[names[branch]]
+            var = column.content
+            w = None if not w_expr else broadcast(columns[w_expr], column, w_expr).astype(np.float64)
+            if sel and sel != common:
+                passed = selectionMask(columns[sel], column)
+                var = var[passed]
+                if w is not None: w = w[passed]
+            if ranges[i] == 'all': #nominal comes first, its range is used by all the variations
+                ranges[i] = [var.min(), var.max()] if len(var) else [0, 0]
+            filled[name][branch] = Binned.fromValues(var, b, ranges[i][0], ranges[i][1], w)
+
+    return filled
+
+
+def branchLimits(path, tree, branches, n_ev='all', first=0, selection=None):
+    """
+        Return {branch: [min, max]} of the branches for the entries read (see binBranches)
+    """
+    columns = readBranches(path, tree, branches, n_ev, first, selection)
+    return {branch: [col.content.min(), col.content.max()] if len(col.content) else [np.inf, -np.inf] for branch, col in columns.items()}
+
+
+def _runJob(job):
+    function, args = job
+    return function(*args)
+
+
+def _run(function, args, workers):
+    """
+        Run function on every tuple of arguments, on a pool of processes if workers > 1.
+        The processes read with the backend of the current process
+    """
+    if workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(args)), initializer=setBackend, initargs=(getBackend(), getThreads())) as pool:
+            return list(pool.map(_runJob, [(function, a) for a in args]))
+
+    return [function(*a) for a in args]
+
+
+def fillFiles(jobs, workers=1, chunksize=None, autorange='exact', cache=None, columns=None, backend=None):
+    """
+        Fill the histograms of many files. Each file can be split in entry ranges of chunksize events
+        that are filled separately and merged, and the pieces can run on a pool of processes.
+        Arguments:
+        jobs: list of (path, tree, n_ev, branches, bins, ranges, selection, weights), see binBranches
+        workers: number of processes. By default 1, everything runs in the current process
+        chunksize: number of events per chunk. By default None, every file is read in one go
+        autorange: how ranges taken from the data ('all') are found.
+                'exact': min and max of the data. The column has to be read before binning (with an extra
+                        min/max pass when the file is split in chunks)
+                'stream': single pass, chunk after chunk (STREAM_CHUNKSIZE events if chunksize is None), with running
+                        min and max and a fine provisional histogram rebinned at the end (see RangeAccumulator)
+                (low, high): as 'stream' but the range is set on the approximate quantiles low and high
+                        of the data, robust against outliers
+        cache: Cache.HistoCache. Histograms found in the cache are not filled again, the others are stored
+                after filling. By default None
+        columns: Cache.ColumnCache where the values read are kept, with keys (path, tree, n_ev, branch, selection, weights), to be
+                binned again without reading. By default None
+        backend: backend reading the files, see Reader.setBackend. By default the current one
+
+        Returns a list pairwise with jobs of {branch: Binned}. The result does not depend on workers.
+    """
+    if backend is not None:
+        with useBackend(backend):
+            return fillFiles(jobs, workers, chunksize, autorange, cache, columns)
+
+    if cache is not None:
+        #serve what is cached and fill only the missing branches
+        keys, cached, missing = [], [], []
+        for path, tree, n_ev, branches, bins, ranges, selection, weights in jobs:
+            spec = {"n_ev": n_ev, "selection": selection, "weights": weights, "autorange": autorange, "chunksize": chunksize if autorange != 'exact' else None}
+            keys.append({br: cache.key(path, tree, br, bins=b, range=r, **spec) for br, b, r in zip(branches, bins, ranges)})
+            cached.append({br: cache.get(k) for br, k in keys[-1].items()})
+            if columns is not None:
+                #values to be kept are read anyway: a cached histogram does not bring its values
+                for br in branches:
+                    if columns.key(path, tree, n_ev, br, selection, weights) not in columns or \
+                            (weights and columns.key(path, tree, n_ev, br, selection, weights, 'weights') not in columns):
+                        cached[-1][br] = None
+            todo = [i for i, br in enumerate(branches) if cached[-1][br] is None]
+            missing.append((path, tree, n_ev, [branches[i] for i in todo], [bins[i] for i in todo], [ranges[i] for i in todo], selection, weights))
+
+        filled = fillFiles([job for job in missing if len(job[3])], workers, chunksize, autorange, None, columns)
+        filled = iter(filled)
+        results = []
+        for job, k, c in zip(missing, keys, cached):
+            binned = next(filled) if len(job[3]) else {}
+            for branch, b in binned.items():
+                cache.put(k[branch], b)
+            results.append({br: c[br] if c[br] is not None else binned[br] for br in k})
+        cache.evict()
+
+        return results
+
+    quantiles = None
+    if autorange != 'exact':
+        if autorange != 'stream': quantiles = tuple(autorange)
+        jobs = [(path, tree, n_ev, branches, bins, ['stream' if r == 'all' else r for r in ranges], selection, weights) for path, tree, n_ev, branches, bins, ranges, selection, weights in jobs]
+        if chunksize is None: chunksize = STREAM_CHUNKSIZE
+
+    chunks = []
+    for path, tree, n_ev, branches, bins, ranges, selection, weights in jobs:
+        chunks.append(entryRanges(path, tree, n_ev, chunksize) if chunksize else [(0, n_ev)])
+
+    #ranges taken from the data must be the same for all the chunks of a file: get the limits of the
+    #chunks first and take the global min and max
+    limits_args = []
+    for (path, tree, n_ev, branches, bins, ranges, selection, weights), ch in zip(jobs, chunks):
+        auto = [b for b, r in zip(branches, ranges) if r == 'all']
+        if len(ch) > 1 and len(auto):
+            limits_args += [(path, tree, auto, n, first, selection) for first, n in ch]
+    limits = iter(_run(branchLimits, limits_args, workers))
+
+    args = []
+    for (path, tree, n_ev, branches, bins, ranges, selection, weights), ch in zip(jobs, chunks):
+        auto = [b for b, r in zip(branches, ranges) if r == 'all']
+        if len(ch) > 1 and len(auto):
+            lim = [next(limits) for _ in ch]
+            global_ = {b: [min(l[b][0] for l in lim), max(l[b][1] for l in lim)] for b in auto}
+            global_ = {b: r if r[0] <= r[1] else [0, 0] for b, r in global_.items()} #nothing selected
+            ranges = [global_[b] if r == 'all' else r for b, r in zip(branches, ranges)]
+        args += [(path, tree, branches, bins, ranges, n, first, selection, weights, quantiles, columns is not None) for first, n in ch]
+
+    results = iter(_run(binBranches, args, workers))
+
+    filled = []
+    for (path, tree, n_ev, branches, bins, ranges, selection, weights), ch in zip(jobs, chunks):
+        binned, kept = next(results)
+        kept = {branch: [part] for branch, part in kept.items()}
+        for _ in ch[1:]:
+            parts, kept_parts = next(results)
+            for branch, part in parts.items():
+                binned[branch].add(part)
+            for branch, part in kept_parts.items():
+                kept[branch].append(part)
+        for branch, parts in kept.items():
+            var, w = [a[0] if a[0] is None or len(a) == 1 else np.concatenate(a) for a in zip(*parts)] #w is None if unweighted
+            columns.put(columns.key(path, tree, n_ev, branch, selection, weights), var)
+            if w is not None: columns.put(columns.key(path, tree, n_ev, branch, selection, weights, 'weights'), w)
+        for branch, b in binned.items():
+            if isinstance(b, RangeAccumulator): binned[branch] = b.finalize()
+        filled.append(binned)
+
+    return filled
+
+
+def fillFilesND(jobs, workers=1, backend=None):
+    """
+        Fill the multi-dimensional histograms of many files, one read per file, on a pool of processes if workers > 1.
+        Arguments:
+        jobs: list of (path, tree, n_ev, variables, bins, ranges, selection, weights, sparse), see binBranchesND
+        workers: number of processes. By default 1
+        backend: backend reading the files, see Reader.setBackend. By default the current one
+
+        Returns a list pairwise with jobs of lists of BinnedND pairwise with variables
+    """
+    with useBackend(backend):
+        return _run(binBranchesND, [(path, tree, variables, bins, ranges, n_ev, 0, selection, weights, sparse) for path, tree, n_ev, variables, bins, ranges, selection, weights, sparse in jobs], workers)
+
+
+def fillFilesPairs(jobs, workers=1, backend=None):
+    """
+        Fill the profiles and efficiencies of many files, one read per file, on a pool of processes if workers > 1.
+        Arguments:
+        jobs: list of (path, tree, n_ev, pairs, kinds, bins, ranges, selection, weights), see binPairs
+        workers: number of processes. By default 1
+        backend: backend reading the files, see Reader.setBackend. By default the current one
+
+        Returns a list pairwise with jobs of lists of Profile or Efficiency pairwise with pairs
+    """
+    with useBackend(backend):
+        return _run(binPairs, [(path, tree, pairs, kinds, bins, ranges, n_ev, 0, selection, weights) for path, tree, n_ev, pairs, kinds, bins, ranges, selection, weights in jobs], workers)
+
+
+def fillFilesVariations(jobs, workers=1, backend=None):
+    """
+        Fill the nominal and variation histograms of many files, one read per file, on a pool of processes if workers > 1.
+        Arguments:
+        jobs: list of (path, tree, n_ev, branches, bins, ranges, variations, selection, weights), see binVariations
+        workers: number of processes. By default 1
+        backend: backend reading the files, see Reader.setBackend. By default the current one
+
+        Returns a list pairwise with jobs of {variation: {branch: Binned}}
+    """
+    with useBackend(backend):
+        return _run(binVariations, [(path, tree, branches, bins, list(ranges), variations, n_ev, 0, selection, weights) for path, tree, n_ev, branches, bins, ranges, variations, selection, weights in jobs], workers)
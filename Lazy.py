@@ -0,0 +1,57 @@
+import sys
+import importlib
+
+#ROOT color index of kBlack, used as default argument without loading ROOT
+kBlack = 1
+
+
+class LazyModule:
+    """
+        Stand-in for a module imported only at the first access to one of its attributes, so that importing
+        Engine or plotter does not load ROOT, matplotlib or pandas until they are actually used.
+        Arguments:
+        name: name of the module such as "ROOT" or "matplotlib.pyplot"
+        setup: function called with the module right after the import. By default None
+    """
+
+    def __init__(self, name, setup=None):
+        self.__dict__["_name"] = name
+        self.__dict__["_setup"] = setup
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._setup is not None: self._setup(module)
+            self.__dict__["_module"] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return "<lazy module {}{}>".format(self._name, "" if self._module is None else " (loaded)")
+
+
+def isLoaded(name):
+    """
+        True if the module has already been imported by someone
+    """
+    return name in sys.modules
+
+
+def isSeries(val):
+    """
+        True if val is a pandas.Series. pandas is not imported for this: a Series exists only if pandas is loaded
+    """
+    return isLoaded("pandas") and isinstance(val, sys.modules["pandas"].Series)
+
+
+ROOT = LazyModule("ROOT")
+plt = LazyModule("matplotlib.pyplot")
@@ -0,0 +1,501 @@
+import os
+import re
+import ast
+import keyword
+import importlib.util
+from contextlib import contextmanager
+import numpy as np
+from Lazy import ROOT
+
+#branch element types: C++ type used for the flat buffer and the matching numpy dtype
+_TYPES = {
+    "float": ("float", np.float32), "Float_t": ("float", np.float32),
+    "double": ("double", np.float64), "Double_t": ("double", np.float64),
+    "int": ("int", np.int32), "Int_t": ("int", np.int32),
+    "unsigned int": ("unsigned int", np.uint32), "UInt_t": ("unsigned int", np.uint32),
+    "long": ("Long64_t", np.int64), "long long": ("Long64_t", np.int64), "Long64_t": ("Long64_t", np.int64),
+    "unsigned long": ("ULong64_t", np.uint64), "unsigned long long": ("ULong64_t", np.uint64), "ULong64_t": ("ULong64_t", np.uint64),
+    "short": ("short", np.int16), "Short_t": ("short", np.int16),
+    "unsigned short": ("unsigned short", np.uint16), "UShort_t": ("unsigned short", np.uint16),
+    "char": ("char", np.int8), "Char_t": ("char", np.int8),
+    "unsigned char": ("unsigned char", np.uint8), "UChar_t": ("unsigned char", np.uint8),
+    "bool": ("unsigned char", np.bool_), "Bool_t": ("unsigned char", np.bool_), #std::vector<bool> has no contiguous storage
+}
+
+_VECTORS = ("ROOT::VecOps::RVec<", "ROOT::RVec<", "RVec<", "std::vector<", "vector<")
+
+#names of the columns holding the selection and the weights of readBranches
+_SELECTION = "HEPPlotter_selection"
+_WEIGHT = "HEPPlotter_weight"
+_EXPRESSION = "HEPPlotter_expression{}" #columns defined from expressions given as branches
+
+_flattener_declared = False
+
+#reading backends: 'root' runs the event loop in C++ with RDataFrame, 'uproot' decompresses the baskets straight
+#into numpy arrays without the ROOT runtime
+BACKENDS = ("root", "uproot")
+_backend = None #None: HEPPLOTTER_BACKEND if set, otherwise 'root' if PyROOT is installed
+_threads = 1 #threads decompressing the baskets with the uproot backend
+
+
+def _declareFlattener():
+    """
+        JIT the C++ helper appending the values of a branch, event after event, to one contiguous
+        std::vector and recording the event offsets for vector branches
+    """
+    global _flattener_declared
+    if _flattener_declared: return
+
+
+    ROOT.gInterpreter.Declare("""
+    namespace HEPPlotter {
+    template <typename T>
+    struct Flattener {
+       std::vector<T> content;
+       std::vector<Long64_t> offsets{0};
+       template <typename V> bool push(const ROOT::RVec<V> &v) {
+          content.insert(content.end(), v.begin(), v.end());
+          offsets.push_back(content.size());
+          return true;
+       }
+       template <typename V> bool push(const V &v) {
+          content.push_back(v);
+          return true;
+       }
+       //element-wise selection: only the elements passing the mask, if the vector matches the mask
+       template <typename V, typename M> bool push(const ROOT::RVec<V> &v, const ROOT::RVec<M> &mask) {
+          if (v.size() != mask.size()) return push(v);
+          for (std::size_t i = 0; i < v.size(); ++i)
+             if (mask[i]) content.push_back(v[i]);
+          offsets.push_back(content.size());
+          return true;
+       }
+       template <typename V, typename M> bool push(const V &v, const ROOT::RVec<M> &) {
+          return push(v);
+       }
+    };
+    }
+    """)
+    _flattener_declared = True
+
+
+def _columnType(type_name):
+    """
+        From the RDataFrame column type return (is_vector, C++ element type, numpy dtype)
+    """
+    type_name = type_name.strip()
+    is_vector = False
+    for prefix in _VECTORS:
+        if type_name.startswith(prefix):
+            type_name = type_name[len(prefix):-1].strip()
+            is_vector = True
+            break
+
+    assert not type_name.startswith(_VECTORS), "[ERROR] nested vector branches are not supported"
+
+    cpp, dtype = _TYPES.get(type_name, ("double", np.float64))
+    return is_vector, cpp, dtype
+
+
+def _release(vec, dtype):
+    """
+        Move the content of a std::vector to an np.ndarray and free the C++ memory, so that at most one
+        column at a time is held twice
+    """
+    arr = np.frombuffer(vec.data(), dtype=dtype, count=vec.size()).copy() if vec.size() else np.array([], dtype=dtype)
+    vec.clear()
+    vec.shrink_to_fit()
+    return arr
+
+
+class Column:
+    """
+        Values read from one branch. content is one contiguous typed np.ndarray with all the values of the
+        branch, event after event. For vector branches offsets is an np.ndarray of dimension n_events+1 such
+        that the values of event i are content[offsets[i]:offsets[i+1]], for scalar branches offsets is None.
+        weights is None or an np.ndarray with the weight of each value of content.
+    """
+
+    def __init__(self, content, offsets=None, weights=None):
+        self.content = content
+        self.offsets = offsets
+        self.weights = weights
+
+    def __len__(self):
+        """
+            Number of events
+        """
+        if self.offsets is None: return len(self.content)
+        return len(self.offsets) - 1
+
+    def isJagged(self):
+        return self.offsets is not None
+
+    def counts(self):
+        """
+            Number of values per event
+        """
+        if self.offsets is None: return np.ones(len(self.content), dtype=np.int64)
+        return np.diff(self.offsets)
+
+
+def getBackend():
+    """
+        Name of the backend used by readBranches, branchNames and numEntries when none is given to the call
+    """
+    if _backend is not None: return _backend
+    if os.environ.get("HEPPLOTTER_BACKEND"): return os.environ["HEPPLOTTER_BACKEND"]
+    return "root" if importlib.util.find_spec("ROOT") is not None else "uproot"
+
+
+def getThreads():
+    """
+        Number of threads decompressing the baskets with the uproot backend
+    """
+    return _threads
+
+
+def setBackend(backend, threads=None):
+    """
+        Select the backend reading the trees for all the following calls, also inherited by the worker processes of Filler.
+        Arguments:
+        backend: 'root' (RDataFrame event loop in C++, needs PyROOT) or 'uproot' (baskets decompressed straight into
+                numpy arrays, no ROOT runtime needed). None goes back to the default: HEPPLOTTER_BACKEND environment variable
+                if set, otherwise 'root' if PyROOT is installed and 'uproot' if not
+        threads: number of threads decompressing and interpreting the baskets with the uproot backend. By default unchanged (1)
+
+        Returns the previous (backend, threads)
+    """
+    global _backend, _threads
+    assert backend is None or backend in BACKENDS, "[ERROR] unknown backend {}, choose among {}".format(backend, BACKENDS)
+    previous = (_backend, _threads)
+    _backend = backend
+    if threads is not None: _threads = int(threads)
+    return previous
+
+
+@contextmanager
+def useBackend(backend, threads=None):
+    """
+        Use backend (see setBackend) inside a with block, such as the reads of one fill. None keeps the current one
+    """
+    if backend is None and threads is None:
+        yield
+        return
+
+    previous = setBackend(backend if backend is not None else _backend, threads)
+    try:
+        yield
+    finally:
+        setBackend(*previous)
+
+
+def branchNames(path, tree, backend=None):
+    """
+        Return the list of branch names of a tree.
+        Arguments:
+        path: path to the .root file
+        tree: name of the tree inside the file such as "SaveAllJets/Jets"
+        backend: 'root' or 'uproot'. By default the one of getBackend
+    """
+    if (backend or getBackend()) == "uproot":
+        import uproot
+        with uproot.open(path) as f:
+            return f[tree].keys(recursive=False)
+
+    f = ROOT.TFile(path)
+    t = f.Get(tree)
+    names = [i.GetName() for i in t.GetListOfBranches()]
+    f.Close()
+
+    return names
+
+
+def numEntries(path, tree, backend=None):
+    """
+        Return the number of entries of a tree
+    """
+    if (backend or getBackend()) == "uproot":
+        import uproot
+        with uproot.open(path) as f:
+            return f[tree].num_entries
+
+    f = ROOT.TFile(path)
+    n = f.Get(tree).GetEntries()
+    f.Close()
+
+    return n
+
+
+def entryRanges(path, tree, n_ev='all', chunksize=100000):
+    """
+        Split the first n_ev entries of a tree in chunks of chunksize events.
+        Arguments:
+        path, tree: file and tree
+        n_ev: number of events to be split. If 'all' all the entries of the tree
+        chunksize: number of events per chunk
+
+        Returns a list of (first, n_ev) with the first entry and the number of events of each chunk
+    """
+    n = numEntries(path, tree)
+    if n_ev != 'all': n = min(n, int(n_ev))
+
+    return [(first, min(chunksize, n - first)) for first in range(0, n, chunksize)] or [(0, 0)]
+
+
+def broadcast(weight, column, branch):
+    """
+        Weights of the values of a column from the weight column: per event weights are repeated for every
+        element of vector branches, per element weights are taken as they are
+    """
+    if not weight.isJagged():
+        return weight.content if not column.isJagged() else np.repeat(weight.content, column.counts())
+
+    assert column.isJagged() and np.array_equal(weight.offsets, column.offsets), \
+        "[ERROR] per element weights do not match the elements of branch {}".format(branch)
+    return weight.content
+
+
+def readBranches(path, tree, branches, n_ev='all', first=0, selection=None, weights=None, backend=None):
+    """
+        Read all the requested branches of a tree in a single traversal of the file.
+        With the 'root' backend the event loop runs in C++ (RDataFrame) and appends the values of every branch to one
+        growable typed buffer. With the 'uproot' backend the baskets are decompressed straight into numpy arrays and
+        expressions are evaluated on whole columns. Either way the memory needed is the raw size of the columns: no per
+        event Python objects and no list of lists to be flattened.
+        Arguments:
+        path: path to the .root file
+        tree: name of the tree inside the file such as "SaveAllJets/Jets"
+        branches: list of branch names to be read. Names which are not columns of the tree are taken as C++ expressions
+                of the branches such as "pt*cosh(eta)" or "trigger && pt > 30" and computed in the event loop
+        n_ev: maximum number of events to read. If 'all' the full tree is read
+        first: first entry to be read. By default 0
+        selection: C++ expression of the branches such as "met > 50" or "pt > 30 && abs(eta) < 2.4", compiled once and
+                evaluated in the event loop, only passing entries are read. If it returns one value per event (scalar
+                branches) it selects events. If it returns one value per element (vector branches) it selects the
+                elements of the vector branches of the same size, and the events with at least one passing element
+                for the other branches. By default None, no selection
+        weights: branch name or C++ expression such as "genWeight*puWeight" giving the weight of the entries. Per event
+                weights are applied to every element of vector branches, per element weights (expression on vector
+                branches) to the elements of vector branches of the same size. By default None, unweighted
+        backend: 'root' or 'uproot', see setBackend. By default the one of getBackend. The uproot backend understands the
+                C++ expressions made of branches, numbers, arithmetic, comparisons, &&, ||, ! and the usual math functions
+                (abs, sqrt, exp, log, pow, cos, ..., TMath:: and std:: ones included) and the RVec reductions Sum, Any, All
+
+        Returns a dictionary {branch: Column}, with Column.weights set if weights
+    """
+    if not isinstance(branches, list): branches = [branches]
+    branches = list(dict.fromkeys(branches)) #every branch is read once
+
+    read = _readUproot if (backend or getBackend()) == "uproot" else _readRDataFrame
+    columns = read(path, tree, branches, n_ev, first, selection, weights)
+
+    if weights:
+        weight = columns.pop(_WEIGHT)
+        for branch, column in columns.items():
+            column.weights = broadcast(weight, column, branch).astype(np.float64)
+
+    return columns
+
+
+def _readRDataFrame(path, tree, branches, n_ev, first, selection, weights):
+    """
+        'root' backend of readBranches: one RDataFrame event loop pushing every branch to a Flattener.
+        Returns {branch: Column}, with the weights in the column _WEIGHT
+    """
+    assert not ROOT.IsImplicitMTEnabled(), "[ERROR] readBranches fills its buffers sequentially, disable ROOT implicit MT"
+
+    _declareFlattener()
+
+    df = ROOT.RDataFrame(tree, path)
+    if n_ev != 'all':
+        df = df.Range(int(first), int(first) + int(n_ev))
+    elif first:
+        df = df.Range(int(first), 0)
+
+    mask = ""
+    if selection:
+        df = df.Define(_SELECTION, selection)
+        if _columnType(df.GetColumnType(_SELECTION))[0]:
+            df = df.Filter("ROOT::VecOps::Any({})".format(_SELECTION))
+            mask = ", " + _SELECTION
+        else:
+            df = df.Filter(_SELECTION)
+
+    if weights:
+        df = df.Define(_WEIGHT, weights)
+
+    names = set(str(c) for c in df.GetColumnNames())
+    flatteners = {}
+    pushes = []
+    for branch in branches + ([_WEIGHT] if weights else []):
+        column = branch
+        if branch not in names:
+            column = _EXPRESSION.format(len(flatteners))
+            df = df.Define(column, branch)
+        is_vector, cpp, dtype = _columnType(df.GetColumnType(column))
+        fl = ROOT.HEPPlotter.Flattener[cpp]()
+        flatteners[branch] = (fl, is_vector, dtype)
+        pushes.append("reinterpret_cast<HEPPlotter::Flattener<{}>*>({})->push({}{})".format(cpp, ROOT.addressof(fl), column, mask))
+
+    #one jitted expression pushing every branch, evaluated once per event
+    df.Filter(" && ".join(pushes)).Count().GetValue()
+
+    columns = {}
+    for branch, (fl, is_vector, dtype) in flatteners.items():
+        offsets = _release(fl.offsets, np.int64) if is_vector else None
+        columns[branch] = Column(_release(fl.content, dtype), offsets)
+
+    return columns
+
+
+#functions of the C++ expressions known by the uproot backend, with TMath:: and std:: stripped
+_FUNCTIONS = {
+    "abs": np.absolute, "fabs": np.absolute, "Abs": np.absolute, "sqrt": np.sqrt, "Sqrt": np.sqrt,
+    "exp": np.exp, "Exp": np.exp, "log": np.log, "Log": np.log, "log10": np.log10, "Log10": np.log10,
+    "pow": np.power, "Power": np.power, "hypot": np.hypot, "Hypot": np.hypot,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "Sin": np.sin, "Cos": np.cos, "Tan": np.tan,
+    "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan, "atan2": np.arctan2, "ATan2": np.arctan2,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh, "SinH": np.sinh, "CosH": np.cosh, "TanH": np.tanh,
+    "min": np.minimum, "max": np.maximum, "Min": np.minimum, "Max": np.maximum,
+}
+
+
+#branches named after python keywords are renamed for ast.parse, and, or, not are C++ operators too
+_KEYWORDS = set(keyword.kwlist) - {"and", "or", "not", "True", "False", "None"}
+_RENAMED = "_kw_"
+
+
+class _CppToNumpy(ast.NodeTransformer):
+    """
+        Turn the logical operators of an expression into element-wise numpy functions, so that
+        and, or, ! act on whole columns, and give back their names to the branches named after python keywords
+    """
+
+    def visit_Name(self, node):
+        if node.id.startswith(_RENAMED) and node.id[len(_RENAMED):] in _KEYWORDS:
+            node.id = node.id[len(_RENAMED):]
+        return node
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        function = "logical_and" if isinstance(node.op, ast.And) else "logical_or"
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.Call(func=ast.Name(id=function, ctx=ast.Load()), args=[result, value], keywords=[])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Invert):
+            return ast.Call(func=ast.Name(id="logical_not", ctx=ast.Load()), args=[node.operand], keywords=[])
+        return node
+
+
+def _parse(expression):
+    """
+        Python syntax tree of a C++ expression of the branches. The C++ ! binds tighter than the comparisons,
+        as the python ~ it is written with, while the python not binds looser
+    """
+    if "~" in expression:
+        raise SyntaxError("[ERROR] bitwise ~ in {} is not supported by the uproot backend".format(expression))
+    python = re.sub(r"\b(?:std|TMath|ROOT::VecOps|VecOps)::", "", expression)
+    python = re.sub(r"\b({})\b".format("|".join(sorted(_KEYWORDS))), _RENAMED + r"\1", python)
+    python = python.replace("&&", " and ").replace("||", " or ")
+    python = re.sub(r"!(?!=)|\bnot\b", " ~", python)
+    python = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", python))
+    try:
+        tree = ast.parse(python.strip(), mode="eval")
+    except SyntaxError:
+        raise SyntaxError("[ERROR] expression {} is not understood by the uproot backend".format(expression))
+    return ast.fix_missing_locations(_CppToNumpy().visit(tree))
+
+
+def _toColumn(array, n):
+    """
+        Column from the awkward array (or number) resulting from reading or evaluating an expression on n events
+    """
+    import awkward as ak
+    if not isinstance(array, ak.Array):
+        array = np.asarray(array)
+        return Column(np.full(n, array) if array.ndim == 0 else array)
+
+    assert array.ndim <= 2, "[ERROR] nested vector branches are not supported"
+    if array.ndim == 1:
+        return Column(ak.to_numpy(array))
+
+    counts = ak.to_numpy(ak.num(array, axis=1)).astype(np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return Column(ak.to_numpy(ak.flatten(array, axis=1)), offsets)
+
+
+def _select(column, passing, mask):
+    """
+        Values of column passing the selection, as the Flattener of the 'root' backend: passing is the event mask and
+        mask the selection Column. A vector selection keeps the elements of the events where the column has the size
+        of the selection, and all the elements elsewhere
+    """
+    if not column.isJagged():
+        return Column(column.content[passing])
+
+    counts = column.counts()
+    keep = np.repeat(passing, counts)
+    if mask.isJagged():
+        same = counts == mask.counts()
+        keep[np.repeat(same, counts)] &= mask.content[np.repeat(same, mask.counts())].astype(bool)
+
+    events = np.repeat(np.arange(len(counts)), counts)[keep]
+    offsets = np.zeros(np.count_nonzero(passing) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(events, minlength=len(counts))[passing], out=offsets[1:])
+    return Column(column.content[keep], offsets)
+
+
+def _readUproot(path, tree, branches, n_ev, first, selection, weights):
+    """
+        'uproot' backend of readBranches: the branches needed by branches, selection and weights are read in one go
+        into awkward arrays, the expressions are evaluated on whole columns.
+        Returns {branch: Column}, with the weights in the column _WEIGHT
+    """
+    import uproot
+    import awkward as ak
+
+    expressions = dict((branch, branch) for branch in branches)
+    if weights: expressions[_WEIGHT] = weights
+    if selection: expressions[_SELECTION] = selection
+
+    executor = uproot.ThreadPoolExecutor(_threads) if _threads > 1 else None
+    with uproot.open(path, decompression_executor=executor, interpretation_executor=executor) as f:
+        t = f[tree]
+        names = set(t.keys())
+        parsed = {key: _parse(e) for key, e in expressions.items() if e not in names}
+        needed = set(e for key, e in expressions.items() if key not in parsed)
+        for key, node in parsed.items():
+            for n in ast.walk(node):
+                if isinstance(n, ast.Name) and n.id in names: needed.add(n.id)
+
+        stop = None if n_ev == 'all' else int(first) + int(n_ev)
+        arrays = t.arrays(sorted(needed), library="ak", entry_start=int(first), entry_stop=stop)
+        n = len(arrays)
+
+    namespace = dict(_FUNCTIONS, logical_and=np.logical_and, logical_or=np.logical_or, logical_not=np.logical_not,
+                     Sum=lambda x: ak.sum(x, axis=-1), Any=lambda x: ak.any(x, axis=-1), All=lambda x: ak.all(x, axis=-1))
+    namespace.update((name, arrays[name]) for name in needed)
+
+    columns = {}
+    for key, e in expressions.items():
+        if key in parsed:
+            unknown = [n.id for n in ast.walk(parsed[key]) if isinstance(n, ast.Name) and n.id not in namespace]
+            assert not unknown, "[ERROR] {} in {} are neither branches nor functions known by the uproot backend".format(unknown, e)
+            columns[key] = _toColumn(eval(compile(parsed[key], e, "eval"), {"__builtins__": {}}, namespace), n)
+        else:
+            columns[key] = _toColumn(arrays[e], n)
+
+    if selection:
+        mask = columns.pop(_SELECTION)
+        passing = mask.content.astype(bool)
+        if mask.isJagged():
+            passing = np.bincount(np.repeat(np.arange(n), mask.counts())[passing], minlength=n) > 0
+        columns = {key: _select(column, passing, mask) for key, column in columns.items()}
+
+    return columns
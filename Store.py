@@ -0,0 +1,450 @@
+import json
+from collections.abc import MutableMapping
+import numpy as np
+from Filler import axisEdges, contentView, sumw2View
+from Lazy import ROOT
+
+#version of the layout of the files written by saveCollections
+STORE_VERSION = 1
+
+#style of the histograms kept in .npz files: (getter, setter)
+_STYLE = {
+    "linecolor": ("GetLineColor", "SetLineColor"), "linestyle": ("GetLineStyle", "SetLineStyle"), "linewidth": ("GetLineWidth", "SetLineWidth"),
+    "fillcolor": ("GetFillColor", "SetFillColor"), "fillstyle": ("GetFillStyle", "SetFillStyle"),
+    "markercolor": ("GetMarkerColor", "SetMarkerColor"), "markerstyle": ("GetMarkerStyle", "SetMarkerStyle"), "markersize": ("GetMarkerSize", "SetMarkerSize"),
+}
+
+#order of the style columns of HistoArrays, and the style of the histograms filled from Filler.Binned besides
+#(fillcolor, fillstyle, linecolor, linestyle)
+_STYLE_ORDER = tuple(_STYLE)
+_BINNED_STYLE = {"linewidth": 1, "markercolor": 1, "markerstyle": 1, "markersize": 1.}
+
+_META = "HEPPlotter_meta" #name of the metadata in .root files and of the metadata array in .npz files
+
+
+def _axes(h):
+    return [h.GetXaxis(), h.GetYaxis(), h.GetZaxis()][:h.GetDimension()]
+
+
+def arrayable(h):
+    """
+        True if h can be described with numpy arrays by histoToArrays: TH1, TH2 or TH3 but not TProfile
+    """
+    return hasattr(h, "InheritsFrom") and h.InheritsFrom("TH1") and not h.InheritsFrom("TProfile")
+
+
+def histoToArrays(h):
+    """
+        Describe a TH1, TH2 or TH3 (F, D, I, S, C) with numpy arrays and a json-able dictionary.
+        Returns (arrays, meta): arrays {"edges0", ..., "contents", "stats", "sumw2" if any} with under/overflow cells
+        included, meta with class, name, title, entries, axis titles and style
+    """
+    assert arrayable(h), "[ERROR] {} ({}) can only be saved in .root files".format(h.GetName(), h.ClassName())
+
+    axes = _axes(h)
+    arrays = {"edges{}".format(i): axisEdges(axis) for i, axis in enumerate(axes)}
+    arrays["contents"] = contentView(h).copy()
+    if h.GetSumw2N(): arrays["sumw2"] = sumw2View(h).copy()
+    stats = np.zeros({1: 4, 2: 7, 3: 11}[len(axes)], dtype=np.float64)
+    h.GetStats(stats)
+    arrays["stats"] = stats
+
+    meta = {"class": h.ClassName(), "name": h.GetName(), "title": h.GetTitle(), "entries": h.GetEntries(),
+            "variable": [bool(axis.GetXbins().GetSize()) for axis in axes], "axis_titles": [axis.GetTitle() for axis in axes],
+            "style": {key: getattr(h, getter)() for key, (getter, _) in _STYLE.items()}}
+    return arrays, meta
+
+
+def histoFromArrays(arrays, meta):
+    """
+        Inverse of histoToArrays: build the histogram, not attached to any directory
+    """
+    edges = [np.ascontiguousarray(arrays["edges{}".format(i)], dtype=np.float64) for i in range(len(meta["variable"]))]
+    args = []
+    if any(meta["variable"]):
+        for e in edges: args += [len(e) - 1, e]
+    else:
+        for e in edges: args += [len(e) - 1, float(e[0]), float(e[-1])]
+
+    h = getattr(ROOT, meta["class"])(meta["name"], meta["title"], *args)
+    h.SetDirectory(0)
+    contentView(h)[:] = arrays["contents"]
+    if "sumw2" in arrays: sumw2View(h)[:] = arrays["sumw2"]
+    h.PutStats(np.ascontiguousarray(arrays["stats"], dtype=np.float64))
+    h.SetEntries(meta["entries"])
+
+    for axis, title in zip(_axes(h), meta["axis_titles"]):
+        axis.SetTitle(title)
+    for key, value in meta["style"].items():
+        getattr(h, _STYLE[key][1])(value)
+    return h
+
+
+def saveCollections(path, collections, variations=None):
+    """
+        Write collections of histograms in one file.
+        Arguments:
+        path: .root file (one directory per collection, every object written with its key; any ROOT object such as
+                TProfile, TEfficiency or THnSparse), .npz file (compressed numpy arrays of edges, contents, sumw2 and
+                statistics plus the style, for TH1, TH2 and TH3, readable without ROOT) or .hmap file (HistoArrays of all the
+                collections, memory-mapped back by loadCollections, for one dimensional histograms with fixed binning)
+        collections: {collection name: {key: histogram}} or {collection name: CompactCollection}
+        variations: {name: {variation: collection name}} groups of collections to be restored, see RootHisto.getVariations
+    """
+    meta = {"version": STORE_VERSION, "collections": {name: list(coll.keys()) for name, coll in collections.items()}, "variations": variations or {}}
+
+    if path.endswith(".root"):
+        f = ROOT.TFile(path, "RECREATE")
+        assert not f.IsZombie(), "[ERROR] cannot write {}".format(path)
+        for name, coll in collections.items():
+            d = f.mkdir(name)
+            for key, h in coll.items():
+                d.WriteTObject(h, key)
+        f.WriteTObject(ROOT.TNamed(_META, json.dumps(meta)), _META)
+        f.Close()
+        return
+
+    if path.endswith(".hmap"):
+        parts = []
+        meta["first"] = {}
+        for name, coll in collections.items():
+            meta["first"][name] = sum(len(p) for p in parts)
+            if isinstance(coll, CompactCollection):
+                parts.append(coll.compacted())
+            else:
+                parts += [compactTH1(h) for h in coll.values()]
+        HistoArrays.concatenate(parts).write(path, meta)
+        return
+
+    arrays = {}
+    meta["histograms"] = []
+    for name, coll in collections.items():
+        for key, h in coll.items():
+            a, m = histoToArrays(h)
+            i = len(meta["histograms"])
+            arrays.update(("h{}_{}".format(i, k), v) for k, v in a.items())
+            meta["histograms"].append(dict(m, collection=name, key=key, arrays=list(a)))
+    arrays[_META] = np.array(json.dumps(meta))
+    np.savez_compressed(path, **arrays)
+
+
+def loadCollections(path, names='all'):
+    """
+        Read the collections written by saveCollections.
+        Arguments:
+        path: .root, .npz or .hmap file
+        names: list of collection names to be read. By default 'all'
+
+        Returns ({collection name: {key: histogram}}, variations). The histograms do not belong to any directory.
+        Collections of .hmap files are CompactCollection sharing one memory-mapped HistoArrays: nothing is read until used
+    """
+    if path.endswith(".hmap"):
+        arrays, meta = HistoArrays.open(path)
+        collections = {}
+        for name, keys in meta["collections"].items():
+            if names != 'all' and name not in names: continue
+            first = meta["first"][name]
+            collections[name] = CompactCollection(arrays, keys, range(first, first + len(keys)))
+        return collections, meta["variations"]
+
+    if path.endswith(".root"):
+        f = ROOT.TFile(path)
+        assert not f.IsZombie(), "[ERROR] cannot read {}".format(path)
+        meta = json.loads(f.Get(_META).GetTitle())
+        collections = {}
+        for name, keys in meta["collections"].items():
+            if names != 'all' and name not in names: continue
+            d = f.Get(name)
+            collections[name] = {}
+            for key in keys:
+                h = d.Get(key)
+                if hasattr(h, "SetDirectory"): h.SetDirectory(0)
+                collections[name][key] = h
+        f.Close()
+        return collections, meta["variations"]
+
+    with np.load(path) as arrays:
+        meta = json.loads(str(arrays[_META]))
+        collections = {name: {} for name in meta["collections"] if names == 'all' or name in names}
+        for i, m in enumerate(meta["histograms"]):
+            if m["collection"] not in collections: continue
+            collections[m["collection"]][m["key"]] = histoFromArrays({k: arrays["h{}_{}".format(i, k)] for k in m["arrays"]}, m)
+
+    return collections, meta["variations"]
+
+
+_MAGIC = b"HEPPHMAP" #first bytes of the memory-mappable files of CompactCollection
+_ALIGN = 64
+
+
+def _fullStyles(styles):
+    """
+        Style columns in _STYLE_ORDER from rows (fillcolor, fillstyle, linecolor, linestyle), the others as _BINNED_STYLE
+    """
+    given = dict(zip(("fillcolor", "fillstyle", "linecolor", "linestyle"), np.asarray(styles, dtype=np.float64).T))
+    full = np.empty((len(styles), len(_STYLE_ORDER)), dtype=np.float64)
+    for j, key in enumerate(_STYLE_ORDER):
+        full[:, j] = given[key] if key in given else _BINNED_STYLE[key]
+    return full
+
+
+class HistoArrays:
+    """
+        Contents of many one dimensional histograms in a few contiguous numpy arrays: contents and sumw2 of all the
+        histograms one after the other (nbins+2 cells each, under/overflow included), and per histogram the offset of its
+        first cell, axis (nbins, xmin, xmax), statistics [sumw, sumw2, sumwx, sumwx2], entries, style (the _STYLE
+        attributes in _STYLE_ORDER) and whether sumw2 is stored in the histogram (weighted). Names, titles, axis titles
+        and classes (TH1F, TH1D, ...) are lists. The arrays can be written in one file and memory-mapped back.
+    """
+
+    ARRAYS = ("offsets", "axes", "stats", "entries", "styles", "weighted", "contents", "sumw2")
+
+    def __init__(self, offsets, axes, stats, entries, styles, contents, sumw2, names, titles, weighted=None, xtitles=None, ytitles=None,
+                 classes=None):
+        self.offsets = offsets
+        self.axes = axes
+        self.stats = stats
+        self.entries = entries
+        #files written before the whole style was stored had (fillcolor, fillstyle, linecolor, linestyle) only
+        self.styles = _fullStyles(styles) if styles.shape[1] == 4 else styles
+        self.contents = contents
+        self.sumw2 = sumw2
+        self.names = names
+        self.titles = titles
+        #files written before weighted was stored had Sumw2 on every TH1F
+        self.weighted = np.ones(len(names), dtype=np.uint8) if weighted is None else weighted
+        self.xtitles = [""]*len(names) if xtitles is None else xtitles
+        self.ytitles = [""]*len(names) if ytitles is None else ytitles
+        self.classes = ["TH1F"]*len(names) if classes is None else classes
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def fromBinned(cls, binned, names, styles):
+        """
+            Arguments:
+            binned: list of Filler.Binned with valid ranges
+            names: list of histogram names pairwise with binned
+            styles: list of (fillcolor, fillstyle, linecolor, linestyle) pairwise with binned
+        """
+        offsets = np.zeros(len(binned) + 1, dtype=np.int64)
+        np.cumsum([b.nbins + 2 for b in binned], out=offsets[1:])
+        contents = np.concatenate([b.contents for b in binned]) if len(binned) else np.zeros(0)
+        sumw2 = np.concatenate([b.contents if b.sumw2 is None else b.sumw2 for b in binned]) if len(binned) else np.zeros(0)
+        return cls(offsets, np.array([[b.nbins, b.xmin, b.xmax] for b in binned], dtype=np.float64).reshape(-1, 3),
+                   np.array([b.stats for b in binned], dtype=np.float64).reshape(-1, 4), np.array([b.entries for b in binned], dtype=np.float64),
+                   _fullStyles(np.array(styles, dtype=np.float64).reshape(-1, 4)), contents, sumw2, list(names), list(names),
+                   np.array([b.sumw2 is not None for b in binned], dtype=np.uint8))
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+            One HistoArrays with the histograms of all the parts, in order
+        """
+        if not len(parts):
+            return cls(np.zeros(1, dtype=np.int64), np.zeros((0, 3)), np.zeros((0, 4)), np.zeros(0), np.zeros((0, len(_STYLE_ORDER))), np.zeros(0), np.zeros(0),
+                       [], [], np.zeros(0, dtype=np.uint8))
+
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for p in parts:
+            offsets.append(p.offsets[1:] + offsets[-1][-1])
+        join = lambda name: np.concatenate([getattr(p, name) for p in parts])
+        lists = lambda name: sum([getattr(p, name) for p in parts], [])
+        return cls(np.concatenate(offsets), join("axes"), join("stats"), join("entries"), join("styles"), join("contents"), join("sumw2"),
+                   lists("names"), lists("titles"), join("weighted"), lists("xtitles"), lists("ytitles"), lists("classes"))
+
+    def take(self, indices):
+        """
+            HistoArrays with only the histograms at indices (copy)
+        """
+        cells = [np.arange(self.offsets[i], self.offsets[i+1]) for i in indices]
+        cells = np.concatenate(cells) if len(cells) else np.zeros(0, dtype=np.int64)
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.offsets)[indices], out=offsets[1:])
+        return HistoArrays(offsets, self.axes[indices], self.stats[indices], self.entries[indices], self.styles[indices],
+                           self.contents[cells], self.sumw2[cells], [self.names[i] for i in indices], [self.titles[i] for i in indices],
+                           self.weighted[indices], [self.xtitles[i] for i in indices], [self.ytitles[i] for i in indices],
+                           [self.classes[i] for i in indices])
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def toTH1(self, i):
+        """
+            Build the histogram i (of its class: TH1F, TH1D, ...), not attached to any directory
+        """
+        nbins, xmin, xmax = self.axes[i]
+        h = getattr(ROOT, self.classes[i])(self.names[i], self.titles[i], int(nbins), xmin, xmax)
+        h.SetDirectory(0)
+        cells = slice(self.offsets[i], self.offsets[i+1])
+        contentView(h)[:] = self.contents[cells]
+        if self.weighted[i]: sumw2View(h)[:] = self.sumw2[cells]
+        h.PutStats(np.array(self.stats[i], dtype=np.float64))
+        h.SetEntries(self.entries[i])
+        for key, value in zip(_STYLE_ORDER, self.styles[i]):
+            getattr(h, _STYLE[key][1])(float(value) if key == "markersize" else int(value))
+        h.GetXaxis().SetTitle(self.xtitles[i])
+        h.GetYaxis().SetTitle(self.ytitles[i])
+        return h
+
+    def write(self, path, index):
+        """
+            Write the arrays in one file: a json header (index, names, titles, axis titles, classes and where every array starts)
+            followed by the arrays, aligned so that they can be memory-mapped.
+            Arguments:
+            path: file to be written
+            index: json-able description of what is stored, given back by open
+        """
+        header = {"version": STORE_VERSION, "index": index, "names": self.names, "titles": self.titles, "xtitles": self.xtitles,
+                  "ytitles": self.ytitles, "classes": self.classes, "arrays": {}}
+        position = 0
+        for name in self.ARRAYS:
+            a = np.ascontiguousarray(getattr(self, name))
+            header["arrays"][name] = [position, a.dtype.str, list(a.shape)]
+            position += -(-a.nbytes // _ALIGN) * _ALIGN
+        raw = json.dumps(header).encode()
+        start = -(-(len(_MAGIC) + 8 + len(raw)) // _ALIGN) * _ALIGN
+
+        with open(path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(np.array([len(raw)], dtype="<u8").tobytes())
+            f.write(raw)
+            for name in self.ARRAYS:
+                f.seek(start + header["arrays"][name][0])
+                f.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+            f.truncate(start + position)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+            Memory-map a file written by write: nothing is read until used. Returns (HistoArrays, index)
+            Arguments:
+            mode: 'r' read only or 'r+' to modify the file in place (see np.memmap)
+        """
+        with open(path, "rb") as f:
+            assert f.read(len(_MAGIC)) == _MAGIC, "[ERROR] {} is not a file of histogram arrays".format(path)
+            size = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            header = json.loads(f.read(size))
+        start = -(-(len(_MAGIC) + 8 + size) // _ALIGN) * _ALIGN
+
+        arrays = {}
+        for name, (position, dtype, shape) in header["arrays"].items():
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mode, offset=start + position, shape=tuple(shape))
+        return cls(names=header["names"], titles=header["titles"], xtitles=header.get("xtitles"), ytitles=header.get("ytitles"),
+                   classes=header.get("classes"), **arrays), header["index"]
+
+
+class CompactCollection(MutableMapping):
+    """
+        Collection {key: TH1} kept as HistoArrays: a few bytes per bin and no ROOT object per histogram. A histogram is
+        built when its key is accessed (for drawing) and kept until release(). Bin contents are available as numpy
+        arrays without building anything (contents, sumw2, edges). Histograms set afterwards are kept as objects.
+    """
+
+    def __init__(self, arrays, keys, indices=None):
+        """
+            arrays: HistoArrays
+            keys: keys pairwise with indices
+            indices: positions in arrays of the histograms of the collection. By default all of them in order
+        """
+        self.arrays = arrays
+        self.index = dict(zip(keys, range(len(arrays)) if indices is None else indices))
+        self.built = {}
+
+    def __getitem__(self, key):
+        if key not in self.built:
+            self.built[key] = self.arrays.toTH1(self.index[key])
+        return self.built[key]
+
+    def __setitem__(self, key, value):
+        self.index[key] = None #the object replaces the arrays
+        self.built[key] = value
+
+    def __delitem__(self, key):
+        del self.index[key]
+        self.built.pop(key, None)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __repr__(self):
+        return "CompactCollection({} histograms, {} built)".format(len(self), len(self.built))
+
+    def release(self, keys=None):
+        """
+            Free the histograms built so far (all of them if keys is None). Changes made to them (style, ...) are lost
+        """
+        for key in (list(self.built) if keys is None else keys):
+            if self.index.get(key) is not None: self.built.pop(key, None)
+
+    def _cells(self, key):
+        i = self.index[key]
+        assert i is not None, "[ERROR] {} was set as an object, it has no arrays".format(key)
+        return slice(self.arrays.offsets[i], self.arrays.offsets[i+1]), i
+
+    def contents(self, key):
+        """
+            Bin contents of key, under/overflow included (view, no copy)
+        """
+        cells, _ = self._cells(key)
+        return self.arrays.contents[cells]
+
+    def sumw2(self, key):
+        """
+            Sum of squared weights of key, under/overflow included (view, no copy)
+        """
+        cells, _ = self._cells(key)
+        return self.arrays.sumw2[cells]
+
+    def edges(self, key):
+        """
+            Bin edges of key
+        """
+        _, i = self._cells(key)
+        nbins, xmin, xmax = self.arrays.axes[i]
+        return np.linspace(xmin, xmax, int(nbins) + 1)
+
+    def compacted(self):
+        """
+            HistoArrays with the histograms of the collection in order. Built histograms (possibly restyled or rebinned)
+            and histograms set as objects are taken as they are now
+        """
+        if not len(self.built):
+            return self.arrays.take(list(self.index.values()))
+
+        parts = [compactTH1(self.built[key]) if key in self.built else self.arrays.take([i]) for key, i in self.index.items()]
+        return HistoArrays.concatenate(parts)
+
+
+def compactable(h):
+    """
+        True if h can be stored in HistoArrays (.hmap files): one dimensional histogram with fixed binning
+    """
+    return hasattr(h, "InheritsFrom") and h.InheritsFrom("TH1") and h.GetDimension() == 1 and not h.InheritsFrom("TProfile") \
+        and not h.GetXaxis().GetXbins().GetSize()
+
+
+def compactTH1(h):
+    """
+        HistoArrays with the single one dimensional histogram h (fixed binning)
+    """
+    assert compactable(h), "[ERROR] {} cannot be compacted: only TH1 with fixed binning".format(h.GetName())
+    axis = h.GetXaxis()
+    stats = np.zeros(4, dtype=np.float64)
+    h.GetStats(stats)
+    contents = contentView(h).astype(np.float64)
+    return HistoArrays(np.array([0, len(contents)], dtype=np.int64), np.array([[axis.GetNbins(), axis.GetXmin(), axis.GetXmax()]], dtype=np.float64),
+                       stats.reshape(1, 4), np.array([h.GetEntries()], dtype=np.float64),
+                       np.array([[getattr(h, _STYLE[key][0])() for key in _STYLE_ORDER]], dtype=np.float64),
+                       contents, sumw2View(h).copy() if h.GetSumw2N() else contents.copy(), [h.GetName()], [h.GetTitle()],
+                       np.array([h.GetSumw2N() > 0], dtype=np.uint8), [axis.GetTitle()], [h.GetYaxis().GetTitle()], [h.ClassName()])
@@ -0,0 +1,439 @@
+"""
+    Benchmarks of the fill and plot hot paths of HEP_Plotter.
+
+    Synthetic .root files (scalar and vector branches) are generated on the fly and kept in --workdir.
+    Every case runs in a fresh process so that the peak memory of one case does not leak into the next one.
+    For every (case, size) the minimum and median wall time over --repeat runs, the peak resident memory
+    growth and the peak memory traced by tracemalloc (Python and numpy allocations) are recorded.
+
+    Usage (from the repository root):
+        python benchmarks/bench.py                                  #run, write benchmarks/results.json
+        python benchmarks/bench.py --sizes 1e4 1e5 1e6 1e7         #sizes of the synthetic trees
+        python benchmarks/bench.py --cases fillROOT histFromRoot    #only some cases
+        python benchmarks/bench.py --backend uproot                 #read the trees with uproot instead of RDataFrame
+        python benchmarks/bench.py --save-baseline                  #store the results as the new baseline
+        python benchmarks/bench.py --baseline benchmarks/baseline.json --tolerance 0.2
+
+    The run exits with status 1 if any case (or module import) is slower, or any case uses more memory, than the
+    baseline by more than the tolerance. Cases missing from the baseline are reported but not compared.
+    Timings depend on the machine: benchmarks/baseline.json was recorded on the machine named in its "meta", run
+    --save-baseline (on the code before your change) to get a baseline of your own machine before comparing.
+
+    Before the cases the import of every module of the package is timed in a fresh process: the run also exits
+    with status 1 if an import takes more than --import-budget seconds or loads ROOT, matplotlib or pandas,
+    which must be loaded only when used.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue as queue_
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOTDIR = os.path.dirname(HERE)
+
+TREE = "Events"
+BRANCHES = ["nJets", "pt", "eta", "met", "weight"]
+MIN_TIME = 0.005 #s, differences below this are not considered regressions
+MIN_MEMORY = 5. #MB, as above
+MIN_IMPORT_TIME = 0.05 #s, as above for the import times, noisier
+MODULES = ["Reader", "Filler", "Cache", "Engine", "plotter"] #modules whose import time is checked
+HEAVY = ["ROOT", "cppyy", "matplotlib", "pandas"] #must not be loaded by the imports of MODULES
+
+
+def makeFile(n, workdir):
+    """
+        Create (once) a synthetic tree of n entries with scalar (nJets, met, weight) and vector (pt, eta) branches
+    """
+    path = os.path.join(workdir, "bench_{}.root".format(n))
+    if os.path.exists(path): return path
+
+    import ROOT
+    ROOT.gRandom.SetSeed(12345)
+    df = ROOT.RDataFrame(n)
+    df = df.Define("nJets", "(int) gRandom->Poisson(5)")
+    df = df.Define("pt", "ROOT::RVec<float> v(nJets); for (auto &x : v) x = gRandom->Exp(50.); return v;")
+    df = df.Define("eta", "ROOT::RVec<float> v(nJets); for (auto &x : v) x = gRandom->Gaus(0., 2.); return v;")
+    df = df.Define("met", "(float) gRandom->Exp(40.)")
+    df = df.Define("weight", "gRandom->Gaus(1., 0.1)")
+    df.Snapshot(TREE, path + ".tmp", BRANCHES)
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+#---------- cases: setup(n, path, workdir) returns the callable to be timed ----------
+
+def _values(n, k=1):
+    import numpy as np
+    rng = np.random.default_rng(12345)
+    return [rng.normal(0, 1, n) for _ in range(k)]
+
+
+def setupFill(n, path, workdir):
+    from Engine import RootHisto
+    val = _values(n)[0]
+
+    def run():
+        RootHisto().fill(val, name_of=["bench", "x"], bins=50, ranges=[-5, 5])
+    return run
+
+
+def setupFillROOT(n, path, workdir):
+    from Engine import RootHisto
+
+    def run():
+        RootHisto().fillROOT([path], [TREE], ['all'], name_of=["bench"], branches=[BRANCHES], bins=30)
+    return run
+
+
+def setupHistFromRoot(n, path, workdir):
+    from plotter import Plotter
+
+    def run():
+        Plotter.RooPlot().histFromRoot(path, TREE, bins_=30)
+    return run
+
+
+def setupRooHist(n, path, workdir):
+    from plotter import Plotter
+    val = _values(n, 4)
+
+    def run():
+        Plotter.RooPlot().hist(val, ["h{}".format(i) for i in range(4)], bins_=50)
+    return run
+
+
+def setupPlotByName(n, path, workdir):
+    from plotter import Plotter
+    names = ["h{}".format(i) for i in range(4)]
+    p = Plotter.RooPlot()
+    p.namedHistos(names)
+    p.hist(_values(n, 4), names, named=True, bins_=50, ranges=[[-5, 5]]*4)
+    p.cmsText()
+    out = os.path.join(workdir, "plotByName_{}.png")
+
+    def run():
+        for i, c in enumerate(p.plotByName(names, legend_=(.7, .7, .9, .9))):
+            c.SaveAs(out.format(i))
+            c.Close()
+    return run
+
+
+def setupExportByName(n, path, workdir):
+    from plotter import Plotter
+    names = ["h{}".format(i) for i in range(4)]
+    p = Plotter.RooPlot()
+    p.namedHistos(names)
+    p.hist(_values(n, 4), names, named=True, bins_=50, ranges=[[-5, 5]]*4)
+    p.cmsText()
+    out = os.path.join(workdir, "exportByName")
+
+    def run():
+        p.exportByName(names, out, legend_=(.7, .7, .9, .9))
+    return run
+
+
+def setupSubPlotsHist(n, path, workdir):
+    import matplotlib.pyplot as plt
+    from plotter import Plotter
+    val = _values(n, 4)
+
+    def run():
+        s = Plotter.SubPlots(2, 2, (10, 10))
+        s.hist(val, bins_=50)
+        s.figure.canvas.draw()
+        plt.close(s.figure)
+    return run
+
+
+CASES = {
+    "fill": setupFill,
+    "fillROOT": setupFillROOT,
+    "histFromRoot": setupHistFromRoot,
+    "RooPlot.hist": setupRooHist,
+    "plotByName": setupPlotByName,
+    "exportByName": setupExportByName,
+    "SubPlots.hist": setupSubPlotsHist,
+}
+
+
+#---------- measurement ----------
+
+def _rssMB():
+    """
+        Current resident memory of the process in MB (peak resident memory if /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.**2
+    except (OSError, ValueError):
+        return _maxRssMB()
+
+
+def _resetPeak():
+    """
+        Reset the peak resident memory of the process to the current one (Linux only), so that the peak of the
+        imports and of the setup is not attributed to the case
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _maxRssMB():
+    """
+        Peak resident memory of the process in MB
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024.
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.**2 if sys.platform == "darwin" else peak / 1024. #bytes on macOS, kB on Linux
+
+
+def _measure(case, n, path, workdir, repeat):
+    """
+        Body of the child process: time one case and record its memory
+    """
+    sys.path.insert(0, ROOTDIR)
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    t0 = time.perf_counter()
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning
+    import_time = time.perf_counter() - t0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = CASES[case](n, path, workdir)
+
+        _resetPeak()
+        rss0 = _rssMB()
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t0)
+        peak_rss = max(_maxRssMB() - rss0, 0.)
+
+        tracemalloc.start()
+        run()
+        peak_traced = tracemalloc.get_traced_memory()[1] / 1024.**2
+        tracemalloc.stop()
+
+    #the first run includes the JIT compilation of the RDataFrame expressions
+    return {"time_min": min(times), "time_median": statistics.median(times), "time_first": times[0], "times": times,
+            "peak_rss_mb": peak_rss, "peak_traced_mb": peak_traced, "import_time": import_time}
+
+
+def _child(queue, *args):
+    try:
+        queue.put(_measure(*args))
+    except Exception as e:
+        queue.put({"error": "{}: {}".format(type(e).__name__, e)})
+
+
+def _importTime(module):
+    """
+        Body of the child process: time the import of module and list the heavy modules it loaded
+    """
+    sys.path.insert(0, ROOTDIR)
+    t0 = time.perf_counter()
+    importlib.import_module(module)
+    return {"import_time": time.perf_counter() - t0, "loaded": [m for m in HEAVY if m in sys.modules]}
+
+
+def _importChild(queue, module):
+    try:
+        queue.put(_importTime(module))
+    except Exception as e:
+        queue.put({"error": "{}: {}".format(type(e).__name__, e)})
+
+
+def measure(case, n, path, workdir, repeat):
+    """
+        Run one case in a fresh process and return its measurements
+    """
+    return _spawn(_child, (case, n, path, workdir, repeat))
+
+
+def measureImport(module):
+    """
+        Import module in a fresh process and return the import time and the heavy modules loaded
+    """
+    return _spawn(_importChild, (module,))
+
+
+def _spawn(target, args):
+    """
+        Run target(queue, *args) in a fresh process and return what it puts in the queue
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=target, args=(queue,) + tuple(args))
+    p.start()
+    while True:
+        try:
+            res = queue.get(timeout=1)
+            break
+        except queue_.Empty:
+            if not p.is_alive(): #crashed in C++, nothing will come
+                res = {"error": "process exited with code {}".format(p.exitcode)}
+                break
+    p.join()
+    return res
+
+
+def compare(results, baseline, tolerance):
+    """
+        Compare results with a baseline. Return the list of regressions as strings
+    """
+    regressions = []
+    print("\n{:<16} {:>10} {:>12} {:>12} {:>8} {:>12} {:>8}".format("case", "entries", "time [s]", "base [s]", "ratio", "rss [MB]", "ratio"))
+    for key, res in sorted(results.items()):
+        base = baseline.get(key)
+        case, n = key.rsplit("/", 1)
+        if "error" in res:
+            print("{:<16} {:>10} {}".format(case, n, res["error"]))
+            continue
+        if base is None or "error" in base:
+            print("{:<16} {:>10} {:>12.4f} {:>12} {:>8} {:>12.1f}".format(case, n, res["time_min"], "-", "-", res["peak_rss_mb"]))
+            continue
+
+        t_ratio = res["time_min"] / base["time_min"] if base["time_min"] > 0 else float("inf")
+        m_ratio = res["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] > 0 else float("inf")
+        flag = ""
+        if res["time_min"] - base["time_min"] > max(tolerance * base["time_min"], MIN_TIME):
+            regressions.append("{}: time {:.4f}s -> {:.4f}s".format(key, base["time_min"], res["time_min"]))
+            flag += " SLOWER"
+        if res["peak_rss_mb"] - base["peak_rss_mb"] > max(tolerance * base["peak_rss_mb"], MIN_MEMORY):
+            regressions.append("{}: memory {:.1f}MB -> {:.1f}MB".format(key, base["peak_rss_mb"], res["peak_rss_mb"]))
+            flag += " MORE MEMORY"
+        print("{:<16} {:>10} {:>12.4f} {:>12.4f} {:>8.2f} {:>12.1f} {:>8.2f}{}".format(case, n, res["time_min"], base["time_min"], t_ratio, res["peak_rss_mb"], m_ratio, flag))
+
+    return regressions
+
+
+def compareImports(imports, baseline, tolerance):
+    """
+        Compare import times with the ones of a baseline. Return the list of regressions as strings
+    """
+    regressions = []
+    for module, res in sorted(imports.items()):
+        base = baseline.get(module)
+        if "error" in res or base is None or "error" in base: continue
+        if res["import_time"] - base["import_time"] > max(tolerance * base["import_time"], MIN_IMPORT_TIME):
+            regressions.append("import {}: {:.4f}s -> {:.4f}s".format(module, base["import_time"], res["import_time"]))
+    return regressions
+
+
+def checkImports(imports, budget):
+    """
+        Return the list of imports over the time budget or loading heavy modules, as strings
+    """
+    violations = []
+    for module, res in sorted(imports.items()):
+        if "error" in res:
+            violations.append("{}: {}".format(module, res["error"]))
+            continue
+        if res["import_time"] > budget:
+            violations.append("{}: import {:.3f}s > budget {:.3f}s".format(module, res["import_time"], budget))
+        if res["loaded"]:
+            violations.append("{}: import loads {}".format(module, ", ".join(res["loaded"])))
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the fill and plot hot paths")
+    parser.add_argument("--sizes", nargs="+", default=["1e4", "1e5", "1e6"], help="number of entries of the synthetic trees")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES), help="cases to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--workdir", default=os.path.join(HERE, "data"), help="directory of the synthetic files")
+    parser.add_argument("--output", default=os.path.join(HERE, "results.json"), help="machine readable results")
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"), help="baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slow down / memory growth")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--import-budget", type=float, default=1., help="maximum import time in seconds of each module")
+    parser.add_argument("--backend", choices=["root", "uproot"], default=None, help="backend reading the trees, see Reader.setBackend")
+    args = parser.parse_args()
+
+    if args.backend: os.environ["HEPPLOTTER_BACKEND"] = args.backend #inherited by the processes of the cases
+
+    if not os.path.isdir(args.workdir): os.makedirs(args.workdir)
+    sizes = [int(float(s)) for s in args.sizes]
+
+    print("[INFO] Import times")
+    imports = {}
+    for module in MODULES:
+        imports[module] = measureImport(module)
+        if "error" in imports[module]:
+            print("[ERROR] import {}: {}".format(module, imports[module]["error"]))
+        else:
+            print("    {:<16} {:.4f} s  {}".format(module, imports[module]["import_time"], ", ".join(imports[module]["loaded"])))
+    violations = checkImports(imports, args.import_budget)
+
+    results = {}
+    for n in sizes:
+        print("[INFO] Synthetic tree with {} entries".format(n))
+        path = makeFile(n, args.workdir)
+        for case in args.cases:
+            res = measure(case, n, path, args.workdir, args.repeat)
+            results["{}/{}".format(case, n)] = res
+            if "error" in res:
+                print("[ERROR] {} {}: {}".format(case, n, res["error"]))
+            else:
+                print("    {:<16} {:.4f} s  {:.1f} MB".format(case, res["time_min"], res["peak_rss_mb"]))
+
+    meta = {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"), "repeat": args.repeat,
+            "backend": os.environ.get("HEPPLOTTER_BACKEND", "default")}
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results, "imports": imports}, f, indent=1, sort_keys=True)
+    print("[INFO] Results written to {}".format(args.output))
+
+    if violations:
+        print("\n[ERROR] Import budget of {}s:".format(args.import_budget))
+        for v in violations: print("    " + v)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": meta, "results": results, "imports": imports}, f, indent=1, sort_keys=True)
+        print("[INFO] Baseline written to {}".format(args.baseline))
+        if violations: sys.exit(1)
+        return
+
+    if not os.path.exists(args.baseline):
+        print("[INFO] No baseline at {}, nothing to compare with".format(args.baseline))
+        if violations: sys.exit(1)
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("node") != meta["node"]:
+        print("[INFO] Baseline recorded on {}, not on this machine ({}): store your own with --save-baseline".format(baseline["meta"].get("node"), meta["node"]))
+    regressions = compare(results, baseline["results"], args.tolerance)
+    regressions += compareImports(imports, baseline.get("imports", {}), args.tolerance)
+    if regressions:
+        print("\n[ERROR] Regressions with respect to {}:".format(args.baseline))
+        for r in regressions: print("    " + r)
+    if regressions or violations:
+        sys.exit(1)
+    print("\n[INFO] No regressions with respect to {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
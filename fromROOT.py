@@ -29,10 +29,6 @@ r = Plotter.RooPlot()
 #r.namedHistos(['l1_pt', 'l1_et'])
 r.histFromRoot(path=file_path , tree="SaveAllJets/Jets", named=True)
 r.print()
-c = r.plotByName(names='all', legend_=(0.89, 0.89, 0.6, 0.7))
-ky = r.getKeys()
-
-for name, canvas in zip(ky, c):
-    save_path = path + name + ".png"
-    canvas.SaveAs(save_path)
+#one canvas at a time is drawn, saved and freed (batch mode), workers processes share the branches
+r.exportByName(names='all', output=path, formats=["png"], legend_=(0.89, 0.89, 0.6, 0.7), workers=4)
 
@@ -1,8 +1,20 @@
 import numpy as np 
-import matplotlib.pyplot as plt 
-import pandas as pd
 import sys
-import ROOT
+import os
+import contextlib
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from Reader import branchNames
+from Filler import bulkFill, fillFiles, fillFilesND, axisEdges, contentView, sumw2View, toArray, valueRange
+from Cache import getCache
+from Store import arrayable, histoToArrays, histoFromArrays
+from Lazy import ROOT, plt, kBlack, isSeries
+
+EXPORT_FORMATS = ("png", "pdf", "svg", "eps", "jpg", "root", "C") #formats written by RooPlot.exportByName
+_CANVAS_IDS = itertools.count() #unique names of the canvases of CanvasPool
+PANEL_METHODS = ("hist", "scatter", "xLabel", "yLabel", "addText", "addTextAll", "legend", "setTickSize", "setNotation") #SubPlots methods usable in specs
+BinnedHisto = namedtuple("BinnedHisto", ["edges", "counts", "errors"], defaults=[None]) #already binned histogram drawn by SubPlots.hist
 
 class Plotter:
 
@@ -45,34 +57,50 @@ class Plotter:
             self.dpi = dpi_
             self.figure, self.axes = plt.subplots(n,m, figsize=size, dpi= dpi_)
 
+        @staticmethod
+        def fromSpec(spec):
+            """
+                Build the figure described by a declarative spec:
+                spec: {"grid": (n, m), "size": (,) by default (10, 10), "dpi": by default 100,
+                        "panels": [{"method": name of a method in PANEL_METHODS, other keys: its arguments}, ...]}
+                        such as {"grid": (2, 2), "panels": [{"method": "hist", "val": [a, b, c, d], "bins_": 40},
+                        {"method": "xLabel", "lab": "p_T", "all_": True}]}. The panels are applied in order
+            """
+            _checkSpec(spec)
+            s = Plotter.SubPlots(spec["grid"][0], spec["grid"][1], spec.get("size", (10, 10)), spec.get("dpi", 100))
+            for panel in spec.get("panels", []):
+                args = {key: value for key, value in panel.items() if key != "method"}
+                getattr(s, panel["method"])(**args)
+            return s
+
         def getAx(self):
             """
                 Return current axes and figure
             """
             return self.figure, self.axes
 
-        def hist(self, val, n=1, m=1, label_="histo",  histtype_='step', color_='fuchsia', bins_=50, ret=False, density_=True, range_=(0,0)):
+        def hist(self, val, n=1, m=1, label_="histo",  histtype_='step', color_='fuchsia', bins_=50, ret=False, density_=True, range_=(0,0), errors_=True):
             """
                 Plot histograms on subplots. Different ways to plot:
-                val: single list/numpy/pd.series of values to be histogrammed. Can also be a list of list
+                val: single list/numpy/pd.series of values to be histogrammed. Can also be a list of list.
+                        Already binned histograms are drawn as they are with ax.stairs, without histogramming again: a ROOT TH1
+                        (such as the ones of RooPlot or RootHisto) or a BinnedHisto(edges, counts, errors=None), alone or in the
+                        list. Drawing them costs the same whatever the number of entries. Plain tuples are values, not bins
                 n: x coordinate of the subplot. Must be integer. By default = 1 but not needed when val is type nested list
                 m: y coordinate of the subplot. Must be integer. By default = 1 but not needed when val is type nested list
                 label_: label of histograms. By default "histo", can be a list of dimension equal to val dimension
                 histtype_ : type of plotting hystos. By default step for everyone, can be a list of dimension equal to val dimension
                 color_: color of histograms. By default = 'fuchsia' for everyone, can be a list of dimension equal to val dimension
-                bins_: number of bins. By default 50 for everyone, can be a list of dimension equal to val dimension
+                bins_: number of bins. By default 50 for everyone, can be a list of dimension equal to val dimension. Not used by binned histograms
                 ret: if you want current figure or axis after plot
                 density_ : Normalize to unit area all histos in input
-                range_: range of histograms. By default min(val), max(val) for every item in val, otherwise can be a list of dimension equal to val dimension
+                range_: range of histograms. By default min(val), max(val) for every item in val, otherwise can be a list of dimension equal to val dimension.
+                        Not used by binned histograms
+                errors_: draw the errors of binned histograms (sqrt of sumw2 for TH1) as error bars. By default True
             """
-            if isinstance(val[0],(list,pd.core.series.Series,np.ndarray)):
+            if not isBinned(val) and (isinstance(val[0],(list,np.ndarray)) or isSeries(val[0]) or isBinned(val[0])):
                 if not isinstance(range_, list):
-                    range_ = []
-                    for v in val:
-                        if type(v) == list:
-                            range_.append((min(v), max(v)))
-                        else:
-                            range_.append((v.min(), v.max()))
+                    range_ = [None if isBinned(v) else valueRange(v) for v in val]
 
                 if not isinstance(label_, list):
                     label_ = [label_]*len(val)
@@ -87,22 +115,38 @@ class Plotter:
                     color_ = [color_]*len(val)
 
                 for v, ax, col, b, lab, ra, ht in zip(val, self.axes.flat, color_, bins_, label_, range_, histtype_ ):
-                    ax.hist(v, histtype=ht, bins=b, color=col, label=lab, range=ra)
+                    self._hist(ax, v, ht, b, col, lab, ra, False, errors_)
 
             else:
                     
-                if range_[0] == range_[1]:
-                    if type(val) == list:
-                        range_ = (min(val), max(val))
-                    else:
-                        range_ = (val.min(), val.max())
+                if not isBinned(val) and range_[0] == range_[1]:
+                    range_ = valueRange(val)
                 
-                self.axes[n,m].hist(val, histtype=histtype_, color=color_, bins=bins_, label=label_, density=density_, range=range_)
+                self._hist(self.axes[n,m], val, histtype_, bins_, color_, label_, range_, density_, errors_)
 
             if ret:
                 return self.figure, self.axes
 
-        def scatter(self, val, n=1, m=1, label_="scatter", color_='fuchsia', alpha=1, ret=False, marker_='o'):
+        def _hist(self, ax, val, histtype_, bins_, color_, label_, range_, density_, errors_):
+            """
+                Draw one histogram on ax, see hist
+            """
+            if not isBinned(val):
+                ax.hist(val, histtype=histtype_, bins=bins_, color=color_, label=label_, density=density_, range=range_)
+                return
+
+            edges, counts, errors = binnedArrays(val)
+            if density_:
+                area = np.sum(counts*np.diff(edges))
+                scale = 1./area if area else 0.
+                counts = counts*scale
+                if errors is not None: errors = errors*scale
+
+            ax.stairs(counts, edges, fill=histtype_ != 'step', color=color_, label=label_)
+            if errors_ and errors is not None:
+                ax.errorbar(0.5*(edges[1:] + edges[:-1]), counts, yerr=errors, fmt='none', ecolor=color_)
+
+        def scatter(self, val, n=1, m=1, label_="scatter", color_='fuchsia', alpha=1, ret=False, marker_='o', raster_=100000, grid_=200, log_=False, cmap_='viridis'):
 
             """
                 Plot scatter on subplots. Different ways to plot:
@@ -114,9 +158,15 @@ class Plotter:
                 alpha: trasparency. By default = 1, can be a list of the same dimension of val
                 ret: if you want current figure or axis after plot
                 marker_: marker for the scatter. Default is 'o', can be a list of the same dimension of val
+                raster_: above this number of points the scatter is drawn as a density image: the points are counted in a grid_ x grid_
+                        grid and the grid is drawn with imshow, so that time and size of the output do not depend on the number of points.
+                        By default 100000, None to always draw the markers, 0 to always draw the density
+                grid_: number of cells per axis of the density image, int or (nx, ny). By default 200
+                log_: logarithmic color scale of the density image. By default False
+                cmap_: colormap of the density image, empty cells are transparent. By default 'viridis'
             """
             
-            if isinstance(val[0],(list,pd.core.series.Series,np.ndarray)):
+            if isinstance(val[0],(list,np.ndarray)) or isSeries(val[0]):
 
                 if not isinstance(label_, list):
                     label_ = [label_]*len(val)
@@ -131,14 +181,28 @@ class Plotter:
                     color_ = [color_]*len(val)
 
                 for v, ax, al, col, lab, m in zip(val, self.axes.flat, alpha, color_, label_, marker_ ):
-                    ax.scatter(v[0], v[1], marker=m, color=col, alpha=al, label=lab)
+                    if raster_ is not None and len(v[0]) > raster_:
+                        self._density(ax, v[0], v[1], grid_, log_, cmap_, al)
+                    else:
+                        ax.scatter(v[0], v[1], marker=m, color=col, alpha=al, label=lab)
 
             else:
-                self.axes[n,m].scatter(val[0], val[1], color=color_, label=label_)
+                if raster_ is not None and len(val[0]) > raster_:
+                    self._density(self.axes[n,m], val[0], val[1], grid_, log_, cmap_, alpha)
+                else:
+                    self.axes[n,m].scatter(val[0], val[1], color=color_, label=label_)
 
             if ret:
                 return self.figure, self.axes
 
+        def _density(self, ax, x, y, grid_, log_, cmap_, alpha):
+            """
+                Draw the points as a density image on ax, see scatter
+            """
+            counts, extent = densityGrid(x, y, grid_)
+            counts = np.ma.masked_equal(counts, 0) #empty cells are not painted
+            ax.imshow(counts, origin='lower', extent=extent, aspect='auto', interpolation='nearest', cmap=cmap_, norm='log' if log_ else None, alpha=alpha)
+
         def xLabel(self, lab, n=1, m=1, s=13, all_=False):
             """
                 Label the x axis of the subplots.
@@ -274,9 +338,160 @@ class Plotter:
                 Save current figure
                 output: output path for figure by default "./subplots.png"
             """
-            self.fig.savefig(output)
+            self.figure.savefig(output)
+
+        def close(self):
+            """
+                Free the figure, to be called when many figures are produced
+            """
+            plt.close(self.figure)
+
+    class RenderQueue:
+        """
+            Produce many SubPlots figures: specs (see SubPlots.fromSpec, plus "output": path of the file) are built,
+            rasterized and saved on a pool of processes with the Agg backend, so that the production scales with the cores.
+            Use as
+                with Plotter.RenderQueue(workers=4) as q:
+                    for ...: q.submit(spec)
+                files = q.results
+        """
+
+        def __init__(self, workers=1, max_pending=None):
+            """
+                workers: number of processes. By default 1, the figures are rendered in this process at submit
+                max_pending: maximum number of specs sent and not yet saved, submit waits when reached so that the data
+                        of the specs do not pile up in memory. By default 2*workers
+            """
+            self.workers = workers
+            self.max_pending = max_pending if max_pending is not None else 2*workers
+            assert self.max_pending >= 1, "[ERROR] max_pending must be at least 1"
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_initRender) if workers > 1 else None
+            self.pending = set()
+            self.futures = []
+            self.results = []
+
+        def submit(self, spec):
+            """
+                Queue a figure. spec: see SubPlots.fromSpec, with "output": path where the figure is saved
+            """
+            _checkSpec(spec)
+            assert "output" in spec, "[ERROR] spec without output"
+            if self.pool is None:
+                self.results.append(renderSpec(spec))
+                return
 
+            #ROOT histograms travel to the processes as arrays
+            spec = dict(spec, panels=[dict(panel, val=_portable(panel["val"])) if panel["method"] == "hist" and "val" in panel else panel
+                                      for panel in spec.get("panels", [])])
 
+            while len(self.pending) >= self.max_pending:
+                done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+                for f in done: f.result() #raise errors of the processes as soon as possible
+            future = self.pool.submit(renderSpec, spec)
+            self.pending.add(future)
+            self.futures.append(future)
+
+        def wait(self):
+            """
+                Wait for all the queued figures. Returns the list of saved files, in order of submission
+            """
+            self.results += [f.result() for f in self.futures]
+            self.futures = []
+            self.pending = set()
+            return self.results
+
+        def close(self):
+            """
+                Wait for the queued figures and stop the processes
+            """
+            try:
+                self.wait()
+            finally:
+                if self.pool is not None: self.pool.shutdown()
+                self.pool = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            if exc[0] is not None and self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+                self.pool = None
+                return False
+            self.close()
+            return False
+
+
+
+    class CanvasPool:
+        """
+            ROOT canvases reused from one plot to the next instead of being created and destroyed for each plot.
+            get returns a cleared canvas among at most size canvases of the same geometry (the least recently used one
+            once they all exist): it is meant for plots saved before the next get, as in exportByName, and its canvases and
+            legends must not be handed to the caller. Canvases returned to the caller come from new and are never reused.
+            Texts are built once and drawn again on all the canvases
+        """
+
+        def __init__(self, size=2):
+            """
+                size: number of canvases kept per geometry (x_dim, y_dim, reso). By default 2
+            """
+            assert size >= 1, "[ERROR] size of the pool must be at least 1"
+            self.size = size
+            self.canvases = {} #(x_dim, y_dim, reso, batch) -> list of TCanvas, least recently used first
+            self.latex = {} #(x, y, text) -> TLatex in NDC coordinates
+            self.legends = {} #location -> TLegend
+
+        def new(self, title, x_dim=1000, y_dim=700, reso=1000):
+            """
+                Canvas not managed by the pool, with a unique name so that it does not replace the canvases of other plots
+            """
+            return ROOT.TCanvas("HEPPlotter_c{}".format(next(_CANVAS_IDS)), title, reso, reso, x_dim, y_dim)
+
+        def get(self, x_dim=1000, y_dim=700, reso=1000):
+            """
+                Cleared canvas of the pool, current pad for the next Draw
+            """
+            canvases = self.canvases.setdefault((x_dim, y_dim, reso, ROOT.gROOT.IsBatch()), [])
+            if len(canvases) < self.size:
+                c = self.new("c", x_dim, y_dim, reso)
+            else:
+                c = canvases.pop(0)
+                c.Clear() #primitives drawn by the pool are not deleted, histograms belong to their owners
+            canvases.append(c)
+            c.cd()
+            return c
+
+        def drawTexts(self, texts):
+            """
+                Draw texts [[(x, y), text], ...] (see RooPlot.addText) on the current pad
+            """
+            for coord, text in texts:
+                key = (coord[0], coord[1], text)
+                if key not in self.latex:
+                    T = ROOT.TLatex(coord[0], coord[1], text)
+                    T.SetNDC()
+                    self.latex[key] = T
+                self.latex[key].Draw()
+
+        def legend(self, loc, create):
+            """
+                Legend at location loc without entries, made by create(loc) the first time
+            """
+            key = tuple(loc) if isinstance(loc, list) else loc
+            if key in self.legends:
+                self.legends[key].Clear()
+            else:
+                self.legends[key] = create(loc)
+            return self.legends[key]
+
+        def close(self):
+            """
+                Delete the canvases of the pool
+            """
+            for canvases in self.canvases.values():
+                for c in canvases: c.Close()
+            self.canvases = {}
 
     class RooPlot:
         """
@@ -290,6 +505,7 @@ class Plotter:
                 namedhistos: dict of named ROOT.TH1F to be filled
                 keys: list of names of the above
                 texts: list of text to be plotted on canvas as ROOT.TLatex
+                canvases: Plotter.CanvasPool of the canvases reused by exportByName
             """
 
             self.histos = []
@@ -298,6 +514,7 @@ class Plotter:
             self.keys = []
             self.texts = []
             self.legend_list = []
+            self.canvases = Plotter.CanvasPool()
 
         def getKeys(self):
             return self.keys
@@ -354,17 +571,25 @@ class Plotter:
             print(self.namedhistos)
 
         
-        def histFromRoot(self, path, tree, named=True, bins_ = 30, linestyle=1, linecolor = ROOT.kBlack, fillcolor = 0, fillstyle = 0, ranges=False ):
-            """
-
-            """
-
-            f = ROOT.TFile(path)
-            t = f.Get(tree)
-
-            branch_names = [i.GetName() for i in t.GetListOfBranches()] #branch names
-
-            f.Close()
+        def histFromRoot(self, path, tree, named=True, bins_ = 30, linestyle=1, linecolor = kBlack, fillcolor = 0, fillstyle = 0, ranges=False, workers=1, chunksize=None, autorange='exact', cache=False, selection=None, weights=None, backend=None ):
+            """
+                Fill self.namedhistos with the branches of a tree. If self.keys is empty all the branches are filled.
+                path: path to the .root file
+                tree: name of the tree inside the file such as "SaveAllJets/Jets"
+                named: fill self.namedhistos. By default True
+                bins_, linestyle, linecolor, fillcolor, fillstyle, ranges: see hist method, pairwise with self.keys
+                workers: number of processes filling the chunks of the file in parallel. By default 1
+                chunksize: split the tree in entry ranges of chunksize events, filled separately and merged. By default None
+                autorange: how ranges taken from the data are found: 'exact', 'stream' or (low, high) quantiles, see RootHisto.fillROOT
+                cache: serve the histograms from the on disk cache if already filled, see RootHisto.fillROOT. By default False
+                selection: C++ expression such as "pt > 30 && abs(eta) < 2.4", only passing events (or vector elements) are
+                        histogrammed, see RootHisto.fillROOT. By default None
+                weights: branch or C++ expression with the weight of each event such as "genWeight*puWeight", see
+                        RootHisto.fillROOT. By default None, unweighted
+                backend: 'root' or 'uproot', backend reading the file (see Reader.setBackend). By default the global one
+            """
+
+            branch_names = branchNames(path, tree, backend) #branch names
 
             if named:
                 if len(self.keys) == 0:
@@ -388,54 +613,66 @@ class Plotter:
                 if ranges:
                     if len(ranges) != len(self.keys):
                         sys.exit("Number of ranges must be equal to number of variables being plotted")
-
-                idx = 0
+                else:
+                    ranges = ['all']*len(self.keys)
 
                 print("...Filling Named Histograms")
 
-                for branch, fc, fs, lc, ls, b in zip(self.keys, fillcolor, fillstyle, linecolor, linestyle, bins_):
-                    f = ROOT.TFile(path)
-                    t = f.Get(tree)
-                    var = []
-                    print("@Filling: ", branch)
-                    #filling single variables = multiple scan of tree but less memory employment -> Quicker
-                    #appending to list to list [[event1], [event2], ...] takes O(1) while appending everything 
-                    #into one list [1,2,3,...] makes everything very expensive.
-                    var = []
-                    for event in t:
-                        try:
-                            var.append(list(getattr(event, branch)))
-                        except:
-                            var.append([getattr(event, branch)])
-
-                    var = [item for sublist in var for item in sublist]
+                #one traversal of the tree for all the keys (or one per chunk)
+                binned = fillFiles([(path, tree, 'all', list(self.keys), bins_, ranges, selection, weights)], workers, chunksize, autorange, getCache(cache), backend=backend)[0]
 
-                    f.Close()
-
-                    if ranges == False:
-                        r = [min(var), max(var)]
-
-                    else:
-                        if ranges[idx] == 'all':
-                            r = [min(var), max(var)]
-                        else:
-                            r = ranges[idx]
-
-                    max_, min_ = r[1], r[0]
-                    h = ROOT.TH1F(branch, branch, b, min_, max_)
+                for branch, fc, fs, lc, ls in zip(self.keys, fillcolor, fillstyle, linecolor, linestyle):
+                    print("@Filling: ", branch)
+                    h = binned.pop(branch).toTH1F(branch)
                     h.SetFillStyle(fs)
                     h.SetFillColor(fc)
                     h.SetLineColor(lc)
                     h.SetLineStyle(ls)
-                    for value in var:
-                        h.Fill(value)
-                    
             
                     self.namedhistos[branch] = h
 
-                    idx += 1
+        def histNDFromRoot(self, path, tree, variables, bins_=30, ranges=False, sparse=False, selection=None, weights=None, backend=None):
+            """
+                Fill self.namedhistos with multi-dimensional histograms (TH2F, TH3F or THnSparseD) of the branches of a tree,
+                all of them filled in a single read of the file. Keys are "x:y" or "x:y:z" and are added to self.keys.
+                path: path to the .root file
+                tree: name of the tree inside the file such as "SaveAllJets/Jets"
+                variables: list of tuples of branches such as [("pt", "eta")], the first branch on the x axis
+                bins_: int (all the axes) or list pairwise with variables of int or list of int (one per axis)
+                ranges: list pairwise with variables of lists of [min, max] or 'all' (one per axis). By default False, all
+                        the ranges from the data
+                sparse: THnSparseD keeping only the filled cells instead of TH2F/TH3F. Forced for more than 3 variables
+                selection, weights, backend: see histFromRoot
+            """
+            if not isinstance(bins_, list):
+                bins_ = [bins_]*len(variables)
+            if not ranges:
+                ranges = [['all']*len(var) for var in variables]
+            if len(bins_) != len(variables) or len(ranges) != len(variables):
+                sys.exit("Number of bins and ranges must be equal to number of variables being plotted")
+
+            bins_ = [b if isinstance(b, list) else [b]*len(var) for b, var in zip(bins_, variables)]
+            sparse = [sparse or len(var) > 3 for var in variables]
+
+            print("...Filling Named Multi-dimensional Histograms")
+            binned = fillFilesND([(path, tree, 'all', [tuple(var) for var in variables], bins_, ranges, selection, weights, sparse)], backend=backend)[0]
+
+            for var, b, s in zip(variables, binned, sparse):
+                key = ":".join(var)
+                print("@Filling: ", key)
+                if s:
+                    h = b.toTHnSparse("_".join(var))
+                    axes = [h.GetAxis(i) for i in range(len(var))]
+                else:
+                    h = b.toTH("_".join(var))
+                    axes = [h.GetXaxis(), h.GetYaxis(), h.GetZaxis()]
+                for axis, branch in zip(axes, var):
+                    axis.SetTitle(branch)
+
+                self.namedhistos[key] = h
+                if key not in self.keys: self.keys.append(key)
 
-        def hist(self, val, name, named=False, bins_=30, linestyle = 1, linecolor = ROOT.kBlack, fillcolor = 0, fillstyle = 0, ranges=False ):
+        def hist(self, val, name, named=False, bins_=30, linestyle = 1, linecolor = kBlack, fillcolor = 0, fillstyle = 0, ranges=False, weights=None ):
             """
                 Method to fill ROOT.TH1F histograms. Works for both self.histos and self.namedhistos as follows:
                 val: single list or nested list/np.array/pd.Series with arrays to be histogrammed.
@@ -450,23 +687,31 @@ class Plotter:
                 fillstyle: FillStyle of TH1F. Default = 0, can be a list like [0, 30003, 3004, ...] of same dimension of val dimension.
                 ranges: X axis range for histograms. By default range = (min(v), max(v)) for every item in v, but can be a list like [(0,100), (0,400), ...]
                         of the same dimension of val dimension, if 'all' in list then the range in that position will be (minn(val), max(val))
+                weights: weights of the values, same structure as val (an array for a single histo, a list of arrays or None
+                        pairwise with val otherwise). Histograms keep the sum of squared weights for the errors. By default None
 
             """
+            nested = isinstance(val[0], (list,np.ndarray)) or isSeries(val[0])
+            if nested and weights is None:
+                weights = [None]*len(val)
+            elif nested and len(weights) != len(val):
+                sys.exit("Number of weights must be equal to number of variables being plotted")
+
 
             if ranges == False:
                 ranges = []
                 for v in val:
-                    ranges.append([min(v), max(v)])
+                    ranges.append(list(valueRange(v)))
             else:
                 if len(ranges) != len(val):
                     sys.exit("Number of ranges must be equal to number of variables being plotted")
                 else:
                     ind = [i for i,x in enumerate(ranges) if x == 'all']
                     for i in ind:
-                        ranges[i] = [min(val[i]), max(val[i])]
+                        ranges[i] = list(valueRange(val[i]))
 
             if not named: #if not named then just fill self.histos, otherwise fill the dict
-                if isinstance(val[0], (list,pd.core.series.Series,np.ndarray)):
+                if isinstance(val[0], (list,np.ndarray)) or isSeries(val[0]):
 
                     if not isinstance(linecolor, list):
                         linecolor = [linecolor]*len(val)
@@ -487,15 +732,14 @@ class Plotter:
                         print("...Same Names for multiple TH1F possible memory leaks. Suggestying name = []")
                         name = [name]*len(val)
                         
-                    for v, n, fc, fs, lc, ls, r, b in zip(val, name, fillcolor, fillstyle, linecolor, linestyle, ranges, bins_):
+                    for v, n, fc, fs, lc, ls, r, b, w in zip(val, name, fillcolor, fillstyle, linecolor, linestyle, ranges, bins_, weights):
                         max_, min_ = r[1], r[0]
                         h = ROOT.TH1F(n, n, b, min_, max_)
                         h.SetFillStyle(fs)
                         h.SetFillColor(fc)
                         h.SetLineColor(lc)
                         h.SetLineStyle(ls)
-                        for value in v:
-                            h.Fill(value)
+                        bulkFill(h, v, w)
                         
                         self.histos.append(h)
                 else:
@@ -505,8 +749,7 @@ class Plotter:
                     h.SetFillColor(fillcolor)
                     h.SetLineColor(linecolor)
                     h.SetLineStyle(linestyle)
-                    for value in val:
-                        h.Fill(value)
+                    bulkFill(h, val, weights)
                     
                     self.histos.append(h)
 
@@ -514,7 +757,7 @@ class Plotter:
                 if len(self.keys) == 0:
                     sys.exit("First fill the keys using namedHistos(self, names) function")
 
-                if isinstance(val[0], (list,pd.core.series.Series,np.ndarray)):
+                if isinstance(val[0], (list,np.ndarray)) or isSeries(val[0]):
 
                     if not isinstance(linecolor, list):
                         linecolor = [linecolor]*len(val)
@@ -534,15 +777,14 @@ class Plotter:
                     if not isinstance(name, list):
                         sys.exit("You cannot require multiple histograms with same names while filling with named=True. Switch to name=False")
 
-                    for v, n, fc, fs, lc, ls, r, b in zip(val, name, fillcolor, fillstyle, linecolor, linestyle, ranges, bins_):
+                    for v, n, fc, fs, lc, ls, r, b, w in zip(val, name, fillcolor, fillstyle, linecolor, linestyle, ranges, bins_, weights):
                         max_, min_ = r[1], r[0]
                         h = ROOT.TH1F(n, n, b, min_, max_)
                         h.SetFillStyle(fs)
                         h.SetFillColor(fc)
                         h.SetLineColor(lc)
                         h.SetLineStyle(ls)
-                        for value in v:
-                            h.Fill(value)
+                        bulkFill(h, v, w)
                         
                         self.namedhistos[n] = h
                 else:
@@ -552,8 +794,7 @@ class Plotter:
                     h.SetFillColor(fillcolor)
                     h.SetLineColor(linecolor)
                     h.SetLineStyle(linestyle)
-                    for value in val:
-                        h.Fill(value)
+                    bulkFill(h, val, weights)
                     
                     self.namedhistos[name] = h
                 
@@ -706,26 +947,20 @@ class Plotter:
             if not same:
                 canvas = []
                 for ind, h in enumerate(self.histos):
-                    c = ROOT.TCanvas("c"+str(ind), "c"+str(ind), reso, reso, x_dim, y_dim)
+                    c = self.canvases.new("c"+str(ind), x_dim, y_dim, reso)
                     h.Draw("hist")
-                    if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                    self.canvases.drawTexts(self.texts)
                     c.Draw()
                     canvas.append(c)
                 return canvas
             else:
-                c = ROOT.TCanvas("c", "c", reso, reso, x_dim, y_dim)
+                c = self.canvases.new("c", x_dim, y_dim, reso)
                 for ind, h in enumerate(self.histos):
                     if ind == 0:
                         h.Draw("hist")
                     else:
                         h.Draw("hist same")
-                if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                self.canvases.drawTexts(self.texts)
                 c.Draw()
                 return c
 
@@ -741,7 +976,7 @@ class Plotter:
                 legend_: do you want to plot the legend on the canvas? if same one big legend in not same
                         all canvases will have its own legend. Specify in input the position of the legend ex: legend_= "upper center"
                         or legend_ = ( , , , ).
-
+                Every call creates new canvases, with unique names. To save many plots see exportByName
             """
             if 'all' in names:
                 names = self.keys
@@ -750,15 +985,13 @@ class Plotter:
                 if not same and not divide:
                     canvas = []
                     for n in names:
-                        c = ROOT.TCanvas("c"+str(n), "c"+str(n), reso, reso, x_dim, y_dim)
+                        c = self.canvases.new("c"+str(n), x_dim, y_dim, reso)
                         if legend_: 
                             self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
                             self.AddEntry(self.namedhistos[n], n)
+                            self.legend_list.append(self.legend) #alive as long as its canvas
                         self.namedhistos[n].Draw("hist")
-                        if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                        self.canvases.drawTexts(self.texts)
                         
                         if legend_:
                             self.legend.Draw()
@@ -767,18 +1000,16 @@ class Plotter:
                     return canvas
 
                 elif not same and divide:
-                    c = ROOT.TCanvas("c", "c", reso, reso, x_dim, y_dim)
+                    c = self.canvases.new("c", x_dim, y_dim, reso)
                     c.Divide(divide[0], divide[1])
                     for i,n in enumerate(names):
                         c.cd(i+1)
                         if legend_: 
                             self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
                             self.AddEntry(self.namedhistos[n], n)
+                            self.legend_list.append(self.legend)
                         self.namedhistos[n].Draw("hist")
-                        if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                        self.canvases.drawTexts(self.texts)
                         
                         if legend_:
                             self.legend.Draw()
@@ -787,8 +1018,10 @@ class Plotter:
                     return c
 
                 elif same and not divide:
-                    c = ROOT.TCanvas("c", "c", reso, reso, x_dim, y_dim)
-                    if legend_: self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
+                    c = self.canvases.new("c", x_dim, y_dim, reso)
+                    if legend_:
+                        self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
+                        self.legend_list.append(self.legend) #alive as long as its canvas
                     for ind, n in enumerate(names):
                         if ind == 0:
                             self.namedhistos[n].Draw("hist")
@@ -796,10 +1029,7 @@ class Plotter:
                         else:
                             self.namedhistos[n].Draw("hist same")
                             if legend_: self.AddEntry(self.namedhistos[n], n)
-                    if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                    self.canvases.drawTexts(self.texts)
 
                     if legend_:
                         self.legend.Draw()
@@ -810,7 +1040,7 @@ class Plotter:
                     if len(same) != divide[0]*divide[1]:
                         sys.exit("One pad left black, suggesting to check dimensions")
 
-                    c = ROOT.TCanvas("c", "c", reso, reso, x_dim, y_dim)
+                    c = self.canvases.new("c", x_dim, y_dim, reso)
                     c.Divide(divide[0], divide[1])
                     leg_idx = 0
                     for key, n in zip(same.keys(), same.values()): #here key is the subplot and values are named histos we want to plot on same
@@ -826,10 +1056,7 @@ class Plotter:
                                 self.namedhistos[n_].Draw("hist same")
                                 leg.AddEntry(self.namedhistos[n_], n_)
                         
-                        if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                        self.canvases.drawTexts(self.texts)
 
                         self.legend_list.append(leg)
                         if legend_:
@@ -843,8 +1070,10 @@ class Plotter:
                     return c   
 
                 else:
-                    c = ROOT.TCanvas("c", "c", reso, reso, x_dim, y_dim)
-                    if legend_: self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
+                    c = self.canvases.new("c", x_dim, y_dim, reso)
+                    if legend_:
+                        self.createLegend(legend_) #create legend, here legend_ = (,,,) coordinates
+                        self.legend_list.append(self.legend) #alive as long as its canvas
                     for ind, n in enumerate(names):
                         if ind == 0:
                             self.namedhistos[n].Draw("hist")
@@ -852,10 +1081,7 @@ class Plotter:
                         else:
                             self.namedhistos[n].Draw("hist same")
                             if legend_: self.AddEntry(self.namedhistos[n], n)
-                    if len(self.texts) != 0:
-                            for coord, text in self.texts:
-                                T = ROOT.TLatex()
-                                T.DrawLatexNDC(coord[0], coord[1], text)
+                    self.canvases.drawTexts(self.texts)
 
                     if legend_:
                         self.legend.Draw()
@@ -863,6 +1089,67 @@ class Plotter:
                     return c
 
 
+        def exportByName(self, names='all', output="./", formats="png", x_dim=1000, y_dim=700, reso=1000, legend_=False, workers=1, batch=True):
+            """
+                Streaming version of plotByName(same=False, divide=False) to produce many plots: every histogram of
+                self.namedhistos is drawn, saved and cleared from a canvas of self.canvases reused for all the plots, so that
+                no canvas is created per plot. Returns the list of written files.
+                names: list of keys to be plot. if 'all' in names then all self.keys() will  be plotted.
+                output: directory where the plots are saved as <name>.<format>, created if missing. By default "./"
+                formats: str or list of formats among EXPORT_FORMATS such as ["png", "pdf", "svg"]. By default "png"
+                x_dim, y_dim, reso, legend_: see plotByName
+                workers: number of processes drawing disjoint subsets of names in parallel. The histograms are sent
+                        to the processes as arrays (see Store.histoToArrays): TH1, TH2 and TH3 of any type but TProfile.
+                        The other objects (TProfile, THnSparse, TGraph, ...) are drawn in this process meanwhile.
+                        By default 1, everything runs in this process
+                batch: draw in batch mode, without opening windows. By default True
+            """
+            if not isinstance(names, list): names = [names]
+            if 'all' in names: names = self.keys
+            if not isinstance(formats, list): formats = [formats]
+            assert all(n in self.namedhistos for n in names), "[ERROR] names not present in namedhistos, check consistency"
+            assert all(f in EXPORT_FORMATS for f in formats), "[ERROR] formats must be in {}".format(EXPORT_FORMATS)
+            os.makedirs(output, exist_ok=True)
+
+            options = {"output": output, "formats": formats, "x_dim": x_dim, "y_dim": y_dim, "reso": reso, "legend_": legend_}
+            shipped = [n for n in names if arrayable(self.namedhistos[n])]
+            local = [n for n in names if not arrayable(self.namedhistos[n])]
+            if workers <= 1 or len(names) <= 1 or not shipped:
+                with batchMode(batch):
+                    return self._export(names, **options)
+
+            chunks = [shipped[i::workers] for i in range(min(workers, len(shipped)))]
+            jobs = [([(n, histoToArrays(self.namedhistos[n])) for n in chunk], self.texts, options) for chunk in chunks]
+            print("...Exporting {} plots on {} processes".format(len(names), len(jobs) + bool(local)))
+            with ProcessPoolExecutor(max_workers=len(jobs), initializer=_initExport, initargs=(batch, ROOT.gStyle.GetOptStat())) as pool:
+                done = pool.map(_exportJob, jobs)
+                if local:
+                    with batchMode(batch):
+                        self._export(local, **options)
+                list(done)
+
+            return [os.path.join(output, "{}.{}".format(n, f)) for n in names for f in formats]
+
+        def _export(self, names, output, formats, x_dim, y_dim, reso, legend_):
+            """
+                Draw, save and free one canvas per name, see exportByName
+            """
+            files = []
+            for n in names:
+                c = self.canvases.get(x_dim, y_dim, reso) #cleared canvas, only the draw costs per plot
+                if legend_:
+                    self.legend = self.canvases.legend(legend_, lambda loc: self.createLegend(loc, ret=True))
+                    self.AddEntry(self.namedhistos[n], n)
+                self.namedhistos[n].Draw("hist")
+                self.canvases.drawTexts(self.texts)
+                if legend_:
+                    self.legend.Draw()
+
+                for f in formats:
+                    files.append(os.path.join(output, "{}.{}".format(n, f)))
+                    c.SaveAs(files[-1])
+            return files
+
         def getHistos(self, n=0, all_=False):
             """
                 Get self.histos by index
@@ -946,4 +1233,119 @@ class Plotter:
                     if not isinstance(scale, list): scale = [scale]
                     for key, s in zip(name, scale):
                         self.namedhistos[key].Scale(1./s)
-    
\ No newline at end of file
+    
+
+
+@contextlib.contextmanager
+def batchMode(batch=True):
+    """
+        Draw ROOT canvases in batch mode (no window) inside the block, without the info message of every saved file
+    """
+    previous = ROOT.gROOT.IsBatch(), ROOT.gErrorIgnoreLevel
+    ROOT.gROOT.SetBatch(batch or previous[0])
+    ROOT.gErrorIgnoreLevel = max(previous[1], ROOT.kWarning)
+    try:
+        yield
+    finally:
+        ROOT.gROOT.SetBatch(previous[0])
+        ROOT.gErrorIgnoreLevel = previous[1]
+
+
+def _initExport(batch, optstat):
+    ROOT.gROOT.SetBatch(batch)
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning
+    ROOT.gStyle.SetOptStat(optstat)
+
+
+def _exportJob(job):
+    """
+        Export a subset of the names on a process of the pool, see RooPlot.exportByName
+    """
+    items, texts, options = job
+    r = Plotter.RooPlot()
+    r.texts = texts
+    for name, (arrays, meta) in items:
+        r.namedhistos[name] = histoFromArrays(arrays, meta)
+    return r._export([name for name, _ in items], **options)
+
+
+def isBinned(val):
+    """
+        True if val is an already binned histogram: a ROOT TH1 or a BinnedHisto
+    """
+    return hasattr(val, "GetNbinsX") or isinstance(val, BinnedHisto)
+
+
+def binnedArrays(val):
+    """
+        Return BinnedHisto(edges, counts, errors) of np.ndarray of a binned histogram (see isBinned), without under/overflow.
+        errors is None if a BinnedHisto without errors is given
+    """
+    if hasattr(val, "GetNbinsX"):
+        assert val.GetDimension() == 1 and not val.InheritsFrom("TProfile"), "[ERROR] {} ({}) is not a one dimensional histogram".format(val.GetName(), val.ClassName())
+        counts = contentView(val)[1:-1].astype(np.float64)
+        sumw2 = sumw2View(val)[1:-1] if val.GetSumw2N() else np.abs(counts)
+        return BinnedHisto(axisEdges(val.GetXaxis()), counts, np.sqrt(sumw2))
+
+    edges = np.asarray(val.edges, dtype=np.float64)
+    counts = np.asarray(val.counts, dtype=np.float64)
+    assert len(edges) == len(counts) + 1, "[ERROR] a BinnedHisto needs one edge more than counts"
+    errors = np.asarray(val.errors, dtype=np.float64) if val.errors is not None else None
+    return BinnedHisto(edges, counts, errors)
+
+
+def densityGrid(x, y, grid=200):
+    """
+        Count the points (x, y) in a grid covering their range, with one vectorized bincount.
+        Arguments:
+        x, y: list/np.ndarray/pd.Series of coordinates, points with a nan or infinite coordinate are dropped
+        grid: number of cells per axis, int or (nx, ny)
+
+        Returns the counts as np.ndarray of shape (ny, nx) (rows along y, as drawn by imshow with origin='lower')
+        and the extent (xmin, xmax, ymin, ymax) of the grid
+    """
+    nx, ny = (grid, grid) if np.ndim(grid) == 0 else grid
+    x, y = toArray(x), toArray(y)
+    assert len(x) == len(y), "[ERROR] x and y have different dimensions"
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all(): x, y = x[finite], y[finite]
+    if len(x) == 0: return np.zeros((ny, nx)), (0., 1., 0., 1.)
+
+    extent = []
+    cells = np.zeros(len(x), dtype=np.int64)
+    for v, nbins, stride in ((x, nx, 1), (y, ny, nx)):
+        low, high = v.min(), v.max()
+        if high == low: low, high = low - 0.5, high + 0.5
+        bins = ((v - low)*(nbins/(high - low))).astype(np.int64)
+        cells += stride*np.minimum(bins, nbins - 1) #the maximum goes in the last cell
+        extent += [low, high]
+
+    counts = np.bincount(cells, minlength=nx*ny).reshape(ny, nx)
+    return counts.astype(np.float64), tuple(extent)
+
+
+def _portable(val):
+    if hasattr(val, "GetNbinsX"): return binnedArrays(val)
+    if isinstance(val, list): return [_portable(v) for v in val]
+    return val
+
+
+def _checkSpec(spec):
+    assert "grid" in spec and len(spec["grid"]) == 2, "[ERROR] spec needs the grid (n, m) of the subplots"
+    for panel in spec.get("panels", []):
+        assert panel.get("method") in PANEL_METHODS, "[ERROR] method of panel must be in {}".format(PANEL_METHODS)
+
+
+def _initRender():
+    import matplotlib
+    matplotlib.use("Agg", force=True) #no display in the processes of the pool
+
+
+def renderSpec(spec):
+    """
+        Build the figure of spec (see Plotter.SubPlots.fromSpec), save it in spec["output"] and free it. Returns the output path
+    """
+    s = Plotter.SubPlots.fromSpec(spec)
+    s.save(spec["output"])
+    s.close()
+    return spec["output"]